@@ -55,6 +55,12 @@ MIDDLEWARE_CLASSES = [
 
 ROOT_URLCONF = 'ifti.urls'
 
+FILE_UPLOAD_HANDLERS = [
+    'imageboard.uploadhandlers.UploadLimitHandler',
+    'imageboard.uploadhandlers.HashingMemoryFileUploadHandler',
+    'imageboard.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -0,0 +1,118 @@
+"""
+Latest activity feed for Pifti
+
+The feed is held in the cache as a bounded list of compact tuples, newest
+first, and is updated in place as posts and comments are created. Page numbers
+are resolved when the feed is read, using the post rank index.
+"""
+from collections import namedtuple
+
+from django.apps import apps
+
+from imageboard import caching
+from imageboard.ranking import get_post_page
+
+ACTIVITY_KEY = 'activity'
+ACTIVITY_TIMEOUT = 3600
+
+POST = 'post'
+COMMENT = 'comment'
+
+Activity = namedtuple('Activity', 'kind id post_id created title username')
+"""
+A single feed item. For comments `title` is the title of the parent post.
+"""
+
+
+def activity_max():
+    """
+    Returns the longest activity list a user may request.
+    """
+    UserProfile = apps.get_model('imageboard', 'UserProfile')
+    return max(UserProfile.ACTIVITY_CHOICES)[0]  # [int, str]
+
+def get_activity(pagination, count):
+    """ Retrieve the latest activity list
+
+    Args:
+        pagination: integer representing the user's post count profile option
+        count: integer representing the number of items to return
+
+    Returns:
+        A list of dictionaries for the latest posts and comments, annotated
+        with the page number of the post they belong to
+    """
+    # Generate cache if not set or expired, by a single worker
+    activity = caching.get_or_generate(ACTIVITY_KEY, generate_activity,
+                                       ACTIVITY_TIMEOUT)
+
+    return [dict(a._asdict(), post_page=get_post_page(a.post_id, pagination))
+            for a in activity[:count]]
+
+def generate_activity():
+    """ Generates the latest activity list
+
+    Returns:
+        A list of Activity tuples, newest first
+    """
+    Post = apps.get_model('imageboard', 'Post')
+    Comment = apps.get_model('imageboard', 'Comment')
+    limit = activity_max()
+
+    # Retrieve the latest posts and comments
+    posts = Post.objects.order_by('-id').values_list(
+        'id', 'created', 'title', 'user__username')[:limit]
+    comments = Comment.objects.order_by('-id').values_list(
+        'id', 'post_id', 'created', 'post__title', 'user__username')[:limit]
+
+    activity = [Activity(POST, i, i, c, t, u) for i, c, t, u in posts]
+    activity += [Activity(COMMENT, i, p, c, t, u) for i, p, c, t, u in comments]
+
+    # Sort both lists together, via latest date
+    activity.sort(key=lambda a: a.created, reverse=True)
+    return activity[:limit]
+
+def push_activity(item):
+    """ Add a new item to the front of the cached activity list
+
+    If the list is not cached it is left to be generated on the next read,
+    which will include the new item. Concurrent updates are applied one at a
+    time, so no item is lost.
+
+    Args:
+        item: Activity tuple
+
+    Returns:
+        None
+    """
+    caching.update(ACTIVITY_KEY, lambda activity: [item] + activity[:activity_max() - 1],
+                   ACTIVITY_TIMEOUT)
+
+def remove_activity(kind, id):
+    """ Remove a deleted post or comment from the cached activity list
+
+    Removing an item leaves a gap which can only be filled from the database,
+    so the list is marked stale and generated again on the next read.
+
+    Args:
+        kind: POST or COMMENT
+        id: integer representing the internal post or comment ID
+
+    Returns:
+        None
+    """
+    def remove(activity):
+        for a in activity:
+            if (a.kind == kind and a.id == id) or (kind == POST and a.post_id == id):
+                return None
+        return activity
+
+    caching.update(ACTIVITY_KEY, remove, ACTIVITY_TIMEOUT)
+
+def post_activity(post):
+    return Activity(POST, post.id, post.id, post.created, post.title,
+                    post.user.username)
+
+def comment_activity(comment):
+    return Activity(COMMENT, comment.id, comment.post_id, comment.created,
+                    comment.post.title, comment.user.username)
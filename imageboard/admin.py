@@ -13,6 +13,7 @@ class PostAdmin(admin.ModelAdmin):
 	)
 	actions = ['delete_selected', 'update_modified', 'update_image_attributes']
 	list_display = ('id', 'user', '__str__', 'created', 'modified')
+	list_select_related = ('user',)
 	search_fields = ['=user__username', '^id']
 
 	def save_model(self, request, obj, form, change): 
@@ -101,6 +102,7 @@ class CommentAdmin(admin.ModelAdmin):
 	)
 	actions = ['delete_selected', 'update_image_attributes']
 	list_display = ('id', 'user', 'post', 'body', 'created')
+	list_select_related = ('user', 'post')
 	search_fields = ['=user__username', '^post__id']
 
 	def get_fieldsets(self, request, obj=None):
@@ -167,6 +169,7 @@ class ProfileAdmin(admin.ModelAdmin):
 		}),
 	)
 	list_display = ('user', 'pagination', 'comment_filter', 'activity', 'nightmode')
+	list_select_related = ('user',)
 	list_filter = ('pagination', 'comment_filter', 'nightmode')
 	search_fields = ['=user__username', '=user__email']
 
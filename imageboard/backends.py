@@ -1,11 +1,166 @@
+from django.core.cache import cache
 from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
 from embed_video import backends
-
+from embed_video.settings import EMBED_VIDEO_BACKENDS
+from imageboard import caching
+from imageboard.conf import IMAGEBOARD_OEMBED_TIMEOUT as oembed_timeout
+from imageboard.conf import IMAGEBOARD_OEMBED_NEGATIVE_TIMEOUT as negative_timeout
+from imageboard.conf import IMAGEBOARD_OEMBED_REFRESH_AHEAD as refresh_ahead
+from imageboard.conf import IMAGEBOARD_EMBED_POOL_SIZE as pool_size
+from imageboard.conf import IMAGEBOARD_EMBED_FAILURE_THRESHOLD as failure_threshold
+from imageboard.conf import IMAGEBOARD_EMBED_COOLDOWN as cooldown
+from imageboard.conf import IMAGEBOARD_EMBED_PROBE_TIMEOUT as probe_timeout
+from requests.adapters import HTTPAdapter
+
+from concurrent.futures import ThreadPoolExecutor, wait
+import hashlib
 import json
 import requests
 import re
 
 
+class ProviderUnavailable(requests.RequestException):
+    """
+    Raised instead of calling a provider while its circuit breaker is open,
+    or when the provider returns a server error
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Tracks consecutive failures of an embed provider across workers through
+    the cache. Once `IMAGEBOARD_EMBED_FAILURE_THRESHOLD` failures are recorded
+    the circuit opens, and the provider is not called for
+    `IMAGEBOARD_EMBED_COOLDOWN` seconds.
+    """
+    def __init__(self, provider):
+        self.provider = provider
+        self.failures_key = 'circuit_failures_' + provider
+        self.open_key = 'circuit_open_' + provider
+
+    @property
+    def is_open(self):
+        return cache.get(self.open_key) is not None
+
+    def record_success(self):
+        cache.delete(self.failures_key)
+
+    def record_failure(self):
+        cache.add(self.failures_key, 0, cooldown)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            # Key expired between add and incr
+            failures = 1
+            cache.set(self.failures_key, failures, cooldown)
+
+        if failures >= failure_threshold:
+            cache.set(self.open_key, True, cooldown)
+            cache.delete(self.failures_key)
+
+
+_breakers = {}
+
+
+def get_breaker(provider):
+    """
+    Returns the CircuitBreaker for a provider name
+    """
+    if provider not in _breakers:
+        _breakers[provider] = CircuitBreaker(provider)
+    return _breakers[provider]
+
+def _build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+session = _build_session()
+"""
+Shared keep-alive HTTP session used for every provider request
+"""
+
+_probe_executor = None
+
+
+def _get_probe_executor():
+    global _probe_executor
+
+    if _probe_executor is None:
+        _probe_executor = ThreadPoolExecutor(max_workers=max(
+            len(YoutubeBackend.resolutions), len(VimeoBackend.resolutions)) * 2)
+    return _probe_executor
+
+def probe_thumbnails(provider, urls):
+    """ Find the first available thumbnail of a list of candidates
+
+    Every URL is probed concurrently within `IMAGEBOARD_EMBED_PROBE_TIMEOUT`
+    seconds, through the provider's circuit breaker.
+
+    Args:
+        provider: String representing the provider name
+        urls: List of thumbnail URLs in order of preference
+
+    Returns:
+        Index of the first URL which is available, or None if none responded
+        in time
+    """
+    def probe(url):
+        r = provider_request(provider, 'head', url, timeout=probe_timeout)
+        return r.status_code < 400
+
+    futures = [_get_probe_executor().submit(probe, url) for url in urls]
+    wait(futures, timeout=probe_timeout)
+
+    for index, future in enumerate(futures):
+        if future.done() and not future.exception() and future.result():
+            return index
+
+    return None
+
+def provider_request(provider, method, url, **kwargs):
+    """ Make a request to an embed provider
+
+    Requests use the shared pooled session, and are guarded by the provider's
+    circuit breaker. Timeouts, connection errors, and server errors count as
+    failures.
+
+    Args:
+        provider: String representing the provider name
+        method: HTTP method name, e.g. 'get'
+        url: Request URL
+        **kwargs: Additional arguments for `requests.Session.request`
+
+    Returns:
+        requests.Response
+
+    Raises:
+        ProviderUnavailable: if the provider's circuit breaker is open
+        requests.RequestException: if the request fails
+    """
+    breaker = get_breaker(provider)
+    if breaker.is_open:
+        raise ProviderUnavailable(
+            '{0} is unavailable after repeated failures.'.format(provider))
+
+    kwargs.setdefault('timeout', backends.EMBED_VIDEO_TIMEOUT)
+    try:
+        r = session.request(method, url, **kwargs)
+    except requests.RequestException:
+        breaker.record_failure()
+        raise
+
+    if r.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+    return r
+
+
 def match_protocol(protocol, url):
     """
     Ensures URL matches given request protocol
@@ -25,28 +180,114 @@ def match_protocol(protocol, url):
     return re.sub(re_protocol, protocol + "://", url, count=1)
 
 
-class YoutubeBackend(backends.YoutubeBackend):
+def normalize_url(url):
     """
-    Extends YoutubeBackend functionality for external embed_video library
+    Normalizes a media URL for use as a cache key
 
-    API Docs: https://developers.google.com/youtube/
+    Args:
+        url: Media URL string
+
+    Returns:
+        URL string without protocol, leading `www.` or fragment, with a
+        lowercase host
+    """
+    url = re.sub(r'^(https?:)?//', '', url.strip(), flags=re.I)
+    url = url.split('#')[0]
+    host, sep, path = url.partition('/')
+    host = host.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return host + sep + path
+
+def get_oembed(provider, endpoint, params):
+    """ Request oEmbed metadata, shared between workers through the cache
+
+    Metadata is cached per normalized URL and maximum dimensions. Missing
+    embeds are cached for `IMAGEBOARD_OEMBED_NEGATIVE_TIMEOUT` seconds.
+
+    Args:
+        provider: String representing the provider name used in errors
+        endpoint: oEmbed API URL
+        params: Dictionary of request parameters, including `url`
+
+    Returns:
+        Dictionary representing the parsed JSON information
+
+    Raises:
+        VideoDoesntExistException: if the provider does not return metadata
+        requests.RequestException: if the provider cannot be reached and no
+            cached metadata exists
+    """
+    key = 'oembed_' + hashlib.md5('{0}|{1}|{2}'.format(
+        normalize_url(params['url']),
+        params.get('maxwidth', ''),
+        params.get('maxheight', '')).encode('utf-8')).hexdigest()
+
+    def fetch():
+        r = provider_request(provider, 'get', endpoint, params=params)
+
+        # Server errors are not cached as missing embeds, and leave embeds
+        # pending to be retried
+        if r.status_code >= 500:
+            raise ProviderUnavailable('{0} returned status code `{1}`.'.format(
+                provider, r.status_code))
+
+        if r.status_code != 200:
+            return False, '{0} returned status code `{1}`.'.format(
+                provider, r.status_code)
+
+        return True, json.loads(r.text)
+
+    def timeout(result):
+        if result[0]:
+            return max(oembed_timeout - refresh_ahead, 0)
+        return negative_timeout
+
+    try:
+        found, info = caching.get_or_generate(key, fetch, timeout,
+                                              grace=refresh_ahead)
+    except requests.RequestException:
+        # Serve previously cached metadata while the provider is failing
+        cached = caching.peek(key)
+        if cached is None:
+            raise
+        found, info = cached
+
+    if not found:
+        raise backends.VideoDoesntExistException(info)
+
+    return info
+
+
+class OEmbedBackend(object):
+    """
+    Shared oEmbed behaviour for the embed_video backends
+
+    Providers are described declaratively by class attributes, and mixed in
+    ahead of an embed_video backend:
+
+        provider: Name used for circuit breakers, errors and as the default
+                  author
+        hosts: Hostnames, without `www.`, that `detect_backend` dispatches to
+               the backend
+        base_url: oEmbed API URL, formatted with `protocol`
+        oembed_params: Additional oEmbed request parameters
+        re_detect, re_code, re_start: Patterns for detecting a URL, and
+                                      finding its code and start time
+        pattern_url, pattern_thumbnail_url: embed_video URL patterns
     """
     EMBED_WIDTH_MAX = 420
     EMBED_HEIGHT_MAX = 315
 
-    base_url = '{protocol}://www.youtube.com/oembed'
-
-    re_start = re.compile(
-        r'''youtu((\.be)|(be\.com))/
-            ([a-z0-9;:@?&%=+/\$_.-]+[&?])
-            ((t|start)[=])
-            ((?P<hours>\d+[h])?(?P<minutes>\d+[m])?(?P<seconds>\d+[s]?)?)''',
-        re.I | re.X
-    )
+    provider = None
+    hosts = ()
+    base_url = None
+    oembed_params = {}
+    re_start = None
 
     @cached_property
     def info(self):
-        """ Additional information about the embedded Youtube object
+        """ Additional information about the embedded object
 
         Returned information is cached for the instance lifetime.
 
@@ -58,7 +299,7 @@ class YoutubeBackend(backends.YoutubeBackend):
     @property
     def start(self):
         """
-        Start time of video
+        Start time of the media
         """
         return self.get_start_time()
 
@@ -79,44 +320,62 @@ class YoutubeBackend(backends.YoutubeBackend):
     def username(self):
         """
         Returns:
-             String representing the channel name
+             String representing the author name, or the provider name
         """
-        author = self.info.get('author_name')
-
-        if author is None or author == '':
-            return "Youtube"
-        else:
-            return self.info.get('author_name')
+        return self.info.get('author_name') or self.provider
 
     def title(self):
         """
         Returns:
-             String representing the video title
+             String representing the media title
         """
-        title = self.info.get('title')
-
-        if title is None or title == '':
-            return "Untitled"
-        else:
-            return self.info.get('title')
+        return self.info.get('title') or "Untitled"
 
     def get_info(self):
         params = {
             'url': self._url,
             'maxwidth': self.EMBED_WIDTH_MAX,
-            'maxheight': self.EMBED_HEIGHT_MAX,
-            'format': 'json'
+            'maxheight': self.EMBED_HEIGHT_MAX
         }
-        r = requests.get(self.base_url.format(protocol=self.protocol),
-                         params=params,
-                         timeout=backends.EMBED_VIDEO_TIMEOUT)
+        params.update(self.oembed_params)
+        return get_oembed(self.provider,
+                          self.base_url.format(protocol=self.protocol),
+                          params)
 
-        if r.status_code != 200:
-            raise backends.VideoDoesntExistException(
-                'Youtube returned status code `{0}`.'.format(r.status_code)
-            )
+    def get_start_time(self):
+        """ Find media start time in url parameters
+
+        Otherwise returns 0 seconds if no matching time is given
+
+        Returns:
+            String representing media start in seconds
+        """
+        match = self.re_start.search(self._url) if self.re_start else None
+
+        if match:
+            return match.group('seconds')
+        else:
+            return '0'
 
-        return json.loads(r.text)
+
+class YoutubeBackend(OEmbedBackend, backends.YoutubeBackend):
+    """
+    Extends YoutubeBackend functionality for external embed_video library
+
+    API Docs: https://developers.google.com/youtube/
+    """
+    provider = 'Youtube'
+    hosts = ('youtube.com', 'm.youtube.com', 'youtu.be')
+    base_url = '{protocol}://www.youtube.com/oembed'
+    oembed_params = {'format': 'json'}
+
+    re_start = re.compile(
+        r'''youtu((\.be)|(be\.com))/
+            ([a-z0-9;:@?&%=+/\$_.-]+[&?])
+            ((t|start)[=])
+            ((?P<hours>\d+[h])?(?P<minutes>\d+[m])?(?P<seconds>\d+[s]?)?)''',
+        re.I | re.X
+    )
 
     def get_start_time(self):
         """ Find video start time in url parameters
@@ -143,22 +402,52 @@ class YoutubeBackend(backends.YoutubeBackend):
         else:
             return '0'
 
+    def get_thumbnail_url(self):
+        """
+        Returns thumbnail URL folded from :py:data:`pattern_thumbnail_url` and
+        parsed code
+
+        Every resolution is probed concurrently within
+        `IMAGEBOARD_EMBED_PROBE_TIMEOUT` seconds, and the preferred available
+        resolution is remembered for the video code. Falls back to the oEmbed
+        thumbnail if none responded.
+
+        :rtype: str
+        """
+        key = 'youtube_thumbnail_' + self.code
+        resolution = cache.get(key)
+
+        if resolution is None:
+            index = probe_thumbnails(self.provider, [
+                self.pattern_thumbnail_url.format(
+                    code=self.code, protocol=self.protocol, resolution=r)
+                for r in self.resolutions])
+            resolution = self.resolutions[index] if index is not None else ''
+            cache.set(key, resolution,
+                      oembed_timeout if resolution else negative_timeout)
+
+        if resolution:
+            return self.pattern_thumbnail_url.format(
+                code=self.code, protocol=self.protocol, resolution=resolution)
 
-class VimeoBackend(backends.VimeoBackend):
+        return self.info.get('thumbnail_url')
+
+
+class VimeoBackend(OEmbedBackend, backends.VimeoBackend):
     """
     Extends VimeoBackend functionality for external embed_video library
 
     API Docs: https://developer.vimeo.com/api
     """
-    EMBED_WIDTH_MAX = 420
-    EMBED_HEIGHT_MAX = 315
+    provider = 'Vimeo'
+    hosts = ('vimeo.com', 'player.vimeo.com')
+    base_url = '{protocol}://vimeo.com/api/oembed.json'
 
     re_thumbnail_code = re.compile(
         r'''/(?P<code>[0-9]+)_''',
         re.I | re.X
     )
 
-    base_url = '{protocol}://vimeo.com/api/oembed.json'
     pattern_thumbnail_url = '{protocol}://i.vimeocdn.com/video/{thumbnail_code}_{resolution}'
     resolutions = [
         '420x315.jpg', # Vimeo handles custom thumbnail sizes
@@ -169,184 +458,73 @@ class VimeoBackend(backends.VimeoBackend):
         '100x75.jpg',
     ]
 
-    @cached_property
-    def info(self):
-        """ Additional information about the embedded Vimeo object
-
-        Returned information is cached for the instance lifetime.
-
-        Returns:
-             String representing the parsed JSON information
-        """
-        return self.get_info()
-
-    @property
-    def start(self):
-        """
-        Start time of video
-        """
-        return self.get_start_time()
-
-    def width(self):
-        """
-        Returns:
-             String representing the embeded player width in pixels
-        """
-        return self.info.get('width')
-
-    def height(self):
-        """
-        Returns:
-             String representing the embeded player height in pixels
-        """
-        return self.info.get('height')
-
-    def username(self):
-        """
-        Returns:
-             String representing the channel name
-        """
-        author = self.info.get('author_name')
-
-        if author is None or author == '':
-            return "Vimeo"
-        else:
-            return self.info.get('author_name')
-
-    def title(self):
-        """
-        Returns:
-             String representing the video title
-        """
-        title = self.info.get('title')
-
-        if title is None or title == '':
-            return "Untitled"
-        else:
-            return self.info.get('title')
-
-    def get_info(self):
-        params = {
-            'url': self._url,
-            'maxwidth': self.EMBED_WIDTH_MAX,
-            'maxheight': self.EMBED_WIDTH_MAX
-        }
-        r = requests.get(self.base_url.format(protocol=self.protocol),
-                         params=params,
-                         timeout=backends.EMBED_VIDEO_TIMEOUT)
-
-        if r.status_code != 200:
-            raise backends.VideoDoesntExistException(
-                'Vimeo returned status code `{0}`.'.format(r.status_code)
-            )
-
-        return json.loads(r.text)
-
     def get_thumbnail_url(self):
         """
         Returns thumbnail URL folded from :py:data:`pattern_thumbnail_url` and
         parsed thumbnail code
 
+        Every resolution is probed concurrently within
+        `IMAGEBOARD_EMBED_PROBE_TIMEOUT` seconds, and the preferred available
+        resolution is remembered for the video code.
+
         :rtype: str
         """
         thumbnail = self.info.get('thumbnail_url')
 
         code = self.re_thumbnail_code.search(thumbnail)
-        if code:
-            for resolution in self.resolutions:
-                temp_thumbnail_url = self.pattern_thumbnail_url.format(
-                    protocol=self.protocol,
-                    thumbnail_code=code.group('code'),
-                    resolution=resolution)
-                if int(requests.head(temp_thumbnail_url).status_code) < 400:
-                    return temp_thumbnail_url
+        if not code:
+            return thumbnail
+
+        key = 'vimeo_thumbnail_' + self.code
+        resolution = cache.get(key)
+
+        if resolution is None:
+            resolution = self.probe_resolutions(code.group('code'))
+            cache.set(key, resolution,
+                      oembed_timeout if resolution else negative_timeout)
+
+        if resolution:
+            return self.pattern_thumbnail_url.format(
+                protocol=self.protocol,
+                thumbnail_code=code.group('code'),
+                resolution=resolution)
 
         return thumbnail
 
-    @staticmethod
-    def get_start_time():
-        """ Find video start time in url parameters
+    def probe_resolutions(self, thumbnail_code):
+        """ Find the preferred available thumbnail resolution
 
-        Otherwise returns 0 seconds if no matching time is given
+        Args:
+            thumbnail_code: String representing the Vimeo thumbnail code
 
         Returns:
-            String representing video start in seconds
+            The first entry of :py:data:`resolutions` which is available, or
+            an empty string if none responded in time
         """
-        return '0' # Not implemented by Vimeo
+        index = probe_thumbnails(self.provider, [
+            self.pattern_thumbnail_url.format(
+                protocol=self.protocol,
+                thumbnail_code=thumbnail_code,
+                resolution=r)
+            for r in self.resolutions])
+
+        return self.resolutions[index] if index is not None else ''
 
 
 # TODO: Replace get_code and get_url to avoid making API call
 # TODO: Fix broken playlist handling
-class SoundCloudBackend(backends.SoundCloudBackend):
+class SoundCloudBackend(OEmbedBackend, backends.SoundCloudBackend):
     """
     Extends SoundCloudBackend functionality for external embed_video library
 
     API Docs: https://developers.soundcloud.com/docs/api/reference
     """
-    EMBED_WIDTH_MAX = 420
     EMBED_HEIGHT_MAX = 176
 
+    provider = 'Soundcloud'
+    hosts = ('soundcloud.com',)
     base_url = '{protocol}://soundcloud.com/oembed'
-
-    @cached_property
-    def info(self):
-        """ Additional information about the embedded SoundCloud object
-
-        Returned request information is cached for the instance lifetime
-
-        Returns:
-             String representing the parsed JSON information
-        """
-        return self.get_info()
-
-    @property
-    def start(self):
-        """
-        Track start time
-        """
-        return self.get_start_time()
-
-    def username(self):
-        """
-        Returns:
-             String representing the artist name
-        """
-        author = self.info.get('author_name')
-
-        if author is None or author == '':
-            return "Soundcloud"
-        else:
-            return self.info.get('author_name')
-
-    def title(self):
-        """
-        Returns:
-             String representing the track title
-        """
-        title = self.info.get('title')
-
-        if title is None or title == '':
-            return "Untitled"
-        else:
-            return self.info.get('title')
-
-    def get_info(self):
-        params = {
-            'url': self._url,
-            'maxwidth': self.EMBED_WIDTH_MAX,
-            'maxheight': self.EMBED_HEIGHT_MAX,
-            'format': 'json'
-        }
-        r = requests.get(self.base_url.format(protocol=self.protocol),
-                         params=params,
-                         timeout=backends.EMBED_VIDEO_TIMEOUT)
-
-        if r.status_code != 200:
-            raise backends.VideoDoesntExistException(
-                'SoundCloud returned status code `{0}`.'.format(r.status_code)
-            )
-
-        return json.loads(r.text)
+    oembed_params = {'format': 'json'}
 
     def get_thumbnail_url(self):
         """
@@ -357,26 +535,16 @@ class SoundCloudBackend(backends.SoundCloudBackend):
         """
         return match_protocol(self.protocol, self.info.get('thumbnail_url'))
 
-    @staticmethod
-    def get_start_time():
-        """ Find track start time in url parameters
-
-        Otherwise returns 0 seconds if no matching time is given
-
-        Returns:
-            String representing track start in seconds
-        """
-        return '0' # Not handled by the SoundCloud embed player
-
 
-class StreamableBackend(backends.VideoBackend):
+class StreamableBackend(OEmbedBackend, backends.VideoBackend):
     """
     StreamableBackend functionality for external embed_video library
 
     API Docs: https://streamable.com/documentation
     """
-    EMBED_WIDTH_MAX = 420
-    EMBED_HEIGHT_MAX = 315
+    provider = 'Streamable'
+    hosts = ('streamable.com',)
+    base_url = '{protocol}://api.streamable.com/oembed.json'
 
     re_detect = re.compile(
         r'''^(http(s)?://)?(www\.)?streamable\.com/([0-9a-zA-Z]*).*''',
@@ -393,112 +561,20 @@ class StreamableBackend(backends.VideoBackend):
         re.I | re.X
     )
 
-    base_url = '{protocol}://api.streamable.com/oembed.json'
     pattern_url = '{protocol}://streamable.com/e/{code}'
     pattern_thumbnail_url = '{protocol}://cdn.streamable.com/image/{code}.jpg'
 
-    @cached_property
-    def info(self):
-        """ Additional information about the embedded Streamable object
-
-        Returned information is cached for the instance lifetime.
-
-        Returns:
-             String representing the parsed JSON information
-        """
-        return self.get_info()
-
-    @property
-    def start(self):
-        """
-        Start time of video
-        """
-        return self.get_start_time()
-
-    def width(self):
-        """
-        Returns:
-             String representing the embeded player width in pixels
-        """
-        return self.info.get('width')
-
-    def height(self):
-        """
-        Returns:
-             String representing the embeded player height in pixels
-        """
-        return self.info.get('height')
-
-    def username(self):
-        """
-        Returns:
-             String representing the channel name
-        """
-        author = self.info.get('author_name')
-
-        if author is None or author == '':
-            return "Streamable"
-        else:
-            return self.info.get('author_name')
-
-    def title(self):
-        """
-        Returns:
-             String representing the video title
-        """
-        title = self.info.get('title')
-
-        if title is None or title == '':
-            return "Untitled"
-        else:
-            return self.info.get('title')
-
-    def get_info(self):
-        params = {
-            'url': self._url,
-            'maxwidth': self.EMBED_WIDTH_MAX,
-            'maxheight': self.EMBED_WIDTH_MAX
-        }
-        r = requests.get(self.base_url.format(protocol=self.protocol),
-                         params=params,
-                         timeout=backends.EMBED_VIDEO_TIMEOUT)
-
-        if r.status_code != 200:
-            raise backends.VideoDoesntExistException(
-                'Streamable returned status code `{0}`.'.format(r.status_code)
-            )
-
-        return json.loads(r.text)
-
-    def get_thumbnail_url(self):
-        return self.pattern_thumbnail_url.format(protocol=self.protocol,
-                                                 code=self.code)
-
-    def get_start_time(self):
-        """ Find video start time in url parameters
-
-        Using format: t = seconds.hundredths
-        Otherwise returns 0 seconds if no matching time is given
-
-        Returns:
-            String representing video start in seconds
-        """
-        match = self.re_start.search(self._url)
-
-        if match:
-            return match.group('seconds')
-        else:
-            return '0'
-
 
-class DailymotionBackend(backends.VideoBackend):
+class DailymotionBackend(OEmbedBackend, backends.VideoBackend):
     """
     DailymotionBackend functionality for external embed_video library
 
     API Docs: https://developer.dailymotion.com/player
     """
-    EMBED_WIDTH_MAX = 420
-    EMBED_HEIGHT_MAX = 315
+    provider = 'Dailymotion'
+    hosts = ('dailymotion.com', 'dai.ly')
+    base_url = '{protocol}://www.dailymotion.com/services/oembed'
+    oembed_params = {'format': 'json'}
 
     re_detect = re.compile(
         r'''(^http(s)?://(www\.)?dailymotion\.com/video/)|
@@ -522,84 +598,9 @@ class DailymotionBackend(backends.VideoBackend):
         re.I | re.X
     )
 
-    base_url = '{protocol}://www.dailymotion.com/services/oembed'
     pattern_url = '{protocol}://www.dailymotion.com/embed/video/{code}'
     pattern_thumbnail_url = 'https://s1-ssl.dmcdn.net/{thumbnail_code}.jpg'
 
-    @cached_property
-    def info(self):
-        """ Additional information about the embedded Dailymotion object
-
-        Returned information is cached for the instance lifetime.
-
-        Returns:
-             String representing the parsed JSON information
-        """
-        return self.get_info()
-
-    @property
-    def start(self):
-        """
-        Start time of video
-        """
-        return self.get_start_time()
-
-    def width(self):
-        """
-        Returns:
-             String representing the embeded player width in pixels
-        """
-        return self.info.get('width')
-
-    def height(self):
-        """
-        Returns:
-             String representing the embeded player height in pixels
-        """
-        return self.info.get('height')
-
-    def username(self):
-        """
-        Returns:
-             String representing the author name
-        """
-        author = self.info.get('author_name')
-
-        if author is None or author == '':
-            return "Dailymotion"
-        else:
-            return self.info.get('author_name')
-
-    def title(self):
-        """
-        Returns:
-             String representing the embed title
-        """
-        title = self.info.get('title')
-
-        if title is None or title == '':
-            return "Untitled"
-        else:
-            return self.info.get('title')
-
-    def get_info(self):
-        params = {
-            'url': self._url,
-            'maxwidth': self.EMBED_WIDTH_MAX,
-            'maxheight': self.EMBED_WIDTH_MAX,
-            'format': 'json'
-        }
-        r = requests.get(self.base_url.format(protocol=self.protocol),
-                         params=params,
-                         timeout=backends.EMBED_VIDEO_TIMEOUT)
-
-        if r.status_code != 200:
-            raise backends.VideoDoesntExistException(
-                'Dailymotion returned status code `{0}`.'.format(r.status_code)
-            )
-
-        return json.loads(r.text)
-
     def get_thumbnail_url(self):
         thumbnail = self.info.get('thumbnail_url')
 
@@ -614,31 +615,16 @@ class DailymotionBackend(backends.VideoBackend):
         else:
             return thumbnail
 
-    def get_start_time(self):
-        """ Find video start time in url parameters
-
-        Using format: start = seconds
-        Otherwise returns 0 seconds if no matching time is given
-
-        Returns:
-            String representing video start in seconds
-        """
-        match = self.re_start.search(self._url)
-
-        if match:
-            return match.group('seconds')
-        else:
-            return '0'
-
 
-class GfycatBackend(backends.VideoBackend):
+class GfycatBackend(OEmbedBackend, backends.VideoBackend):
     """
     GfycatBackend functionality for external embed_video library
 
     API Docs: https://gfycat.com/api
     """
-    EMBED_WIDTH_MAX = 420
-    EMBED_HEIGHT_MAX = 315
+    provider = 'Gfycat'
+    hosts = ('gfycat.com',)
+    base_url = '{protocol}://api.gfycat.com/v1/oembed'
 
     re_detect = re.compile(
         r'''^(http(s)?://)?(www\.)?gfycat\.com/([a-zA-Z]*).*''',
@@ -650,94 +636,56 @@ class GfycatBackend(backends.VideoBackend):
         re.I | re.X
     )
 
-    base_url = '{protocol}://api.gfycat.com/v1/oembed'
     pattern_url = '{protocol}://www.gfycat.com/ifr/{code}'
     pattern_thumbnail_url = '{protocol}://thumbs.gfycat.com/{code}-poster.jpg'
 
-    @cached_property
-    def info(self):
-        """ Additional information about the embedded Gfycat object
-
-        Returned information is cached for the instance lifetime.
-
-        Returns:
-             String representing the parsed JSON information
-        """
-        return self.get_info()
-
-    @property
-    def start(self):
-        """
-        Start time of video
-        """
-        return self.get_start_time()
-
-    def width(self):
-        """
-        Returns:
-             String representing the embeded player width in pixels
-        """
-        return self.info.get('width')
-
-    def height(self):
-        """
-        Returns:
-             String representing the embeded player height in pixels
-        """
-        return self.info.get('height')
-
-    def username(self):
-        """
-        Returns:
-             String representing the author name
-        """
-        author = self.info.get('author_name')
 
-        if author is None or author == '':
-            return "Gfycat"
-        else:
-            return self.info.get('author_name')
-
-    def title(self):
-        """
-        Returns:
-             String representing the embed title
-        """
-        title = self.info.get('title')
+_registry = None
 
-        if title is None or title == '':
-            return "Untitled"
-        else:
-            return self.info.get('title')
 
-    def get_info(self):
-        params = {
-            'url': self._url,
-            'maxwidth': self.EMBED_WIDTH_MAX,
-            'maxheight': self.EMBED_WIDTH_MAX
-        }
-        r = requests.get(self.base_url.format(protocol=self.protocol),
-                         params=params,
-                         timeout=backends.EMBED_VIDEO_TIMEOUT)
+def _get_registry():
+    """
+    Builds the host to backend lookup from `EMBED_VIDEO_BACKENDS`. Backends
+    which do not declare `hosts` are tried in turn after the lookup.
+    """
+    global _registry
+
+    if _registry is None:
+        hosts, fallback = {}, []
+        for name in EMBED_VIDEO_BACKENDS:
+            backend = import_string(name)
+            if getattr(backend, 'hosts', None):
+                for host in backend.hosts:
+                    hosts.setdefault(host, backend)
+            else:
+                fallback.append(backend)
+        _registry = hosts, fallback
+    return _registry
+
+def detect_backend(url):
+    """ Detect the backend for a media URL
+
+    Replaces `embed_video.backends.detect_backend`, which matches the URL
+    against every backend in turn. The backend is found by its host, so only
+    its own `re_detect` is tested.
 
-        if r.status_code != 200:
-            raise backends.VideoDoesntExistException(
-                'Gfycat returned status code `{0}`.'.format(r.status_code)
-            )
+    Args:
+        url: Media URL string
 
-        return json.loads(r.text)
+    Returns:
+        Backend instance for the URL
 
-    def get_thumbnail_url(self):
-        return self.pattern_thumbnail_url.format(protocol=self.protocol,
-                                                 code=self.code)
+    Raises:
+        UnknownBackendException: if no enabled backend handles the URL
+    """
+    hosts, fallback = _get_registry()
 
-    @staticmethod
-    def get_start_time():
-        """ Find video start time in url parameters
+    backend = hosts.get(normalize_url(url).partition('/')[0])
+    if backend is not None and backend.is_valid(url):
+        return backend(url)
 
-        Otherwise returns 0 seconds if no matching time is given
+    for backend in fallback:
+        if backend.is_valid(url):
+            return backend(url)
 
-        Returns:
-            String representing video start in seconds
-        """
-        return '0' # Not implemented by Gfycat
+    raise backends.UnknownBackendException
@@ -0,0 +1,187 @@
+"""
+Single-flight caching for Pifti
+
+Values are stored alongside the time they become stale and are kept in the
+cache for `IMAGEBOARD_CACHE_GRACE` seconds past it. Once a value is stale the
+first worker to take the regeneration lock rebuilds it, while every other
+worker continues to serve the stale value.
+
+Locks hold a token unique to their holder, and are only released by it, so a
+holder whose lock expired cannot release the lock of the worker after it.
+
+Keys may still hold values cached without a stale time, such as fragments
+cached by the built-in `{% cache %}` tag before `{% stalecache %}` replaced
+it. These are treated as missing.
+"""
+from time import sleep, time
+from uuid import uuid4
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from imageboard.conf import IMAGEBOARD_CACHE_GRACE as grace
+from imageboard.conf import IMAGEBOARD_CACHE_LOCK_TIMEOUT as lock_timeout
+from imageboard.conf import IMAGEBOARD_CACHE_LOCK_WAIT as lock_wait
+
+POLL_INTERVAL = 0.05
+
+
+def get_or_generate(key, generate, timeout, grace=grace):
+    """ Retrieve a cached value, regenerating it in a single worker
+
+    Args:
+        key: cache key
+        generate: callable returning the value to be cached
+        timeout: seconds until the value becomes stale, or None to never
+                 become stale. May be a callable which is given the generated
+                 value and returns the timeout.
+        grace: seconds a stale value may be served while it is regenerated
+
+    Returns:
+        The cached, stale, or newly generated value
+    """
+    entry = _get(key)
+    lock = key + ':lock'
+
+    if entry is not None:
+        value, stale_at = entry
+        if stale_at is None or time() < stale_at:
+            return value
+        token = _acquire(lock)
+        if token is None:
+            # Another worker is regenerating, serve stale
+            return value
+        return _regenerate(key, generate, timeout, grace, token)
+
+    # Nothing to serve, wait briefly for the lock holder to finish
+    deadline = time() + lock_wait
+    token = _acquire(lock)
+    while token is None:
+        if time() > deadline:
+            return generate()
+        sleep(POLL_INTERVAL)
+        entry = _get(key)
+        if entry is not None:
+            return entry[0]
+        token = _acquire(lock)
+
+    return _regenerate(key, generate, timeout, grace, token)
+
+def peek(key):
+    """
+    Returns a cached value regardless of staleness, or None if it is missing.
+    """
+    entry = _get(key)
+    if entry is None:
+        return None
+    return entry[0]
+
+def is_shared():
+    """
+    Returns True if the default cache is shared between processes. The local
+    memory and dummy backends keep their values within a single process.
+    """
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+def store(key, value, timeout, grace=grace):
+    """
+    Caches a value which becomes stale after `timeout` seconds, and is removed
+    `grace` seconds later.
+    """
+    if timeout is None:
+        cache.set(key, (value, None), None)
+    else:
+        cache.set(key, (value, time() + timeout), timeout + grace)
+
+def expire(key, grace=grace):
+    """
+    Marks a cached value as stale, so it is regenerated by the next worker
+    while others continue to serve it.
+    """
+    entry = _get(key)
+    if entry is not None:
+        cache.set(key, (entry[0], 0), grace)
+
+def update(key, func, timeout, grace=grace):
+    """ Change a cached value while holding its update lock
+
+    Concurrent updates of the same key are applied one at a time, so none of
+    them is lost. Missing values are left missing. Updates are made while
+    saving, so if the lock cannot be taken within `IMAGEBOARD_CACHE_LOCK_WAIT`
+    seconds the value is deleted, to be generated again by the next read.
+
+    Args:
+        key: cache key
+        func: callable given the cached value, returning the new value,
+              the same value to leave it unchanged, or None to mark the
+              value stale
+        timeout: seconds until the new value becomes stale
+        grace: seconds a stale value may be served while it is regenerated
+
+    Returns:
+        None
+    """
+    lock = key + ':update'
+    deadline = time() + lock_wait
+    token = _acquire(lock)
+    while token is None:
+        if time() > deadline:
+            cache.delete(key)
+            return
+        sleep(POLL_INTERVAL)
+        token = _acquire(lock)
+
+    try:
+        entry = _get(key)
+        if entry is None:
+            return
+        value = func(entry[0])
+        if value is entry[0]:
+            return
+        if value is None:
+            expire(key, grace)
+        else:
+            store(key, value, timeout, grace)
+    finally:
+        _release(lock, token)
+
+
+def _get(key):
+    """
+    Returns the `(value, stale_at)` entry for a key, or None if it is missing
+    or was not stored by this module.
+    """
+    entry = cache.get(key)
+    if isinstance(entry, tuple) and len(entry) == 2:
+        return entry
+    return None
+
+def _acquire(lock):
+    """
+    Takes a lock for `IMAGEBOARD_CACHE_LOCK_TIMEOUT` seconds, returning the
+    token to release it with, or None if it is held by another worker.
+    """
+    token = uuid4().hex
+    if cache.add(lock, token, lock_timeout):
+        return token
+    return None
+
+def _release(lock, token):
+    """
+    Releases a lock, unless it expired and was taken by another worker.
+    """
+    # The cache API has no atomic compare and delete, this only narrows the
+    # window to the time between the two calls
+    if cache.get(lock) == token:
+        cache.delete(lock)
+
+def _regenerate(key, generate, timeout, grace, token):
+    try:
+        value = generate()
+        if callable(timeout):
+            timeout = timeout(value)
+        store(key, value, timeout, grace)
+        return value
+    finally:
+        _release(key + ':lock', token)
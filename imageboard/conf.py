@@ -7,7 +7,7 @@ IMAGEBOARD_FORMATS = getattr(settings, 'IMAGEBOARD_FORMATS',
         'PNG': {'code': 'PNG', 'animated': False},
         'ICO': {'code': 'ICO', 'animated': False},
         'GIF': {'code': 'GIF', 'animated': True},
-        'FFMPEG': {'code': 'VIDEO', 'animated': True},
+        'FFMPEG': {'code': 'VIDEO', 'animated': True, 'max_size': 10 * 1024 * 1024},
     }
 )
 """
@@ -15,6 +15,9 @@ The default formats which Pifti will handle. All replacements must be supplied
 with `code` and `animated` fields, and must be supported by the imageio library.
 Imageio formats: https://imageio.readthedocs.io/en/latest/formats.html
 
+A format may also supply `max_size`, its upload limit in bytes, which otherwise
+defaults to `IMAGEBOARD_UPLOAD_MAX_SIZE`.
+
 Overwrite this in your application settings to alter format support.
 """
 
@@ -28,8 +31,8 @@ IMAGEBOARD_SERVER_EMBEDS = getattr(settings, 'IMAGEBOARD_SERVER_EMBEDS',
 The default embeds which Pifti will force the loading of responsive embed data
 from via its embed_video backend.
 
-Requesting data through the server backend is a slow process because it is
-generated synchronously when building the template context. However loading data
+Embed data for these backends is resolved by a background job when a post or
+comment is saved, and a placeholder is shown until it is ready. Loading data
 through the client browser is forbidden for some backends, such as Youtube's
 oEmbed API which blocks cross-domain requests. Thus this setting is configured
 for those backends by default.
@@ -37,3 +40,138 @@ for those backends by default.
 Overwrite this in your application settings to force loading of the listed
 backends through the server, rather than client side javascript.
 """
+
+IMAGEBOARD_CACHE_GRACE = getattr(settings, 'IMAGEBOARD_CACHE_GRACE', 3600)
+"""
+The number of seconds a cached activity list or template fragment may be served
+after it has expired, while a single worker regenerates it.
+
+Overwrite this in your application settings to alter how long stale content may
+be shown.
+"""
+
+IMAGEBOARD_CACHE_LOCK_TIMEOUT = getattr(settings, 'IMAGEBOARD_CACHE_LOCK_TIMEOUT', 30)
+"""
+The number of seconds a worker may hold the regeneration lock for a cached
+value, after which the lock expires and another worker may take it.
+"""
+
+IMAGEBOARD_CACHE_LOCK_WAIT = getattr(settings, 'IMAGEBOARD_CACHE_LOCK_WAIT', 2)
+"""
+The number of seconds a worker with nothing to serve will wait for the holder
+of a regeneration lock, before generating the value itself. A worker updating
+a cached value as it saves waits this long for the update lock, before
+dropping the value to be regenerated.
+"""
+
+IMAGEBOARD_OEMBED_TIMEOUT = getattr(settings, 'IMAGEBOARD_OEMBED_TIMEOUT', 604800)
+"""
+The number of seconds oEmbed metadata for an embed is cached and shared between
+all workers before it is requested from the provider again.
+"""
+
+IMAGEBOARD_OEMBED_NEGATIVE_TIMEOUT = getattr(settings, 'IMAGEBOARD_OEMBED_NEGATIVE_TIMEOUT', 3600)
+"""
+The number of seconds a provider's report that an embed does not exist is
+cached, before the provider is asked again.
+"""
+
+IMAGEBOARD_OEMBED_REFRESH_AHEAD = getattr(settings, 'IMAGEBOARD_OEMBED_REFRESH_AHEAD', 0)
+"""
+The number of seconds before `IMAGEBOARD_OEMBED_TIMEOUT` at which cached oEmbed
+metadata is refreshed by a single worker, while the others continue to serve
+the cached copy. Disabled by default.
+"""
+
+IMAGEBOARD_TASK_WORKERS = getattr(settings, 'IMAGEBOARD_TASK_WORKERS', 2)
+"""
+The number of background threads each process uses to run jobs such as
+resolving embed metadata. Jobs are started once the current database
+transaction commits.
+
+Set this to 0 in your application settings to run jobs synchronously, which is
+useful for testing.
+"""
+
+IMAGEBOARD_EMBED_WORKERS = getattr(settings, 'IMAGEBOARD_EMBED_WORKERS', 8)
+"""
+The number of threads each process uses to resolve the embeds of a page in
+parallel before it is rendered.
+"""
+
+IMAGEBOARD_EMBED_DEADLINE = getattr(settings, 'IMAGEBOARD_EMBED_DEADLINE', 2)
+"""
+The number of seconds a page waits in total for its embeds to be resolved.
+Embeds which are not resolved in time are shown with a placeholder, and
+continue to be resolved in the background.
+"""
+
+IMAGEBOARD_EMBED_POOL_SIZE = getattr(settings, 'IMAGEBOARD_EMBED_POOL_SIZE', 10)
+"""
+The number of keep-alive connections held open to each embed provider host.
+"""
+
+IMAGEBOARD_EMBED_FAILURE_THRESHOLD = getattr(settings, 'IMAGEBOARD_EMBED_FAILURE_THRESHOLD', 5)
+"""
+The number of consecutive failures or timeouts after which an embed provider is
+no longer called until `IMAGEBOARD_EMBED_COOLDOWN` seconds have passed.
+Cached or placeholder metadata is shown in the meantime.
+"""
+
+IMAGEBOARD_EMBED_COOLDOWN = getattr(settings, 'IMAGEBOARD_EMBED_COOLDOWN', 60)
+"""
+The number of seconds an embed provider is left alone after repeated failures.
+"""
+
+IMAGEBOARD_EMBED_PROBE_TIMEOUT = getattr(settings, 'IMAGEBOARD_EMBED_PROBE_TIMEOUT', 2)
+"""
+The number of seconds to wait in total when probing a provider for the
+available thumbnail resolutions of an embed.
+"""
+
+IMAGEBOARD_EMBED_THUMBNAIL = getattr(settings, 'IMAGEBOARD_EMBED_THUMBNAIL',
+    {'size': (420, 315)}
+)
+"""
+The easy_thumbnails options used to resize embed thumbnails, which are mirrored
+into media storage when an embed is resolved. Defaults to the embed box size.
+"""
+
+IMAGEBOARD_UPLOAD_HASH = getattr(settings, 'IMAGEBOARD_UPLOAD_HASH', 'sha256')
+"""
+The hashlib algorithm used to name uploaded images by their content. The hash
+is computed by the upload handlers as the file is received. Digests must fit
+the image field's 100 character name along with the extension.
+"""
+
+IMAGEBOARD_UPLOAD_MAX_SIZE = getattr(settings, 'IMAGEBOARD_UPLOAD_MAX_SIZE', 5 * 1024 * 1024)
+"""
+The upload limit in bytes for formats which do not supply their own `max_size`.
+Uploads are abandoned as soon as they exceed their limit, so the web server's
+request body limit must allow for the largest format limit.
+"""
+
+IMAGEBOARD_THUMBNAIL_PLACEHOLDER = getattr(settings, 'IMAGEBOARD_THUMBNAIL_PLACEHOLDER',
+                                           'thumbnail_pending.svg')
+"""
+The static file shown in place of an image thumbnail while a background job
+generates it. Thumbnails are never generated while a page is rendered.
+"""
+
+IMAGEBOARD_THUMBNAIL_DERIVATIVES = getattr(settings, 'IMAGEBOARD_THUMBNAIL_DERIVATIVES',
+    {
+        'scales': (1, 2),
+        'formats': ('avif', 'webp'),
+    }
+)
+"""
+The derivatives generated alongside each thumbnail alias. Every alias is made
+at each of the `scales` of its size, for high density screens, in its own
+format and in each of the `formats`, in order of preference.
+
+Formats which the installed Pillow cannot save are skipped, AVIF requires a
+Pillow AVIF plugin. Supported formats are `avif` and `webp`.
+
+Derivatives are generated for new uploads. After changing this setting, run
+`manage.py regenerate_thumbnails <alias>` to generate them for existing images.
+"""
@@ -0,0 +1,273 @@
+"""
+Embed metadata for Pifti
+
+Metadata for Post and Comment media is resolved by a background job when they
+are saved, and stored in EmbedMetadata so templates never wait on a provider.
+"""
+from datetime import timedelta
+import hashlib
+import logging
+import posixpath
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key as tf
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.validators import URLValidator
+from django.utils.timezone import now
+from easy_thumbnails.files import get_thumbnailer
+from embed_video.backends import EmbedVideoException
+from requests import ConnectionError, RequestException, Timeout
+
+from imageboard import tasks
+from imageboard.backends import detect_backend, ProviderUnavailable, provider_request
+from imageboard.conf import IMAGEBOARD_EMBED_DEADLINE as deadline
+from imageboard.conf import IMAGEBOARD_EMBED_THUMBNAIL as thumbnail_options
+from imageboard.conf import IMAGEBOARD_SERVER_EMBEDS as server_embeds
+from imageboard.storage import MediaFileStorage
+
+logger = logging.getLogger(__name__)
+
+PENDING_RETRY = timedelta(minutes=5)
+THUMBNAIL_MAX_SIZE = 5 * 1024 * 1024
+THUMBNAIL_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+
+def request_embed(url):
+    """ Queue metadata resolution for a media URL
+
+    Args:
+        url: Media URL string
+
+    Returns:
+        The EmbedMetadata record for the URL
+    """
+    EmbedMetadata = apps.get_model('imageboard', 'EmbedMetadata')
+
+    record, created = EmbedMetadata.objects.get_or_create(url=url)
+    if created or record.status == EmbedMetadata.PENDING:
+        tasks.enqueue(resolve_embed, url)
+
+    return record
+
+def get_embed(url):
+    """ Retrieve the stored metadata for a media URL
+
+    Unknown URLs, or URLs left pending for longer than `PENDING_RETRY`, are
+    queued for resolution.
+
+    Args:
+        url: Media URL string
+
+    Returns:
+        The EmbedMetadata record for the URL, which may still be pending
+    """
+    EmbedMetadata = apps.get_model('imageboard', 'EmbedMetadata')
+
+    record = EmbedMetadata.objects.filter(url=url).first()
+    if record is None:
+        return request_embed(url)
+    if record.status == EmbedMetadata.PENDING and \
+            record.updated < now() - PENDING_RETRY:
+        record.save(update_fields=['updated'])
+        tasks.enqueue(resolve_embed, url)
+
+    return record
+
+def get_embeds(urls, server_only=True):
+    """ Retrieve the metadata for every media URL on a page
+
+    Stored metadata is loaded with a single query. Server resolved embeds
+    without a record are resolved in parallel, waiting at most
+    `IMAGEBOARD_EMBED_DEADLINE` seconds in total. Pending records are left to
+    the job queued when they were saved, and are queued again once they have
+    been pending for longer than `PENDING_RETRY`.
+
+    Args:
+        urls: iterable of media URL strings
+        server_only: if False, embeds of every backend are resolved
+
+    Returns:
+        A dictionary of media URL to EmbedMetadata record. Records which could
+        not be resolved in time remain pending.
+    """
+    EmbedMetadata = apps.get_model('imageboard', 'EmbedMetadata')
+
+    urls = set(urls)
+    if not urls:
+        return {}
+
+    records = {r.url: r for r in EmbedMetadata.objects.filter(url__in=urls)}
+
+    stale = [url for url, r in records.items()
+             if r.status == EmbedMetadata.PENDING and r.updated < now() - PENDING_RETRY]
+    if stale:
+        EmbedMetadata.objects.filter(url__in=stale).update(updated=now())
+        for url in stale:
+            tasks.enqueue(resolve_embed, url)
+
+    unresolved = [url for url in urls
+                  if url not in records and (not server_only or is_server_embed(url))]
+    records.update(tasks.run_concurrently(resolve_embed, unresolved, deadline))
+
+    for url in unresolved:
+        if url not in records:
+            records[url] = EmbedMetadata(url=url)
+
+    return records
+
+def get_known_urls(urls):
+    """ Filter media URLs down to those the imageboard shows
+
+    Invalid or overlong URLs are dropped without touching the database.
+
+    Args:
+        urls: iterable of media URL strings
+
+    Returns:
+        A set of the URLs which are already stored in EmbedMetadata, or are
+        the media of a Post or Comment
+    """
+    EmbedMetadata = apps.get_model('imageboard', 'EmbedMetadata')
+    Post = apps.get_model('imageboard', 'Post')
+    Comment = apps.get_model('imageboard', 'Comment')
+
+    max_length = EmbedMetadata._meta.get_field('url').max_length
+    validate = URLValidator()
+
+    valid = set()
+    for url in urls:
+        if len(url) > max_length:
+            continue
+        try:
+            validate(url)
+        except ValidationError:
+            continue
+        valid.add(url)
+
+    if not valid:
+        return set()
+
+    known = set(EmbedMetadata.objects.filter(url__in=valid).values_list('url', flat=True))
+    for model in (Post, Comment):
+        if valid - known:
+            known.update(model.objects.filter(media__in=valid - known)
+                         .values_list('media', flat=True))
+
+    return known
+
+def is_server_embed(url):
+    """
+    Returns True if the media URL belongs to a backend listed in
+    `IMAGEBOARD_SERVER_EMBEDS`.
+    """
+    try:
+        return detect_backend(url).backend in server_embeds
+    except EmbedVideoException:
+        return False
+
+def resolve_embed(url):
+    """ Request and store the metadata for a media URL
+
+    Template fragments showing the URL are cleared once it is resolved.
+
+    Args:
+        url: Media URL string
+
+    Returns:
+        The EmbedMetadata record for the URL
+    """
+    EmbedMetadata = apps.get_model('imageboard', 'EmbedMetadata')
+    record, created = EmbedMetadata.objects.get_or_create(url=url)
+
+    try:
+        backend = detect_backend(url)
+        backend.is_secure = True
+        record.backend = backend.backend
+        record.title = _value(backend, 'title') or ''
+        record.author = _value(backend, 'username') or ''
+        record.thumbnail = backend.thumbnail or ''
+        record.width = _integer(_value(backend, 'width'))
+        record.height = _integer(_value(backend, 'height'))
+        record.start = str(getattr(backend, 'start', '0'))
+        # Share the circuit breaker of the provider's oEmbed API
+        record.mirrored_thumbnail = mirror_thumbnail(
+            getattr(backend, 'provider', None) or record.backend,
+            record.thumbnail)
+        record.status = EmbedMetadata.RESOLVED
+    except (ProviderUnavailable, ConnectionError, Timeout):
+        # Provider is failing, leave pending to be retried later
+        pass
+    except (EmbedVideoException, RequestException, ValueError):
+        record.status = EmbedMetadata.FAILED
+
+    record.save()
+    clear_embed_fragments(url)
+
+    return record
+
+def mirror_thumbnail(provider, url):
+    """ Copy a provider's thumbnail into media storage
+
+    The thumbnail is downloaded once and resized for the embed box with
+    easy_thumbnails, alongside post thumbnails.
+
+    Args:
+        provider: String representing the provider name, as used for its
+                  oEmbed requests, e.g. 'Youtube'
+        url: Provider thumbnail URL
+
+    Returns:
+        URL string of the resized local thumbnail, or an empty string if it
+        could not be mirrored
+    """
+    if not url:
+        return ''
+
+    extension = posixpath.splitext(url.split('?')[0])[1].lower()
+    if extension not in THUMBNAIL_EXTENSIONS:
+        extension = '.jpg'
+    name = 'embeds/' + hashlib.md5(url.encode('utf-8')).hexdigest() + extension
+    storage = MediaFileStorage()
+
+    try:
+        if not storage.exists(name):
+            r = provider_request(provider, 'get', url, stream=True)
+            r.raise_for_status()
+            data = r.raw.read(THUMBNAIL_MAX_SIZE + 1, decode_content=True)
+            if len(data) > THUMBNAIL_MAX_SIZE:
+                return ''
+            storage.save(name, ContentFile(data))
+
+        thumbnail = get_thumbnailer(storage, relative_name=name)
+        return thumbnail.get_thumbnail(thumbnail_options).url
+    except Exception:
+        logger.exception('Failed to mirror thumbnail `%s`', url)
+        return ''
+
+def clear_embed_fragments(url):
+    """
+    Deletes the cached media fragments of every post and comment showing the
+    media URL.
+    """
+    Post = apps.get_model('imageboard', 'Post')
+    Comment = apps.get_model('imageboard', 'Comment')
+
+    keys = [tf('post_media', [i])
+            for i in Post.objects.filter(media=url).values_list('id', flat=True)]
+    keys += [tf('comment_media', [i])
+             for i in Comment.objects.filter(media=url).values_list('id', flat=True)]
+    cache.delete_many(keys)
+
+
+def _value(backend, name):
+    # Backends expose some attributes as methods and others as properties
+    value = getattr(backend, name, None)
+    return value() if callable(value) else value
+
+def _integer(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
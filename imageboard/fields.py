@@ -1,11 +1,17 @@
 from django.core.exceptions import ValidationError
+from django.template.defaultfilters import filesizeformat
+from django.utils.functional import SimpleLazyObject
 from django.utils.translation import ugettext_lazy as _
 from easy_thumbnails.fields import ThumbnailerField
 from imageboard.files import ThumbnailerImageExtFieldFile, ImageExtField
 from imageboard.conf import IMAGEBOARD_FORMATS as formats
+from imageboard.probe import read_header, sniff_format
+from imageboard.uploadhandlers import get_upload_limit, MAX_SIZE_MESSAGE
 from imageboard.utils import force_close_reader
 
-from io import BytesIO
+from contextlib import contextmanager
+from PIL import Image
+from shutil import copyfileobj
 from tempfile import NamedTemporaryFile
 
 
@@ -18,7 +24,7 @@ class ThumbnailerExtField(ThumbnailerField, ImageExtField):
     default_error_messages = {
         'invalid_file': _("Invalid file, supported files: %(types)s."),
         'invalid_extension': _("File has no valid extension."),
-        'max_size': _("This file is too large (5MB Limit)."),
+        'max_size': MAX_SIZE_MESSAGE,
         'unsupported': _("This format is unsupported,"
                          " supported formats are: %(types)s."),
         'corrupt_file': _("%(file)s is corrupt."),
@@ -29,18 +35,17 @@ class ThumbnailerExtField(ThumbnailerField, ImageExtField):
     def to_python(self, data):
         """
         Checks that the file-upload field data contains a valid source file
-        (GIF, JPG, PNG, WEBM, MP4, etc) using imageio plugins.
+        (GIF, JPG, PNG, WEBM, MP4, etc).
+
+        The format is identified from the file header, images are validated
+        by PIL without decoding their pixels, and videos by an FFmpeg reader.
+        The upload is never copied into memory, and `image` is only decoded
+        when it is first accessed.
         """
         f = super(ThumbnailerExtField, self).to_python(data)
         if f is None:
             return None
 
-        # Check filesize limit
-        # Nginx client_max_body_size is 5MB
-        if f.size > 5 * 1024 * 1024:
-            raise ValidationError(self.error_messages['max_size'],
-                                  code='max_size')
-
         from pathlib import PurePath
 
         # Check for file extension
@@ -49,67 +54,129 @@ class ThumbnailerExtField(ThumbnailerField, ImageExtField):
             raise ValidationError(self.error_messages['invalid_extension'],
                                   code='invalid_extension')
 
-        # Get temporary file path or raw bytes
+        # Work from the uploaded file itself, rather than a copy of it. The
+        # path belongs to the UploadedFile, not the file object it wraps.
         if hasattr(data, 'temporary_file_path'):
-            file = data.temporary_file_path()
+            path = data.temporary_file_path()
         else:
-            if hasattr(data, 'read'):
-                file = BytesIO(data.read())
-            else:
-                file = BytesIO(data['content'])
+            path = None
+        upload = getattr(data, 'file', data)
 
-        from PIL import Image
-        from imageio import get_reader
-
-        try:
-            # Firstly try and recognise BytesIO
-            file = get_reader(file)
-            # Send data to PIL
-            f.image = Image.fromarray(file.get_data(0))
-            # Close the reader
-            force_close_reader(file)
-        except ValueError:
-            # Create a local file
-            with NamedTemporaryFile(suffix=ext) as n:
-                for chunk in data.chunks():
-                    n.write(chunk)
-                try:
-                    # Try and read from temporary file
-                    file = get_reader(n.name)
-                    # Send data to PIL
-                    f.image = Image.fromarray(file.get_data(0))
-                except OSError:
-                    # FFmpeg cannot read video meta
-                    # May be out of memory for a new reader (bug #48)
-                    params = { 'file': f.name }
-                    raise ValidationError(self.error_messages['corrupt_file'],
-                                          code='corrupt_file',
-                                          params=params)
-                except Exception:
-                    # imageio doesn't recognize it as an image.
-                    params = { 'types': self.types }
-                    raise ValidationError(self.error_messages['invalid_file'],
-                                          code='invalid_file',
-                                          params=params)
-                finally:
-                    # Close Named Tempoary File
-                    n.close()
-                    # Make sure any open reader is closed
-                    force_close_reader(file)
+        # Identify the format from the file header
+        format, content_type = sniff_format(read_header(upload))
+        if format is None:
+            params = { 'types': self.types }
+            raise ValidationError(self.error_messages['invalid_file'],
+                                  code='invalid_file',
+                                  params=params)
 
         # Check if this format is enabled
         # See ``imageboard.settings`` for more information
-        if file.format.name in formats.keys():
-            # MIME type is not supported with imageio
-            # Thus if the content type is not detected, it will remain as None
-            f.content_type = Image.MIME.get(f.image.format)
-
-            if hasattr(f, 'seek') and callable(f.seek):
-                f.seek(0)
-
-            return f
-        else:
+        if format not in formats.keys():
             params = { 'types': self.types }
             raise ValidationError(self.error_messages['unsupported'],
                                   code='unsupported',
                                   params=params)
+
+        # Check filesize limit of the identified format
+        # Normally enforced while receiving by UploadLimitHandler
+        limit = get_upload_limit(format)
+        if f.size > limit:
+            raise ValidationError(self.error_messages['max_size'],
+                                  code='max_size',
+                                  params={'limit': filesizeformat(limit)})
+
+        if format == 'FFMPEG':
+            self._check_video(upload, path, ext, f.name)
+            image = SimpleLazyObject(
+                lambda: self._video_image(upload, path, ext))
+        else:
+            self._check_image(upload, f.name)
+            image = SimpleLazyObject(lambda: Image.open(upload_at_start(upload)))
+
+        # The first frame is only decoded if it is used
+        f.image = image
+        f.content_type = content_type
+
+        if hasattr(f, 'seek') and callable(f.seek):
+            f.seek(0)
+
+        return f
+
+    def _check_image(self, upload, name):
+        """
+        Validates an image by parsing its headers with PIL, without decoding
+        the pixel data.
+        """
+        try:
+            Image.open(upload_at_start(upload)).verify()
+        except Exception:
+            params = { 'file': name }
+            raise ValidationError(self.error_messages['corrupt_file'],
+                                  code='corrupt_file',
+                                  params=params)
+        finally:
+            upload.seek(0)
+
+    def _check_video(self, upload, path, ext, name):
+        """
+        Validates a video by opening an FFmpeg reader, which reads the video
+        metadata without decoding any frames.
+        """
+        from imageio import get_reader
+
+        reader = None
+        try:
+            with video_path(upload, path, ext) as video:
+                reader = get_reader(video, 'FFMPEG')
+        except Exception:
+            # FFmpeg cannot read video meta
+            # May be out of memory for a new reader (bug #48)
+            params = { 'file': name }
+            raise ValidationError(self.error_messages['corrupt_file'],
+                                  code='corrupt_file',
+                                  params=params)
+        finally:
+            # Make sure any open reader is closed
+            force_close_reader(reader)
+            upload.seek(0)
+
+    @staticmethod
+    def _video_image(upload, path, ext):
+        """
+        Decodes the first frame of a video into a PIL image.
+        """
+        from imageio import get_reader
+
+        reader = None
+        try:
+            with video_path(upload, path, ext) as video:
+                reader = get_reader(video, 'FFMPEG')
+                return Image.fromarray(reader.get_data(0))
+        finally:
+            force_close_reader(reader)
+            upload.seek(0)
+
+
+def upload_at_start(upload):
+    """
+    Rewinds an uploaded file, returning it for use by PIL.
+    """
+    upload.seek(0)
+    return upload
+
+@contextmanager
+def video_path(upload, path, ext):
+    """
+    Yields a path FFmpeg can read the upload from. Uploads held in memory are
+    written once to a temporary file, which is removed afterwards.
+    """
+    if path is not None:
+        yield path
+        return
+
+    with NamedTemporaryFile(suffix=ext) as n:
+        upload.seek(0)
+        copyfileobj(upload, n)
+        n.flush()
+        yield n.name
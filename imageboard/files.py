@@ -4,9 +4,18 @@ from django.core.files import File
 from django.db.models import signals
 from django.db.models.fields.files import FieldFile, FileField, FileDescriptor
 from django.utils.translation import ugettext_lazy as _
-from easy_thumbnails.files import ThumbnailerFieldFile
+from easy_thumbnails.files import Thumbnailer, ThumbnailerFieldFile
+from collections import namedtuple
+import os
 
 
+ImageDetails = namedtuple('ImageDetails',
+                          'animated format width height duration frames')
+"""
+The attributes stored on an image's owning row. `format` is the
+`IMAGEBOARD_FORMATS` code and `duration` is in seconds. Unknown values are None.
+"""
+
 
 def database_get_image_attributes(file, close=False):
     """
@@ -59,6 +68,66 @@ def database_delete_image_attributes(file):
     SourceAttributes = apps.get_model('imageboard', 'SourceAttributes')
     SourceAttributes.objects.filter(name=file.name.lstrip('./')).delete()
 
+def prefetch_image_attributes(instances, field_name='image'):
+    """
+    Fills the attribute fields of instances whose rows do not store them yet,
+    such as rows saved before the attribute fields existed, with a single
+    SourceAttributes query for all of them. The attributes are also placed in
+    each file's attribute cache.
+
+    Every such row is queued to have its attribute fields stored in the
+    background. Images without SourceAttributes show no attributes until then,
+    rather than being read while rendering.
+    """
+    from django.core.cache import cache
+    from imageboard.tasks import enqueue
+
+    pending = {}
+    for instance in instances:
+        field = instance._meta.get_field(field_name)
+        file = getattr(instance, field.attname)
+        if file and field.format_field and getattr(instance, field.format_field) is None:
+            pending.setdefault(file.name.lstrip('./'), []).append(instance)
+
+    if not pending:
+        return
+
+    SourceAttributes = apps.get_model('imageboard', 'SourceAttributes')
+    for attributes in SourceAttributes.objects.filter(name__in=pending.keys()):
+        for instance in pending[attributes.name]:
+            field = instance._meta.get_field(field_name)
+            getattr(instance, field.attname)._attributes_cache = (
+                attributes.animated, attributes.format)
+            if field.animated_field:
+                setattr(instance, field.animated_field, attributes.animated)
+            setattr(instance, field.format_field, attributes.format)
+
+    queued = {}
+    for instances in pending.values():
+        for instance in instances:
+            label = instance._meta.label
+            # Queue each row once while its job is outstanding
+            if cache.add('image_attributes_queued_%s_%s' % (label, instance.pk),
+                         True, 3600):
+                queued.setdefault(label, []).append(instance.pk)
+
+    for label, pks in queued.items():
+        enqueue(store_image_attributes, label, pks, field_name)
+
+def store_image_attributes(label, pks, field_name='image'):
+    """
+    Background job storing the attribute fields of the given rows.
+    """
+    from django.core.cache import cache
+
+    model = apps.get_model(label)
+    field = model._meta.get_field(field_name)
+
+    for instance in model._default_manager.filter(pk__in=pks).only('pk', field.attname):
+        field.store_attribute_fields(instance)
+
+    cache.delete_many(['image_attributes_queued_%s_%s' % (label, pk) for pk in pks])
+
 def get_image_attributes(file_or_path, close=False):
     """
     Returns a tuple with the animated(boolean) and format(str) of an image.
@@ -68,34 +137,65 @@ def get_image_attributes(file_or_path, close=False):
     If there is an error when accessing the file or `IMAGEBOARD_FORMATS` is not
     configured correctly the defaults will be returned (False, None).
     """
+    details = get_image_details(file_or_path, close=close)
+    return details.animated, details.format
+
+def get_image_details(file_or_path, close=False):
+    """
+    Returns the ImageDetails of an image, given a file or a path string. Files
+    which have been assigned but not yet saved are read from the uploaded
+    file, otherwise the file will be accessed directly at a supplied path. Set
+    `close` to True if `file_or_path` is a file to ensure it is closed.
+
+    Details are read from the file headers by `imageboard.probe`, without
+    decoding any frames. Files it cannot parse are opened with imageio.
+
+    If there is an error when accessing the file or `IMAGEBOARD_FORMATS` is not
+    configured correctly the defaults will be returned.
+    """
     from imageboard.conf import IMAGEBOARD_FORMATS as formats
+    from imageboard.probe import probe_attributes
     from imageboard.utils import force_close_reader
     from imageio import get_reader
     from os.path import exists
 
-    _animated = False
-    _format = None
+    details = ImageDetails(False, None, None, None, None, None)
     f = None
 
-    if hasattr(file_or_path, 'path'):
+    if isinstance(file_or_path, str):
+        if not exists(file_or_path):
+            return details
+        file = file_or_path
+        close = False
+    elif getattr(file_or_path, '_committed', True) is False:
+        # Newly assigned upload, which is not in storage yet
+        file = file_or_path.file
+        close = False
+    elif hasattr(file_or_path, 'path'):
         if not exists(file_or_path.path):
             # No file at path. Should raise an error here but we will return
             # defaults instead.
-            return _animated, _format
+            return details
         file = file_or_path.path
         close = False
     elif hasattr(file_or_path, 'read'):
         file = file_or_path
-        if not exists(file):
-            # No file at path. Should raise an error here but we will return
-            # defaults instead.
-            return _animated, _format
         file.open()
         file.seek(0)
     else:
         raise AttributeError("No file or path given.")
 
     try:
+        # Read the details from the file headers where possible
+        attributes = probe_attributes(file)
+        if attributes is not None and attributes.format in formats:
+            return ImageDetails(
+                formats[attributes.format]['animated'] and attributes.animated,
+                formats[attributes.format]['code'],
+                attributes.width, attributes.height, attributes.duration,
+                attributes.frames)
+
+        # Otherwise fall back to an imageio reader
         f = get_reader(file)
         try:
             _format = formats[f.format.name]['code']
@@ -115,6 +215,8 @@ def get_image_attributes(file_or_path, close=False):
             except ValueError:
                 # GIF only has one frame, is not animated
                 _animated = False
+
+        details = details._replace(animated=_animated, format=_format)
     except ValueError:
         # No reader or format, fail silently
         pass
@@ -122,13 +224,16 @@ def get_image_attributes(file_or_path, close=False):
         # Out of memory for a new reader (bug #48)
         pass
     finally:
+        # Rewind an upload for saving
+        if hasattr(file, 'seek') and not close:
+            file.seek(0)
         # Close the file
         if close:
             file.close()
         # Close the reader
         force_close_reader(f)
 
-    return _animated, _format
+    return details
 
 
 class ImageExtFile(File):
@@ -154,6 +259,14 @@ class ImageExtFile(File):
                 close=close)
         return self._attributes_cache
 
+    def _get_details(self):
+        if not hasattr(self, '_details_cache'):
+            close = self.closed
+            self._details_cache = get_image_details(self, close=close)
+        return self._details_cache
+
+    details = property(_get_details)
+
     def set_image_attributes(self):
         close = self.closed
         database_update_image_attributes(self, close=close)
@@ -184,6 +297,21 @@ class ImageExtFileDescriptor(FileDescriptor):
 
 
 class ImageExtFieldFile(ImageExtFile, FieldFile):
+    def set_image_attributes(self):
+        """
+        Update the image attributes, and the attribute fields of the owning
+        row.
+        """
+        super(ImageExtFieldFile, self).set_image_attributes()
+
+        for cache in ('_attributes_cache', '_details_cache'):
+            if hasattr(self, cache):
+                delattr(self, cache)
+
+        self.field.store_attribute_fields(self.instance)
+
+    set_image_attributes.alters_data = True
+
     def delete(self, *args, **kwargs):
         """
         Delete the image attribute cache.
@@ -203,10 +331,23 @@ class ImageExtField(FileField):
     description = _("Image and Video")
 
     def __init__(self, verbose_name=None, name=None, animated_field=None,
-            format_field=None, **kwargs):
+            format_field=None, width_field=None, height_field=None,
+            duration_field=None, frames_field=None, **kwargs):
         self.animated_field, self.format_field = animated_field, format_field
+        self.width_field, self.height_field = width_field, height_field
+        self.duration_field, self.frames_field = duration_field, frames_field
         super(ImageExtField, self).__init__(verbose_name, name, **kwargs)
 
+    @property
+    def attribute_fields(self):
+        """
+        Names of the model fields holding the image attributes, in
+        ImageDetails order.
+        """
+        return [getattr(self, attribute + '_field')
+                for attribute in ImageDetails._fields
+                if getattr(self, attribute + '_field')]
+
     def check(self, **kwargs):
         errors = super(ImageExtField, self).check(**kwargs)
         errors.extend(self._check_image_library_installed())
@@ -235,10 +376,9 @@ class ImageExtField(FileField):
 
     def deconstruct(self):
         name, path, args, kwargs = super(ImageExtField, self).deconstruct()
-        if self.animated_field:
-            kwargs['animated_field'] = self.animated_field
-        if self.format_field:
-            kwargs['format_field'] = self.format_field
+        for attribute in ImageDetails._fields:
+            if getattr(self, attribute + '_field'):
+                kwargs[attribute + '_field'] = getattr(self, attribute + '_field')
         return name, path, args, kwargs
 
     def contribute_to_class(self, cls, name, **kwargs):
@@ -252,19 +392,19 @@ class ImageExtField(FileField):
 
     def update_attribute_fields(self, instance, force=False, *args, **kwargs):
         """
-        Updates field's animated and format fields, if they are defined.
+        Updates field's animated, format, width, height, duration, and frames
+        fields, if they are defined.
 
         This method is connected to the model's post_init signal to update
-        attributes after instantiating a model instance. However, attributes
-        won't be updated if the fields are already populated. This avoids
-        unnecessary recalculation when loading an object from the database.
+        attributes after instantiating a model instance with a new file.
+        Attributes are never calculated for files already in storage, which
+        are loaded from the database along with their attribute fields.
 
         Attributes can be forced to update with force=True, which is how
         ImageExtFileDescriptor.__set__ calls this method.
         """
         # Nothing to update if the field doesn't have attribute fields.
-        has_attribute_fields = self.animated_field or self.format_field
-        if not has_attribute_fields:
+        if not self.attribute_fields:
             return
 
         # getattr will call the FileDescriptor's __get__ method, which
@@ -272,41 +412,66 @@ class ImageExtField(FileField):
         # (ImageExtFieldFile in this case).
         file = getattr(instance, self.attname)
 
-        # Nothing to update with no file and not being forced to update.
-        if not file and not force:
-            return
-
-        attribute_fields_filled = not(
-            (self.animated_field and not getattr(instance, self.animated_field))
-            or (self.format_field and not getattr(instance, self.format_field))
-        )
-        # When both attribute fields have values, we are most likely loading
-        # data from the database or updating an image field that already had
-        # an image stored.  In the first case, we don't want to update the
-        # attribute fields because we are already getting their values from the
-        # database.  In the second case, we do want to update the attributes
-        # fields and will skip this return because force will be True since we
-        # were called from ImageExtFileDescriptor.__set__.
-        if attribute_fields_filled and not force:
+        # Only newly assigned files are read, unless being forced to update.
+        # Rendering never reads a stored file for its attributes.
+        if not force and (not file or file._committed):
             return
 
         # file should be an instance of ImageExtFieldFile or should be None.
         if file:
-            animated = file.animated
-            format = file.format
+            details = file.details
         else:
             # No file, so clear attributes fields.
-            animated = False
-            format = None
+            details = ImageDetails(False, None, None, None, None, None)
+
+        # Update the attribute fields.
+        for attribute, value in zip(ImageDetails._fields, details):
+            field = getattr(self, attribute + '_field')
+            if field:
+                setattr(instance, field, value)
+
+    def store_attribute_fields(self, instance):
+        """
+        Recalculates the attribute fields of a saved instance, and updates its
+        row directly without sending save signals.
+        """
+        fields = self.attribute_fields
+        if not fields or instance.pk is None:
+            return
+
+        self.update_attribute_fields(instance, force=True)
+        type(instance)._default_manager.filter(pk=instance.pk).update(
+            **{name: getattr(instance, name) for name in fields})
+
+
+class ThumbnailFormatMixin(object):
+    """
+    Mixin for easy_thumbnails Thumbnailers which saves a thumbnail in the
+    format named by its `FORMAT` option, such as `webp`, rather than the
+    configured thumbnail extension. Uppercase options are not part of the
+    prepared options, so the format is only reflected in the extension.
+    """
+
+    def get_thumbnail_name(self, thumbnail_options, transparent=False,
+                           high_resolution=False):
+        name = super(ThumbnailFormatMixin, self).get_thumbnail_name(
+            thumbnail_options, transparent=transparent,
+            high_resolution=high_resolution)
 
-        # Update the animated and format fields.
-        if self.animated_field:
-            setattr(instance, self.animated_field, animated)
-        if self.format_field:
-            setattr(instance, self.format_field, format)
+        format = thumbnail_options.get('FORMAT')
+        if format:
+            name = '%s.%s' % (os.path.splitext(name)[0], format)
+        return name
 
 
-class ThumbnailerImageExtFieldFile(ImageExtFieldFile, ThumbnailerFieldFile):
+class FormatThumbnailer(ThumbnailFormatMixin, Thumbnailer):
+    """
+    Thumbnailer for a source in storage, without a model instance.
+    """
+
+
+class ThumbnailerImageExtFieldFile(ThumbnailFormatMixin, ImageExtFieldFile,
+                                   ThumbnailerFieldFile):
     """
     Metaclass for ThumbnailerExtField which extends easy_thumbnails to add
     methods for generating and returning source image attributes.
@@ -314,8 +479,11 @@ class ThumbnailerImageExtFieldFile(ImageExtFieldFile, ThumbnailerFieldFile):
 
     def delete(self, *args, **kwargs):
         """
-        Delete the image attributes, sources, and thumbnails.
+        Delete the image attributes, sources, thumbnails, and their cached URLs.
         """
+        from imageboard.thumbnails import forget_thumbnails
+
+        forget_thumbnails(self)
         ImageExtFieldFile.delete(self, *args, **kwargs)
         ThumbnailerFieldFile.delete(self, *args, **kwargs)
 
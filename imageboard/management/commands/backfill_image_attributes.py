@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from imageboard.models import Post, Comment
+
+
+class Command(BaseCommand):
+    help = ('Stores the animated, format, width, height, duration, and frame '
+            'count attributes of existing post and comment images on their rows.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help='Recalculate images which already have stored attributes.'
+        )
+
+    def handle(self, *args, **options):
+        for model in (Post, Comment):
+            field = model._meta.get_field('image')
+            images = model.objects.exclude(image='').order_by('pk')
+            if not options['all']:
+                images = images.filter(**{field.format_field + '__isnull': True})
+
+            count = 0
+            for instance in images.only('pk', 'image').iterator():
+                field.store_attribute_fields(instance)
+                count += 1
+
+            self.stdout.write('Updated %d %s images.' % (
+                count, model._meta.verbose_name))
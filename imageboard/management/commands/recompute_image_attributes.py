@@ -0,0 +1,104 @@
+from imageboard.files import get_image_details
+from imageboard.management.parallel import ParallelCommand
+from imageboard.models import Post, Comment, SourceAttributes
+
+import os
+
+
+def _recompute(item):
+    """
+    Worker task returning the image name with its ImageDetails, or with the
+    error preventing them from being read. Missing or unreadable sources are
+    failures, so their stored attributes are left untouched.
+    """
+    name, path = item
+    if not os.path.exists(path):
+        return name, None, 'Source file not found'
+
+    try:
+        details = get_image_details(path)
+        if details.format is None:
+            return name, None, 'Source file could not be read'
+        return name, tuple(details), None
+    except MemoryError:
+        return name, None, 'Out of memory'
+    except Exception as e:
+        return name, None, str(e) or e.__class__.__name__
+
+
+class Command(ParallelCommand):
+    help = ('Recomputes the SourceAttributes of post and comment images in a '
+            'pool of worker processes, along with the attributes stored on '
+            'their rows. Progress is checkpointed so an interrupted run '
+            'resumes where it stopped.')
+
+    checkpoint = '.recompute_image_attributes.json'
+    selecting_options = ('model', 'format', 'missing')
+
+    models = {
+        'post': Post,
+        'comment': Comment,
+    }
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--model',
+            choices=sorted(self.models),
+            help='Only recompute images of posts or comments.'
+        )
+        parser.add_argument(
+            '--format',
+            help='Only recompute images stored with this format code, e.g. GIF.'
+        )
+        parser.add_argument(
+            '--missing',
+            action='store_true',
+            default=False,
+            help='Only recompute images without SourceAttributes.'
+        )
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        items = [(n, storage.path(n)) for n in self.get_names(options)]
+
+        done, failed = self.run(items, _recompute, options)
+        self.stdout.write('Recomputed %d images, %d failed.' % (done - failed, failed))
+
+    def get_names(self, options):
+        """
+        Returns the distinct image names selected by the options.
+        """
+        models = [self.models[options['model']]] if options['model'] else \
+            list(self.models.values())
+
+        names = set()
+        for model in models:
+            images = model.objects.exclude(image='')
+            if options['format']:
+                images = images.filter(image_format=options['format'])
+            names.update(images.values_list('image', flat=True))
+
+        names = set(n.lstrip('./') for n in names)
+        if options['missing']:
+            names -= set(SourceAttributes.objects.filter(
+                name__in=names).values_list('name', flat=True))
+
+        return names
+
+    def store(self, name, details):
+        """
+        Saves the recomputed attributes of an image, in SourceAttributes and
+        on every row showing the image.
+        """
+        animated, format, width, height, duration, frames = details
+
+        SourceAttributes.objects.update_or_create(
+            name=name,
+            defaults={'animated': animated, 'format': format})
+
+        for model in self.models.values():
+            model.objects.filter(image__in=(name, './' + name)).update(
+                image_animated=animated, image_format=format,
+                image_width=width, image_height=height,
+                image_duration=duration, image_frames=frames)
@@ -0,0 +1,145 @@
+from django.core.management.base import CommandError
+from easy_thumbnails.alias import aliases
+from imageboard.files import FormatThumbnailer
+from imageboard.management.parallel import ParallelCommand
+from imageboard.models import Post, Comment
+from imageboard.thumbnails import decode_once, get_variants
+from imageboard.uploadhandlers import FORMAT_EXTENSIONS
+
+from multiprocessing import BoundedSemaphore
+import os
+
+_decoders = None
+
+
+def _init_decoders(decoders):
+    global _decoders
+    _decoders = decoders
+
+def _regenerate(item):
+    """
+    Worker task generating the thumbnails of an image for each set of alias
+    or derivative options. Returns the image name with a list of `(thumbnail
+    name, URL, generated)` tuples, or with the error preventing them from
+    being made.
+
+    The source is decoded once for all of an image's thumbnails. Videos are
+    decoded by FFmpeg, so only a limited number of workers may generate a
+    video thumbnail at once.
+    """
+    name, (options_list, force) = item
+    video = FORMAT_EXTENSIONS.get(os.path.splitext(name)[1].lower()) == 'FFMPEG'
+
+    try:
+        thumbnailer = FormatThumbnailer(
+            name=name, source_storage=Post._meta.get_field('image').storage)
+        thumbnails = []
+
+        with decode_once(thumbnailer):
+            for options in options_list:
+                thumbnail_name = thumbnailer.get_thumbnail_name(options)
+                thumbnail = None if force else thumbnailer.get_existing_thumbnail(options)
+                if thumbnail is not None:
+                    thumbnails.append((thumbnail_name, thumbnail.url, False))
+                    continue
+
+                if video:
+                    _decoders.acquire()
+                try:
+                    thumbnail = thumbnailer.generate_thumbnail(options)
+                finally:
+                    if video:
+                        _decoders.release()
+
+                thumbnailer.save_thumbnail(thumbnail)
+                thumbnails.append((thumbnail_name, thumbnail.url, True))
+
+        return name, thumbnails, None
+    except MemoryError:
+        return name, None, 'Out of memory'
+    except Exception as e:
+        return name, None, str(e) or e.__class__.__name__
+
+
+class Command(ParallelCommand):
+    help = ('Regenerates a thumbnail alias and its derivatives for every post '
+            'and comment image in a pool of worker processes, skipping '
+            'thumbnails which are up to date. Progress is checkpointed so an '
+            'interrupted run resumes where it stopped.')
+
+    checkpoint = '.regenerate_thumbnails.json'
+    selecting_options = ('alias', 'model', 'force')
+
+    models = {
+        'post': Post,
+        'comment': Comment,
+    }
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            'alias',
+            help='Name of the THUMBNAIL_ALIASES alias to regenerate, e.g. avatar.'
+        )
+        parser.add_argument(
+            '--model',
+            choices=sorted(self.models),
+            help='Only regenerate thumbnails of posts or comments.'
+        )
+        parser.add_argument(
+            '--decoders',
+            type=int,
+            default=1,
+            help='Number of video thumbnails generated at once. Defaults to 1.'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            default=False,
+            help='Regenerate thumbnails which are already up to date.'
+        )
+
+    def handle(self, *args, **options):
+        if options['decoders'] < 1:
+            raise CommandError('--decoders must be at least 1.')
+
+        models = [self.models[options['model']]] if options['model'] else \
+            list(self.models.values())
+
+        images = {}
+        for model in models:
+            # Aliases may be limited to, or overridden for, a model's field
+            target = '%s.image' % model._meta.label
+            alias_options = aliases.get(options['alias'], target=target)
+            if not alias_options:
+                raise CommandError('Unknown thumbnail alias "%s" for %s.' % (
+                    options['alias'], target))
+            variants = [v for format, scale, v in get_variants(alias_options)]
+
+            for name in model.objects.exclude(image='').values_list('image', flat=True):
+                alias_list = images.setdefault(name.lstrip('./'), [])
+                for variant in variants:
+                    if variant not in alias_list:
+                        alias_list.append(variant)
+
+        items = [(name, (alias_list, options['force']))
+                 for name, alias_list in images.items()]
+
+        self.generated = self.skipped = 0
+        done, failed = self.run(items, _regenerate, options, _init_decoders,
+                                (BoundedSemaphore(options['decoders']),))
+
+        self.stdout.write('Generated %d thumbnails, %d up to date, %d images failed.' % (
+            self.generated, self.skipped, failed))
+
+    def store(self, name, thumbnails):
+        """
+        Counts an image's generated and skipped thumbnails. Their URLs are not
+        cached from here, as the command's cache may not be shared with the
+        web processes, which find new thumbnails in storage instead.
+        """
+        for thumbnail_name, url, generated in thumbnails:
+            if generated:
+                self.generated += 1
+            else:
+                self.skipped += 1
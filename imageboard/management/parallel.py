@@ -0,0 +1,175 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from multiprocessing import Pool
+import json
+import os
+import time
+
+
+def _init_worker(memory_limit, initializer, initargs):
+    """
+    Worker initializer restricting the address space of the worker, and the
+    FFmpeg subprocesses it starts, to `memory_limit` bytes (bug #48).
+    """
+    if memory_limit:
+        try:
+            import resource
+        except ImportError:
+            # Not available on this platform
+            pass
+        else:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    if initializer is not None:
+        initializer(*initargs)
+
+
+class ParallelCommand(BaseCommand):
+    """
+    Base for commands processing images in a pool of worker processes.
+
+    Items are processed in order of their name, and the last completed name
+    is saved to a JSON checkpoint so an interrupted run resumes after it. The
+    checkpoint records the `selecting_options` which chose the items, and a
+    run with different options will not resume from it.
+
+    Workers return a `(name, result, error)` tuple, and each result without
+    an error is passed to `store` in the parent process.
+    """
+    checkpoint = None
+    selecting_options = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=max((os.cpu_count() or 2) // 2, 1),
+            help='Number of worker processes. Defaults to half the CPUs.'
+        )
+        parser.add_argument(
+            '--memory-limit',
+            type=int,
+            default=1024,
+            help='Address space limit of each worker in megabytes, 0 for none.'
+        )
+        parser.add_argument(
+            '--tasks-per-worker',
+            type=int,
+            default=100,
+            help='Images processed before a worker is replaced.'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=self.checkpoint,
+            help='File recording progress, removed once the run completes.'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            default=False,
+            help='Ignore an existing checkpoint.'
+        )
+        parser.add_argument(
+            '--progress',
+            type=int,
+            default=100,
+            help='Report progress and save the checkpoint every N images.'
+        )
+
+    def run(self, items, worker, options, initializer=None, initargs=()):
+        """ Process items in the worker pool
+
+        Args:
+            items: list of `(name, argument)` tuples, where `argument` is
+                   passed to `worker` along with the name
+            worker: top level function taking a `(name, argument)` tuple
+            options: command options
+            initializer: optional function run by each worker as it starts
+            initargs: arguments for `initializer`
+
+        Returns:
+            A tuple of the number of items processed and failed
+        """
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+
+        checkpoint = options['checkpoint']
+        selecting = {k: options[k] for k in self.selecting_options}
+        items = sorted(items)
+
+        last = None
+        if not options['restart'] and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+            if state.get('options') != selecting:
+                raise CommandError(
+                    'Checkpoint %s was saved by a run with different options %s. '
+                    'Use --restart to discard it, or --checkpoint to use '
+                    'another file.' % (checkpoint, state.get('options')))
+            last = state.get('last')
+            items = [i for i in items if i[0] > last]
+            self.stdout.write('Resuming after %s.' % last)
+
+        total = len(items)
+        self.stdout.write('Processing %d images with %d workers.' % (
+            total, options['workers']))
+        if not total:
+            self.remove_checkpoint(checkpoint)
+            return 0, 0
+
+        # Workers must not share the parent's database connections
+        connections.close_all()
+
+        pool = Pool(options['workers'], _init_worker,
+                    (options['memory_limit'] * 1024 * 1024, initializer, initargs),
+                    options['tasks_per_worker'])
+        start = time.time()
+        done = failed = 0
+
+        try:
+            # Results are returned in name order, so the checkpoint is the
+            # last name every earlier item has been processed before
+            for name, result, error in pool.imap(worker, items, chunksize=4):
+                if error is None:
+                    self.store(name, result)
+                else:
+                    failed += 1
+                    self.stderr.write('%s: %s' % (name, error))
+
+                done += 1
+                last = name
+                if done % options['progress'] == 0 or done == total:
+                    self.save_checkpoint(checkpoint, last, selecting)
+                    elapsed = time.time() - start
+                    self.stdout.write('%d/%d images, %d failed, %.1f images/s.' % (
+                        done, total, failed, done / elapsed if elapsed else 0))
+        except KeyboardInterrupt:
+            pool.terminate()
+            self.save_checkpoint(checkpoint, last, selecting)
+            raise CommandError('Interrupted, run again to resume after %s.' % last)
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+        self.remove_checkpoint(checkpoint)
+        return done, failed
+
+    def store(self, name, result):
+        """
+        Handles the result of a successfully processed item.
+        """
+        pass
+
+    @staticmethod
+    def save_checkpoint(checkpoint, last, selecting):
+        if last is None:
+            return
+        with open(checkpoint, 'w') as f:
+            json.dump({'last': last, 'options': selecting}, f)
+
+    @staticmethod
+    def remove_checkpoint(checkpoint):
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
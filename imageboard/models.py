@@ -1,5 +1,5 @@
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.utils.timezone import now
@@ -7,9 +7,10 @@ from django.utils.translation import ugettext_lazy as _
 from embed_video.fields import EmbedVideoField
 from imageboard.fields import ThumbnailerExtField
 from imageboard.storage import MediaFileStorage
-import hashlib
+from imageboard import activity, embeds, ranking, thumbnails
+from imageboard.uploadhandlers import get_content_hash
 
-IMAGES_HELP_TEXT = _('Images and WEBM/MP4. Limit: 5MB.')
+IMAGES_HELP_TEXT = _('Images and WEBM/MP4. Limit: 5MB, 10MB for video.')
 EMBED_VIDEO_HELP_TEXT = _('Youtube, Vimeo, Soundcloud, '
 						  'Streamable, Dailymotion, and Gfycat.')
 
@@ -24,8 +25,44 @@ class Post(models.Model):
 	image = ThumbnailerExtField(
 		storage=MediaFileStorage(),
 		blank=False,
+		animated_field='image_animated',
+		format_field='image_format',
+		width_field='image_width',
+		height_field='image_height',
+		duration_field='image_duration',
+		frames_field='image_frames',
 		help_text=IMAGES_HELP_TEXT
 	)
+	image_animated = models.BooleanField(
+		default=False,
+		editable=False
+	)
+	image_format = models.CharField(
+		max_length=16,
+		blank=True,
+		null=True,
+		editable=False
+	)
+	image_width = models.PositiveIntegerField(
+		blank=True,
+		null=True,
+		editable=False
+	)
+	image_height = models.PositiveIntegerField(
+		blank=True,
+		null=True,
+		editable=False
+	)
+	image_duration = models.FloatField(
+		blank=True,
+		null=True,
+		editable=False
+	)
+	image_frames = models.PositiveIntegerField(
+		blank=True,
+		null=True,
+		editable=False
+	)
 	media = EmbedVideoField(
 		_('media url'),
 		blank=True,
@@ -50,13 +87,7 @@ class Post(models.Model):
 		Generate image name hash.
 		"""
 		if self.image and not self.id: # New Post with image
-			md5 = hashlib.md5()
-			while True:
-				data = self.image.read(128)
-				if not data:
-					break
-				md5.update(data)
-			image_hash = md5.hexdigest()
+			image_hash = get_content_hash(self.image)
 			image_extension = self.image.name.split('.')[-1]
 			image_name = image_hash + '.' + image_extension
 			self.image.name = image_name
@@ -85,6 +116,52 @@ class Post(models.Model):
 		super(Post, self).delete(*args, **kwargs)
 
 
+@receiver(post_save, sender=Post)
+def update_post_rank(sender, instance, **kwargs):
+	"""
+	Move a created or bumped post to its new position in the rank index
+	"""
+	ranking.update_post(instance)
+
+@receiver(post_delete, sender=Post)
+def remove_post_rank(sender, instance, **kwargs):
+	"""
+	Remove a deleted post from the rank index
+	"""
+	ranking.remove_post(instance.id)
+
+@receiver(post_save, sender=Post)
+def push_post_activity(sender, instance, created, **kwargs):
+	"""
+	Add a new post to the latest activity list
+	"""
+	if created:
+		activity.push_activity(activity.post_activity(instance))
+
+@receiver(post_save, sender=Post)
+def request_post_thumbnails(sender, instance, created, **kwargs):
+	"""
+	Queue generation of the post image thumbnails
+	"""
+	if created and instance.image:
+		thumbnails.request_thumbnails(instance.image)
+
+@receiver(post_save, sender=Post)
+def request_post_embed(sender, instance, **kwargs):
+	"""
+	Queue resolution of the post media metadata
+	"""
+	if instance.media:
+		embeds.request_embed(instance.media)
+
+@receiver(post_delete, sender=Post)
+def remove_post_activity(sender, instance, **kwargs):
+	"""
+	Remove a deleted post and its comments from the latest activity list
+	"""
+	activity.remove_activity(activity.POST, instance.id)
+
+
 class Comment(models.Model):
 	user = models.ForeignKey(
 		User
@@ -97,8 +174,44 @@ class Comment(models.Model):
 	image = ThumbnailerExtField(
 		storage=MediaFileStorage(),
 		blank=True,
+		animated_field='image_animated',
+		format_field='image_format',
+		width_field='image_width',
+		height_field='image_height',
+		duration_field='image_duration',
+		frames_field='image_frames',
 		help_text=IMAGES_HELP_TEXT
 	)
+	image_animated = models.BooleanField(
+		default=False,
+		editable=False
+	)
+	image_format = models.CharField(
+		max_length=16,
+		blank=True,
+		null=True,
+		editable=False
+	)
+	image_width = models.PositiveIntegerField(
+		blank=True,
+		null=True,
+		editable=False
+	)
+	image_height = models.PositiveIntegerField(
+		blank=True,
+		null=True,
+		editable=False
+	)
+	image_duration = models.FloatField(
+		blank=True,
+		null=True,
+		editable=False
+	)
+	image_frames = models.PositiveIntegerField(
+		blank=True,
+		null=True,
+		editable=False
+	)
 	media = EmbedVideoField(
 		blank=True,
 		null=True,
@@ -121,13 +234,7 @@ class Comment(models.Model):
 			self.post.save()
 
 			if self.image: # Has image
-				md5 = hashlib.md5()
-				while True:
-					data = self.image.read(128)
-					if not data:
-						break
-					md5.update(data)
-				image_hash = md5.hexdigest()
+				image_hash = get_content_hash(self.image)
 				image_extension = self.image.name.split('.')[-1]
 				image_name = image_hash + '.' + image_extension
 				self.image.name = image_name
@@ -164,6 +271,37 @@ class Comment(models.Model):
 		super(Comment, self).delete(*args, **kwargs)
 
 
+@receiver(post_save, sender=Comment)
+def push_comment_activity(sender, instance, created, **kwargs):
+	"""
+	Add a new comment to the latest activity list
+	"""
+	if created:
+		activity.push_activity(activity.comment_activity(instance))
+
+@receiver(post_save, sender=Comment)
+def request_comment_thumbnails(sender, instance, created, **kwargs):
+	"""
+	Queue generation of the comment image thumbnails
+	"""
+	if created and instance.image:
+		thumbnails.request_thumbnails(instance.image)
+
+@receiver(post_save, sender=Comment)
+def request_comment_embed(sender, instance, **kwargs):
+	"""
+	Queue resolution of the comment media metadata
+	"""
+	if instance.media:
+		embeds.request_embed(instance.media)
+
+@receiver(post_delete, sender=Comment)
+def remove_comment_activity(sender, instance, **kwargs):
+	"""
+	Remove a deleted comment from the latest activity list
+	"""
+	activity.remove_activity(activity.COMMENT, instance.id)
+
 class UserProfile(models.Model):
 	PAGINATION_CHOICES = (
 		(5, '5'),
@@ -233,3 +371,62 @@ class SourceAttributes(models.Model):
 			return "Animated " + self.format
 		else:
 			return self.format
+
+
+class EmbedMetadata(models.Model):
+	PENDING = 'pending'
+	RESOLVED = 'resolved'
+	FAILED = 'failed'
+	STATUS_CHOICES = (
+		(PENDING, 'Pending'),
+		(RESOLVED, 'Resolved'),
+		(FAILED, 'Failed')
+	)
+
+	url = models.CharField(max_length=255, unique=True)
+	backend = models.CharField(max_length=64, blank=True)
+	status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+	title = models.CharField(max_length=255, blank=True)
+	author = models.CharField(max_length=255, blank=True)
+	thumbnail = models.URLField(max_length=500, blank=True)
+	mirrored_thumbnail = models.CharField(max_length=255, blank=True)
+	width = models.PositiveIntegerField(blank=True, null=True)
+	height = models.PositiveIntegerField(blank=True, null=True)
+	start = models.CharField(max_length=16, default='0')
+	updated = models.DateTimeField(auto_now=True)
+
+	def __str__(self):
+		return self.url
+
+	@property
+	def is_resolved(self):
+		return self.status == self.RESOLVED
+
+	@property
+	def thumbnail_url(self):
+		"""
+		Returns the locally mirrored thumbnail, or the provider's thumbnail
+		if it has not been mirrored.
+		"""
+		return self.mirrored_thumbnail or self.thumbnail
+
+	def as_oembed(self):
+		""" Serialise the metadata for client side embeds
+
+		Returns:
+			A dictionary using the oEmbed response field names, or holding an
+			`error` message if the metadata is not available
+		"""
+		if self.status == self.FAILED:
+			return { 'error': 'Invalid Video Url' }
+		if self.status == self.PENDING:
+			return { 'error': 'Pending' }
+
+		return {
+			'type': 'video',
+			'title': self.title,
+			'author_name': self.author,
+			'width': self.width,
+			'height': self.height,
+			'thumbnail_url': self.thumbnail_url
+		}
@@ -0,0 +1,248 @@
+"""
+Keyset (cursor) pagination for Pifti
+
+Pages are addressed by the `(modified, id)` key of the row preceding them
+rather than by an OFFSET, so rendering any page costs the same as page 1 and
+no COUNT(*) is required.
+"""
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import datetime, timedelta
+
+from django.db.models import Q
+from django.utils.timezone import utc
+
+EPOCH = datetime(1970, 1, 1, tzinfo=utc)
+LAST = 'last'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(number, key=None):
+    """ Build an opaque cursor token
+
+    Args:
+        number: integer page number the cursor points at, or None if unknown
+        key: `(modified, id)` tuple of the row preceding the page, or None for
+             the first page
+
+    Returns:
+        URL safe string representing the cursor
+    """
+    if key is None:
+        raw = '%s::' % (number or '')
+    else:
+        modified, pk = key
+        delta = modified - EPOCH
+        micro = (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+        raw = '%s:%d:%d' % (number or '', micro, pk)
+
+    return urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    """ Parse an opaque cursor token
+
+    Args:
+        token: String produced by `encode_cursor` or `LAST`
+
+    Returns:
+        A tuple of the page number (or None) and the `(modified, id)` key (or
+        None for the first page)
+
+    Raises:
+        InvalidCursor: if the token cannot be parsed
+    """
+    try:
+        padding = '=' * (-len(token) % 4)
+        raw = urlsafe_b64decode((token + padding).encode('ascii')).decode('ascii')
+        number, micro, pk = raw.split(':')
+        number = int(number) if number else None
+        if micro == '' and pk == '':
+            return number, None
+        modified = EPOCH + timedelta(microseconds=int(micro))
+        return number, (modified, int(pk))
+    except (BinasciiError, UnicodeError, ValueError):
+        raise InvalidCursor(token)
+
+
+class CursorPage(object):
+    """
+    A page of results produced by `CursorPaginator`. Mirrors the parts of
+    `django.core.paginator.Page` used by the templates, plus cursor tokens for
+    the neighbouring pages.
+
+    `number` is None when the page was reached without a known offset, such as
+    the last page.
+    """
+    def __init__(self, object_list, number, paginator):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self.next_cursor = None
+        self.next_next_cursor = None
+        self.previous_cursor = None
+        self.previous_previous_cursor = None
+
+    def __repr__(self):
+        return '<Page %s>' % (self.number or '?')
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_page_number(self):
+        if self.number is None:
+            return None
+        return self.number + 1
+
+    def previous_page_number(self):
+        if self.number is None:
+            return None
+        return self.number - 1
+
+
+class CursorPaginator(object):
+    """
+    Paginates a queryset ordered by `-modified, -id` using keyset lookups.
+
+    Each page performs one query for the page rows plus two narrow, indexed
+    `values_list` queries to discover the cursors of up to two pages either
+    side of it.
+    """
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+
+    def page(self, token=None):
+        """
+        Returns a CursorPage for the given cursor token. Missing or invalid
+        tokens return the first page.
+        """
+        if token == LAST:
+            return self._last_page()
+
+        try:
+            number, key = decode_cursor(token) if token else (1, None)
+        except InvalidCursor:
+            number, key = 1, None
+
+        qs = self.object_list
+        if key is not None:
+            qs = qs.filter(self._after(key))
+        objects = list(qs[:self.per_page])
+
+        if not objects and key is not None:
+            # Cursor points past the end of the list
+            return self._last_page()
+
+        return self._build(objects, number, key)
+
+    def page_number(self, number):
+        """
+        Returns the CursorPage for a page number. The page rows are sliced
+        with an OFFSET, but no COUNT(*) is performed. Numbers past the end of
+        the list return the last page.
+        """
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            number = 1
+
+        offset = (number - 1) * self.per_page
+        # Fetch the row preceding the page alongside the page itself
+        start = max(offset - 1, 0)
+        objects = list(self.object_list[start:offset + self.per_page])
+
+        if offset > 0:
+            if len(objects) < 2:
+                return self._last_page()
+            preceding, objects = objects[0], objects[1:]
+            key = self._key(preceding)
+        else:
+            key = None
+
+        return self._build(objects, number, key)
+
+    def _last_page(self):
+        """
+        The oldest `per_page` rows, found with a reversed scan. As the total
+        is never counted the page number is unknown.
+        """
+        objects = list(self.object_list.reverse()[:self.per_page])
+        objects.reverse()
+
+        if not objects:
+            return self._build(objects, 1, None)
+
+        preceding = self._values(self.object_list.reverse().filter(
+            self._before(self._key(objects[0]))))[:1]
+        key = preceding[0] if preceding else None
+        number = None if key else 1
+
+        return self._build(objects, number, key)
+
+    def _build(self, objects, number, key):
+        page = CursorPage(objects, number, self)
+        per_page = self.per_page
+
+        if objects:
+            ahead = self._values(self.object_list.filter(
+                self._after(self._key(objects[-1]))))[:per_page + 1]
+            if ahead:
+                page.next_cursor = self._encode(number, 1, self._key(objects[-1]))
+            if len(ahead) > per_page:
+                page.next_next_cursor = self._encode(number, 2, ahead[per_page - 1])
+
+        if key is not None:
+            # Rows preceding this page, nearest first. `key` itself is the
+            # last row of the previous page.
+            behind = [key] + list(self._values(self.object_list.reverse().filter(
+                self._before(key)))[:2 * per_page])
+            page.previous_cursor = self._encode(
+                number, -1, behind[per_page] if len(behind) > per_page else None)
+            if len(behind) > per_page:
+                page.previous_previous_cursor = self._encode(
+                    number, -2,
+                    behind[2 * per_page] if len(behind) > 2 * per_page else None)
+
+        return page
+
+    @staticmethod
+    def _encode(number, step, key):
+        if key is None:
+            return encode_cursor(1)
+        return encode_cursor(number + step if number else None, key)
+
+    @staticmethod
+    def _key(obj):
+        return obj.modified, obj.id
+
+    @staticmethod
+    def _values(qs):
+        return qs.values_list('modified', 'id')
+
+    @staticmethod
+    def _after(key):
+        modified, pk = key
+        return Q(modified__lt=modified) | Q(modified=modified, id__lt=pk)
+
+    @staticmethod
+    def _before(key):
+        modified, pk = key
+        return Q(modified__gt=modified) | Q(modified=modified, id__gt=pk)
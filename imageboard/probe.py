@@ -0,0 +1,345 @@
+"""
+Header based format probing for Pifti
+
+Uploaded files are recognised by their magic bytes, so the format of an upload
+is known without decoding it or handing it to an imageio reader.
+
+The remaining attributes are read from container and frame headers: GIF image
+descriptors, PNG chunks, JPEG frame markers, WebM elements, and MP4 boxes.
+Pixel data is skipped over and never decoded.
+"""
+from collections import namedtuple
+import struct
+
+HEADER_SIZE = 32
+
+FORMAT_SIGNATURES = (
+    # (offset, magic bytes, imageio format name, MIME type)
+    (0, b'\xff\xd8\xff', 'JPEG', 'image/jpeg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'PNG', 'image/png'),
+    (0, b'GIF87a', 'GIF', 'image/gif'),
+    (0, b'GIF89a', 'GIF', 'image/gif'),
+    (0, b'\x00\x00\x01\x00', 'ICO', 'image/x-icon'),
+    (0, b'\x1a\x45\xdf\xa3', 'FFMPEG', 'video/webm'),
+    (4, b'ftyp', 'FFMPEG', 'video/mp4'),
+)
+
+
+def read_header(file, size=HEADER_SIZE):
+    """ Read the first bytes of a file object, leaving it at the start
+
+    Args:
+        file: Seekable file object
+        size: Integer representing the number of bytes to read
+
+    Returns:
+        Bytes of at most `size` length
+    """
+    file.seek(0)
+    header = file.read(size)
+    file.seek(0)
+    return header
+
+def sniff_format(header):
+    """ Identify a file format from its magic bytes
+
+    Args:
+        header: Bytes from the start of the file, see `read_header`
+
+    Returns:
+        A tuple of the imageio format name and MIME type, or (None, None) if
+        the format is not recognised
+    """
+    header = bytes(header)
+
+    for offset, magic, format, content_type in FORMAT_SIGNATURES:
+        if header[offset:offset + len(magic)] == magic:
+            return format, content_type
+
+    return None, None
+
+
+ImageAttributes = namedtuple('ImageAttributes',
+                             'format animated frames width height duration')
+"""
+Attributes of an image or video. `format` is the imageio format name and
+`duration` is in seconds. Values the headers do not describe are None.
+"""
+
+
+def probe_attributes(file_or_path):
+    """ Read the attributes of an image or video from its headers
+
+    Args:
+        file_or_path: Seekable file object, or path string
+
+    Returns:
+        ImageAttributes, or None if the format is not recognised or its
+        headers cannot be parsed
+    """
+    if isinstance(file_or_path, str):
+        with open(file_or_path, 'rb') as f:
+            return probe_attributes(f)
+
+    f = file_or_path
+    format, content_type = sniff_format(read_header(f))
+    parser = PARSERS.get(content_type)
+    if parser is None:
+        return None
+
+    try:
+        return parser(f)
+    except (EOFError, IndexError, ValueError, struct.error):
+        return None
+    finally:
+        f.seek(0)
+
+
+def _read(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise EOFError
+    return data
+
+def _size(f):
+    f.seek(0, 2)
+    end = f.tell()
+    f.seek(0)
+    return end
+
+def _probe_gif(f):
+    """
+    Counts the image descriptors of a GIF, and totals the delays of its
+    graphic control extensions. LZW image data is skipped block by block.
+    """
+    width, height, flags = struct.unpack('<HHB', _read(f, 13)[6:11])
+    if flags & 0x80:
+        # Global colour table
+        f.seek(3 << ((flags & 0x07) + 1), 1)
+
+    frames = 0
+    delay = 0
+
+    while True:
+        block = f.read(1)
+        if block == b'\x2c':
+            # Image descriptor, followed by an optional local colour table
+            flags = _read(f, 9)[8]
+            if flags & 0x80:
+                f.seek(3 << ((flags & 0x07) + 1), 1)
+            _read(f, 1)  # LZW minimum code size
+            _skip_gif_blocks(f)
+            frames += 1
+        elif block == b'\x21':
+            # Extension
+            if _read(f, 1) == b'\xf9':
+                # Graphic control extension, delay in hundredths of a second
+                data = _read(f, _read(f, 1)[0])
+                delay += struct.unpack('<H', data[1:3])[0]
+            _skip_gif_blocks(f)
+        elif block in (b'\x3b', b''):
+            # Trailer, or a truncated file
+            break
+        else:
+            raise ValueError('Invalid GIF block.')
+
+    return ImageAttributes('GIF', frames > 1, frames, width, height,
+                           delay / 100.0 if frames > 1 else None)
+
+def _skip_gif_blocks(f):
+    while True:
+        size = _read(f, 1)[0]
+        if size == 0:
+            return
+        f.seek(size, 1)
+
+def _probe_png(f):
+    """
+    Walks the chunks of a PNG. Animated PNGs declare their frame count in an
+    acTL chunk before the first IDAT, and each frame's delay in an fcTL chunk.
+    """
+    f.seek(8)
+    width = height = None
+    frames = 1
+    animated = False
+    delay = 0.0
+
+    while True:
+        length, chunk = struct.unpack('>I4s', _read(f, 8))
+        if chunk in (b'IHDR', b'acTL', b'fcTL'):
+            data = _read(f, length)
+            f.seek(4, 1)  # CRC
+        elif chunk == b'IEND' or (chunk == b'IDAT' and not animated):
+            break
+        else:
+            f.seek(length + 4, 1)
+            continue
+
+        if chunk == b'IHDR':
+            width, height = struct.unpack('>II', data[:8])
+        elif chunk == b'acTL':
+            frames = struct.unpack('>I', data[:4])[0]
+            animated = frames > 1
+        else:
+            numerator, denominator = struct.unpack('>HH', data[20:24])
+            delay += numerator / float(denominator or 100)
+
+    return ImageAttributes('PNG', animated, frames, width, height,
+                           delay if animated else None)
+
+def _probe_jpeg(f):
+    """
+    Finds the dimensions of a JPEG in its start of frame marker.
+    """
+    f.seek(2)
+
+    while True:
+        if _read(f, 1) != b'\xff':
+            raise ValueError('Invalid JPEG marker.')
+        code = _read(f, 1)[0]
+        while code == 0xff:
+            # Fill bytes
+            code = _read(f, 1)[0]
+        if code == 0x01 or 0xd0 <= code <= 0xd8:
+            # Markers without a length
+            continue
+
+        length = struct.unpack('>H', _read(f, 2))[0]
+        if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>xHH', _read(f, 5))
+            return ImageAttributes('JPEG', False, 1, width, height, None)
+        f.seek(length - 2, 1)
+
+def _probe_ico(f):
+    """
+    Reads the dimensions of the first image in an ICO directory.
+    """
+    header = _read(f, 8)
+    # A dimension of 0 represents 256 pixels
+    return ImageAttributes('ICO', False, 1, header[6] or 256, header[7] or 256, None)
+
+EBML_SEGMENT = 0x18538067
+EBML_CONTAINERS = {
+    EBML_SEGMENT,
+    0x1549a966,  # Info
+    0x1654ae6b,  # Tracks
+    0xae,  # TrackEntry
+    0xe0,  # Video
+}
+EBML_CLUSTER = 0x1f43b675
+EBML_TIMECODE_SCALE = 0x2ad7b1
+EBML_DURATION = 0x4489
+EBML_PIXEL_WIDTH = 0xb0
+EBML_PIXEL_HEIGHT = 0xba
+
+def _probe_webm(f):
+    """
+    Walks the EBML elements of a WebM up to its first cluster, descending into
+    the segment information and video track headers.
+    """
+    end = _size(f)
+    values = {}
+
+    while f.tell() < end:
+        element, length = _read_vint(f, keep_marker=True)
+        size, length = _read_vint(f)
+        unknown = size == (1 << (7 * length)) - 1
+
+        if element == EBML_CLUSTER:
+            break
+        if element in EBML_CONTAINERS:
+            # Children follow directly
+            continue
+        if unknown:
+            raise ValueError('Unknown size EBML element.')
+
+        if element == EBML_DURATION:
+            values[element] = struct.unpack('>f' if size == 4 else '>d', _read(f, size))[0]
+        elif element in (EBML_TIMECODE_SCALE, EBML_PIXEL_WIDTH, EBML_PIXEL_HEIGHT):
+            values.setdefault(element, int.from_bytes(_read(f, size), 'big'))
+        else:
+            f.seek(size, 1)
+
+    duration = values.get(EBML_DURATION)
+    if duration is not None:
+        duration = duration * values.get(EBML_TIMECODE_SCALE, 1000000) / 1e9
+
+    return ImageAttributes('FFMPEG', True, None, values.get(EBML_PIXEL_WIDTH),
+                           values.get(EBML_PIXEL_HEIGHT), duration)
+
+def _read_vint(f, keep_marker=False):
+    """
+    Reads an EBML variable length integer. Element IDs keep their length
+    marker, sizes have it removed. Returns the value and its length in bytes.
+    """
+    first = _read(f, 1)[0]
+    length, bit = 1, 0x80
+    while length <= 8 and not first & bit:
+        length += 1
+        bit >>= 1
+    if length > 8:
+        raise ValueError('Invalid EBML variable length integer.')
+
+    value = first if keep_marker else first & (bit - 1)
+    for b in _read(f, length - 1):
+        value = (value << 8) | b
+    return value, length
+
+MP4_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+def _probe_mp4(f):
+    """
+    Walks the boxes of an MP4, skipping media data. The duration comes from
+    the movie header, and the dimensions and sample count from the first
+    track with dimensions.
+    """
+    end = _size(f)
+    width = height = frames = duration = None
+    track = (0, 0)
+
+    while f.tell() + 8 <= end:
+        start = f.tell()
+        size, kind = struct.unpack('>I4s', _read(f, 8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', _read(f, 8))[0]
+            header = 16
+        elif size == 0:
+            # Box extends to the end of the file
+            size = end - start
+        if size < header:
+            raise ValueError('Invalid MP4 box size.')
+
+        if kind in MP4_CONTAINERS:
+            # Children follow directly
+            continue
+
+        if kind == b'mvhd':
+            data = _read(f, 32)
+            if data[0] == 1:
+                timescale, length = struct.unpack('>IQ', data[20:32])
+            else:
+                timescale, length = struct.unpack('>II', data[12:20])
+            if timescale:
+                duration = length / float(timescale)
+        elif kind == b'tkhd':
+            # Width and height are 16.16 fixed point, ending the box
+            data = _read(f, size - header)
+            w, h = struct.unpack('>II', data[-8:])
+            track = (w >> 16, h >> 16)
+        elif kind == b'stsz' and width is None and all(track):
+            width, height = track
+            frames = struct.unpack('>I', _read(f, 12)[8:12])[0]
+
+        f.seek(start + size)
+
+    return ImageAttributes('FFMPEG', True, frames, width, height, duration)
+
+PARSERS = {
+    'image/gif': _probe_gif,
+    'image/png': _probe_png,
+    'image/jpeg': _probe_jpeg,
+    'image/x-icon': _probe_ico,
+    'video/webm': _probe_webm,
+    'video/mp4': _probe_mp4,
+}
@@ -0,0 +1,196 @@
+"""
+Post rank index for Pifti
+
+Keeps the `(modified, id)` sort key of every post in memory, ordered as the
+index view orders them, so the page a post appears on can be found by bisection
+without querying the database.
+
+Each process holds its own index. Writers update their local index in place,
+then publish the change as a numbered delta in the cache, and increment the
+shared version. Other processes apply the deltas they have missed once they
+notice the version has changed. The index is only rebuilt from the database,
+with a single `values_list` query, on cold start or when deltas are lost.
+
+The index requires a cache shared by every process, such as memcached, to
+learn of changes made elsewhere. With a process-local cache, such as the
+default local memory backend, pages are counted in the database instead.
+"""
+from bisect import bisect_left, insort
+from threading import RLock
+from time import time
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db.models import Q
+
+from imageboard import caching
+
+VERSION_KEY = 'post_rank_version'
+DELTA_KEY = 'post_rank_delta_%d'
+DELTA_TIMEOUT = 3600
+MAX_DELTAS = 100  # Missed deltas applied before rebuilding instead
+
+_lock = RLock()
+_keys = []  # Ascending (modified, id) sort keys
+_posts = {}  # Post id to sort key
+_version = None
+
+
+def get_post_page(post_id, pagination):
+    """ Find the page number for a specific post
+
+    Args:
+        post_id: integer representing the internal post ID
+        pagination: integer representing a pagination option
+
+    Returns:
+        An integer representing the page number for a given post and
+        pagination. Unknown posts are reported on the first page.
+    """
+    if not caching.is_shared():
+        return _count_post_page(int(post_id), pagination)
+
+    with _lock:
+        _refresh()
+        key = _posts.get(int(post_id))
+        if key is None:
+            return 1
+        rank = len(_keys) - bisect_left(_keys, key) - 1
+
+    return rank // pagination + 1
+
+def update_post(post):
+    """ Move a created or bumped post to its new rank
+
+    Args:
+        post: Post instance which has been saved
+
+    Returns:
+        None
+    """
+    if not caching.is_shared():
+        return
+
+    with _lock:
+        key = (post.modified, post.id)
+        if not _refresh():
+            _apply(post.id, key)
+        _publish(post.id, key)
+
+def remove_post(post_id):
+    """ Remove a deleted post from the rank index
+
+    Args:
+        post_id: integer representing the internal post ID
+
+    Returns:
+        None
+    """
+    if not caching.is_shared():
+        return
+
+    with _lock:
+        if not _refresh():
+            _apply(post_id, None)
+        _publish(post_id, None)
+
+def invalidate():
+    """ Force every process to rebuild its rank index
+
+    Returns:
+        None
+    """
+    global _version
+
+    with _lock:
+        _version = None
+        cache.delete(VERSION_KEY)
+
+
+def _count_post_page(post_id, pagination):
+    """
+    Counts the posts ranked before a post in the database, for processes
+    which cannot share the index.
+    """
+    Post = apps.get_model('imageboard', 'Post')
+
+    modified = Post.objects.filter(id=post_id).values_list('modified', flat=True).first()
+    if modified is None:
+        return 1
+
+    rank = Post.objects.filter(
+        Q(modified__gt=modified) | Q(modified=modified, id__gt=post_id)).count()
+    return rank // pagination + 1
+
+def _refresh():
+    """
+    Brings the local index up to date with the shared version, applying the
+    missed deltas where possible. Returns True if a rebuild took place.
+    """
+    global _version
+
+    version = cache.get(VERSION_KEY)
+    if _version is not None and version == _version:
+        return False
+
+    if _version is not None and version is not None and \
+            0 < version - _version <= MAX_DELTAS:
+        keys = [DELTA_KEY % v for v in range(_version + 1, version + 1)]
+        deltas = cache.get_many(keys)
+        if len(deltas) == len(keys):
+            for k in keys:
+                _apply(*deltas[k])
+            _version = version
+            return False
+
+    _rebuild(version)
+    return True
+
+def _rebuild(version):
+    global _keys, _posts, _version
+
+    Post = apps.get_model('imageboard', 'Post')
+    keys = list(Post.objects.order_by('modified', 'id').values_list('modified', 'id'))
+
+    _keys = keys
+    _posts = {k[1]: k for k in keys}
+    if version is None:
+        # Start a new sequence, above any version from before the cache was
+        # cleared, so no process mistakes it for the one it already holds
+        cache.add(VERSION_KEY, int(time() * 1000000), None)
+        version = cache.get(VERSION_KEY)
+    _version = version
+
+def _apply(post_id, key):
+    """
+    Moves a post to its sort key, or removes it if the key is None.
+    """
+    _discard(post_id)
+    if key is not None:
+        _posts[post_id] = key
+        insort(_keys, key)
+
+def _discard(post_id):
+    key = _posts.pop(post_id, None)
+    if key is not None:
+        index = bisect_left(_keys, key)
+        if index < len(_keys) and _keys[index] == key:
+            del _keys[index]
+
+def _publish(post_id, key):
+    """
+    Announces a local change as a delta, for other processes to apply.
+    """
+    global _version
+
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        # Version missing, every process rebuilds
+        return
+
+    cache.set(DELTA_KEY % version, (post_id, key), DELTA_TIMEOUT)
+    if _version is not None and version == _version + 1:
+        # No other writer published in between. Otherwise the next refresh
+        # applies their deltas along with this one, which is idempotent.
+        _version = version
@@ -0,0 +1,103 @@
+"""
+Local background job queue for Pifti
+
+Jobs run on a small pool of threads inside each process, and are only
+started once the current database transaction has committed.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Lock
+import logging
+
+from django.db import connection, transaction
+
+from imageboard.conf import IMAGEBOARD_TASK_WORKERS as workers
+from imageboard.conf import IMAGEBOARD_EMBED_WORKERS as embed_workers
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_embed_executor = None
+_executor_lock = Lock()
+
+
+def enqueue(func, *args, **kwargs):
+    """ Run a function in the background once the transaction commits
+
+    Args:
+        func: callable to run
+        *args: positional arguments for `func`
+        **kwargs: keyword arguments for `func`
+
+    Returns:
+        None
+    """
+    if workers <= 0:
+        transaction.on_commit(lambda: _run(func, args, kwargs, close=False))
+    else:
+        transaction.on_commit(lambda: _get_executor().submit(_run, func, args, kwargs))
+
+def run_concurrently(func, items, timeout):
+    """ Call a function for each item in parallel, within a total deadline
+
+    Calls which have not finished by the deadline keep running in the
+    background, but their results are not returned.
+
+    Args:
+        func: callable taking a single item
+        items: iterable of hashable items
+        timeout: seconds to wait for all calls in total
+
+    Returns:
+        A dictionary of item to result for each call finished in time
+    """
+    items = list(items)
+    if not items:
+        return {}
+
+    if embed_workers <= 0:
+        return {item: func(item) for item in items}
+
+    futures = {_get_embed_executor().submit(_call, func, item): item
+               for item in items}
+    done, not_done = wait(futures, timeout=timeout)
+
+    results = {}
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except Exception:
+            logger.exception('Concurrent call %s failed', getattr(func, '__name__', func))
+    return results
+
+
+def _get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers)
+    return _executor
+
+def _get_embed_executor():
+    global _embed_executor
+
+    with _executor_lock:
+        if _embed_executor is None:
+            _embed_executor = ThreadPoolExecutor(max_workers=embed_workers)
+    return _embed_executor
+
+def _call(func, item):
+    try:
+        return func(item)
+    finally:
+        connection.close()
+
+def _run(func, args, kwargs, close=True):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception('Background job %s failed', getattr(func, '__name__', func))
+    finally:
+        # Each worker thread holds its own database connection
+        if close:
+            connection.close()
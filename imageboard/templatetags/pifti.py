@@ -1,10 +1,15 @@
 from django import template
+from django.core.cache.utils import make_template_fragment_key
 from django.core.urlresolvers import reverse
 from django.template.defaultfilters import stringfilter
 from django.utils.safestring import mark_safe, SafeData
 from django.utils.html import escape
-from imageboard.models import Post
-from math import ceil
+from imageboard.backends import detect_backend
+from imageboard.caching import get_or_generate
+from imageboard.embeds import get_embed
+from imageboard.ranking import get_post_page
+from imageboard.thumbnails import get_thumbnail_set, get_thumbnail_url
+from embed_video.backends import EmbedVideoException
 from emojipy import Emoji
 
 register = template.Library()
@@ -57,6 +62,43 @@ def is_excluded_backend(backend):
         return False
 
 
+@register.filter(name='embedbackend')
+def embed_backend(url):
+    """
+    Detects the backend of a media URL, using the host keyed backend lookup.
+
+    Args:
+        url: Media URL string
+    Returns:
+        Backend instance for the URL
+        The URL itself if no backend handles it
+    Sample Usage::
+        {% video media|embedbackend as v %}
+    """
+    try:
+        return detect_backend(str(url))
+    except EmbedVideoException:
+        return url
+
+
+@register.filter(name='thumbnailurl')
+def thumbnail_url(file, alias):
+    """
+    Gets the URL of an image thumbnail which has already been generated.
+    Missing thumbnails are queued for background generation, and a
+    placeholder is shown until they are ready.
+
+    Args:
+        file: Image field file of a post or comment
+        alias: String representing the thumbnail alias, e.g. 'avatar'
+    Returns:
+        URL of the thumbnail or placeholder
+    Sample Usage::
+        <img src="{{ post.image|thumbnailurl:'avatar' }}" />
+    """
+    return get_thumbnail_url(file, alias)
+
+
 # Template Tags
 
 @register.simple_tag(name='posturl')
@@ -71,8 +113,102 @@ def post_link(post_id, pagination):
         Url to post page with anchor
     """
 
-    post_count = Post.objects.filter(modified__gte=Post.objects.get(id=post_id).modified).count()
-    post_page = ceil(post_count / pagination)
+    post_page = get_post_page(post_id, pagination)
     index = reverse('imageboard:index')
 
     return index + '?page=' + str(post_page) + '#' + str(post_id)
+
+
+@register.simple_tag(name='embedmeta', takes_context=True)
+def embed_metadata(context, url):
+    """ Get the stored metadata for a media URL
+
+    Metadata prefetched by the view in the `embeds` context variable is used
+    when present, otherwise it is loaded from the database.
+
+    Args:
+        context: template context
+        url: Media URL string
+
+    Returns:
+        EmbedMetadata record, which may still be pending resolution
+
+    Sample Usage::
+        {% embedmeta post.media as m %}
+    """
+    embeds = context.get('embeds') or {}
+    if url in embeds:
+        return embeds[url]
+    return get_embed(url)
+
+@register.inclusion_tag('includes/picture.html', name='thumbnailpicture')
+def thumbnail_picture(file, alias):
+    """ Render a picture element for an image thumbnail and its derivatives
+
+    Only derivatives which have already been generated are offered, missing
+    ones are queued for background generation.
+
+    Args:
+        file: Image field file of a post or comment
+        alias: String representing the thumbnail alias, e.g. 'avatar'
+
+    Returns:
+        Template context with the `src`, `srcset`, and `sources` of the
+        thumbnail
+
+    Sample Usage::
+        {% thumbnailpicture post.image 'avatar' %}
+    """
+    return get_thumbnail_set(file, alias) or {}
+
+@register.tag(name='stalecache')
+def do_stale_cache(parser, token):
+    """ Cache a template fragment, serving it stale while it is regenerated
+
+    Behaves like the built-in ``{% cache %}`` tag and shares its fragment
+    keys, however only one worker renders an expired fragment while the
+    others continue to serve the previous content.
+
+    Sample Usage::
+        {% stalecache 86400 post_media post.id %}
+            .. some expensive processing ..
+        {% endstalecache %}
+    """
+    nodelist = parser.parse(('endstalecache',))
+    parser.delete_first_token()
+    tokens = token.split_contents()
+    if len(tokens) < 3:
+        raise template.TemplateSyntaxError(
+            "'%r' tag requires at least 2 arguments." % tokens[0])
+    return StaleCacheNode(
+        nodelist, parser.compile_filter(tokens[1]), tokens[2],
+        [parser.compile_filter(t) for t in tokens[3:]])
+
+
+class StaleCacheNode(template.Node):
+    def __init__(self, nodelist, expire_time_var, fragment_name, vary_on):
+        self.nodelist = nodelist
+        self.expire_time_var = expire_time_var
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        try:
+            expire_time = self.expire_time_var.resolve(context)
+        except template.VariableDoesNotExist:
+            raise template.TemplateSyntaxError(
+                '"stalecache" tag got an unknown variable: %r'
+                % self.expire_time_var.var)
+        if expire_time is not None:
+            try:
+                expire_time = int(expire_time)
+            except (ValueError, TypeError):
+                raise template.TemplateSyntaxError(
+                    '"stalecache" tag got a non-integer timeout value: %r'
+                    % expire_time)
+
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        key = make_template_fragment_key(self.fragment_name, vary_on)
+
+        return get_or_generate(key, lambda: self.nodelist.render(context),
+                               expire_time)
@@ -5,7 +5,10 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
+
+GIF_1X1 = (b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00'
+           b'\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;')
 
 
 class SimpleTest(TestCase):
@@ -14,3 +17,1080 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class CursorTest(SimpleTestCase):
+    def test_cursor_round_trip(self):
+        """
+        Tests that cursor tokens decode to the page number and key encoded.
+        """
+        from datetime import datetime
+        from django.utils.timezone import utc
+        from imageboard.pagination import encode_cursor, decode_cursor
+
+        key = (datetime(2017, 3, 4, 5, 6, 7, 891011, tzinfo=utc), 42)
+        self.assertEqual(decode_cursor(encode_cursor(3, key)), (3, key))
+        self.assertEqual(decode_cursor(encode_cursor(None, key)), (None, key))
+        self.assertEqual(decode_cursor(encode_cursor(1)), (1, None))
+
+    def test_invalid_cursor(self):
+        """
+        Tests that malformed cursor tokens are rejected.
+        """
+        from imageboard.pagination import decode_cursor, InvalidCursor
+
+        self.assertRaises(InvalidCursor, decode_cursor, 'not-a-cursor')
+
+
+class PostRankTest(TestCase):
+    def setUp(self):
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from imageboard import ranking
+
+        # The index is only used with a cache shared between processes
+        shared = mock.patch('imageboard.caching.is_shared', return_value=True)
+        shared.start()
+        self.addCleanup(shared.stop)
+
+        ranking.invalidate()
+        self.user = User.objects.create_user('rank', password='rank')
+
+    def test_post_page(self):
+        """
+        Tests that post pages follow bumps and deletions without counting.
+        """
+        from imageboard.models import Post
+        from imageboard.ranking import get_post_page
+
+        posts = [Post.objects.create(user=self.user, title=str(i), body='')
+                 for i in range(6)]
+
+        self.assertEqual(get_post_page(posts[5].id, 5), 1)
+        self.assertEqual(get_post_page(posts[0].id, 5), 2)
+
+        # Bump the oldest post to the front
+        from django.utils.timezone import now
+        posts[0].modified = now()
+        posts[0].save()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_post_page(posts[0].id, 5), 1)
+            self.assertEqual(get_post_page(posts[1].id, 5), 2)
+
+        posts[5].delete()
+        self.assertEqual(get_post_page(posts[1].id, 5), 1)
+
+    def test_apply_remote_delta(self):
+        """
+        Tests that a bump published by another process is applied without a query.
+        """
+        from django.core.cache import cache
+        from django.utils.timezone import now
+        from imageboard import ranking
+        from imageboard.models import Post
+
+        posts = [Post.objects.create(user=self.user, title=str(i), body='')
+                 for i in range(6)]
+        self.assertEqual(ranking.get_post_page(posts[0].id, 5), 2)
+
+        # Another process bumps the oldest post
+        version = cache.incr(ranking.VERSION_KEY)
+        cache.set(ranking.DELTA_KEY % version, (posts[0].id, (now(), posts[0].id)))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(ranking.get_post_page(posts[0].id, 5), 1)
+            self.assertEqual(ranking.get_post_page(posts[1].id, 5), 2)
+
+    def test_local_cache_counts(self):
+        """
+        Tests that pages are counted in the database without a shared cache.
+        """
+        from unittest import mock
+        from django.utils.timezone import now
+        from imageboard import ranking
+        from imageboard.models import Post
+
+        posts = [Post.objects.create(user=self.user, title=str(i), body='')
+                 for i in range(6)]
+
+        with mock.patch('imageboard.caching.is_shared', return_value=False):
+            # Bumped by another process, which this index never hears of
+            Post.objects.filter(id=posts[0].id).update(modified=now())
+            self.assertEqual(ranking.get_post_page(posts[0].id, 5), 1)
+            self.assertEqual(ranking.get_post_page(posts[1].id, 5), 2)
+            self.assertEqual(ranking.get_post_page(0, 5), 1)
+
+
+class ActivityTest(TestCase):
+    def setUp(self):
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from django.core.cache import cache
+
+        # Post pages come from the rank index, as with a shared cache
+        shared = mock.patch('imageboard.caching.is_shared', return_value=True)
+        shared.start()
+        self.addCleanup(shared.stop)
+
+        cache.clear()
+        self.user = User.objects.create_user('activity', password='activity')
+
+    def test_activity_updates(self):
+        """
+        Tests that new items are added to the feed without regenerating it.
+        """
+        from imageboard.activity import get_activity, COMMENT, POST
+        from imageboard.models import Post, Comment
+
+        post = Post.objects.create(user=self.user, title='first', body='')
+        self.assertEqual(get_activity(10, 10)[0]['kind'], POST)
+
+        with self.assertNumQueries(0):
+            get_activity(10, 10)
+
+        comment = Comment(user=self.user, post=post, body='')
+        comment.save()
+
+        activity = get_activity(10, 10)
+        self.assertEqual(activity[0]['kind'], COMMENT)
+        self.assertEqual(activity[0]['title'], 'first')
+        self.assertEqual(activity[0]['post_page'], 1)
+
+        post.delete()
+        self.assertEqual(get_activity(10, 10), [])
+
+
+class StaleCacheTest(SimpleTestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_serve_stale_while_locked(self):
+        """
+        Tests that stale values are served while another worker regenerates.
+        """
+        from django.core.cache import cache
+        from imageboard import caching
+
+        caching.store('stale', 'old', 60)
+        caching.expire('stale')
+
+        # Another worker holds the regeneration lock
+        cache.add('stale:lock', True)
+        self.assertEqual(caching.get_or_generate('stale', lambda: 'new', 60), 'old')
+
+        cache.delete('stale:lock')
+        self.assertEqual(caching.get_or_generate('stale', lambda: 'new', 60), 'new')
+        self.assertEqual(caching.get_or_generate('stale', lambda: 'newer', 60), 'new')
+
+    def test_release_own_lock(self):
+        """
+        Tests that a regeneration outliving its lock leaves the next holder's lock.
+        """
+        from django.core.cache import cache
+        from imageboard import caching
+
+        def generate():
+            # The lock expires, and another worker takes it
+            cache.set('owned:lock', 'other')
+            return 'new'
+
+        self.assertEqual(caching.get_or_generate('owned', generate, 60), 'new')
+        self.assertEqual(cache.get('owned:lock'), 'other')
+
+    def test_generate_after_short_wait(self):
+        """
+        Tests that a worker with nothing to serve generates once the wait expires.
+        """
+        from unittest import mock
+        from django.core.cache import cache
+        from imageboard import caching
+
+        cache.add('waiting:lock', 'other')
+        with mock.patch('imageboard.caching.lock_wait', 0):
+            self.assertEqual(caching.get_or_generate('waiting', lambda: 'new', 60), 'new')
+        self.assertEqual(cache.get('waiting:lock'), 'other')
+
+    def test_update_under_lock(self):
+        """
+        Tests that updates apply in turn, and a stuck update lock drops the value.
+        """
+        from unittest import mock
+        from django.core.cache import cache
+        from imageboard import caching
+
+        caching.store('list', [1], 60)
+        caching.update('list', lambda l: [2] + l, 60)
+        caching.update('list', lambda l: [3] + l, 60)
+        self.assertEqual(caching.peek('list'), [3, 2, 1])
+
+        cache.add('list:update', 'other')
+        with mock.patch('imageboard.caching.lock_wait', 0):
+            caching.update('list', lambda l: [4] + l, 60)
+        self.assertIsNone(caching.peek('list'))
+        self.assertEqual(cache.get('list:update'), 'other')
+
+    def test_legacy_fragment_is_missing(self):
+        """
+        Tests that a fragment cached by the built-in cache tag is regenerated.
+        """
+        from django.core.cache import cache
+        from imageboard import caching
+
+        cache.set('legacy', '<div>fragment</div>')
+        self.assertIsNone(caching.peek('legacy'))
+        self.assertEqual(caching.get_or_generate('legacy', lambda: 'new', 60), 'new')
+
+
+class CommentPrefetchTest(TestCase):
+    def test_windowed_prefetch(self):
+        """
+        Tests that only the newest comments are loaded beneath each post.
+        """
+        from django.contrib.auth.models import User
+        from imageboard.models import Post, Comment
+        from imageboard.views import _prefetchComments
+
+        user = User.objects.create_user('prefetch', password='prefetch')
+        busy = Post.objects.create(user=user, title='busy', body='')
+        quiet = Post.objects.create(user=user, title='quiet', body='')
+        comments = []
+        for i in range(7):
+            c = Comment(user=user, post=busy, body=str(i))
+            c.save()
+            comments.append(c)
+
+        posts = [Post.objects.get(id=busy.id), Post.objects.get(id=quiet.id)]
+        with self.assertNumQueries(1):
+            _prefetchComments(posts, 5)
+
+        self.assertEqual([c.id for c in posts[0].recent_comments],
+                         [c.id for c in comments[2:]])
+        self.assertEqual(posts[0].comment_count, 7)
+        self.assertEqual(posts[0].hidden_comment_count, 2)
+        self.assertEqual(posts[1].recent_comments, [])
+        with self.assertNumQueries(0):
+            self.assertEqual(posts[0].recent_comments[0].user.username, 'prefetch')
+
+        _prefetchComments(posts, 5, expand=str(busy.id))
+        self.assertEqual(posts[0].hidden_comment_count, 0)
+
+
+class HiddenCommentsTest(TestCase):
+    def test_hidden_comments(self):
+        """
+        Tests that the hidden comments endpoint returns only older comments.
+        """
+        from django.contrib.auth.models import User
+        from django.core.urlresolvers import reverse
+        from imageboard.models import Post, Comment
+
+        user = User.objects.create_user('hidden', password='hidden')
+        post = Post.objects.create(user=user, title='hidden', body='')
+        for i in range(12):
+            Comment(user=user, post=post, body='comment-%02d' % i).save()
+
+        self.client.login(username='hidden', password='hidden')
+        response = self.client.get(
+            reverse('imageboard:hidden_comments', args=[post.id]))
+
+        self.assertContains(response, 'comment-00')
+        self.assertContains(response, 'comment-01')
+        self.assertNotContains(response, 'comment-02')
+
+
+class IndexQueryTest(TestCase):
+    def setUp(self):
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from django.core.cache import cache
+
+        # Post pages come from the rank index, as with a shared cache
+        shared = mock.patch('imageboard.caching.is_shared', return_value=True)
+        shared.start()
+        self.addCleanup(shared.stop)
+
+        cache.clear()
+        self.user = User.objects.create_user('queries', password='queries')
+        self.client.login(username='queries', password='queries')
+
+    def _add_posts(self, count):
+        from django.contrib.auth.models import User
+        from imageboard.models import Post, Comment
+
+        for i in range(count):
+            author = User.objects.create_user('author-%d-%d' % (count, i))
+            post = Post.objects.create(user=author, title='queries', body='')
+            for j in range(3):
+                commenter = User.objects.create_user(
+                    'commenter-%d-%d-%d' % (count, i, j))
+                Comment(user=commenter, post=post, body='').save()
+
+    def _count_queries(self, url):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        # Warm the activity and rank caches
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_index_queries(self):
+        """
+        Tests that the index query count does not grow with posts, comments,
+        or authors on the page.
+        """
+        from django.core.urlresolvers import reverse
+
+        self._add_posts(2)
+        few = self._count_queries(reverse('imageboard:index'))
+        self._add_posts(6)
+        many = self._count_queries(reverse('imageboard:index'))
+
+        self.assertEqual(few, many)
+
+
+class OEmbedCacheTest(SimpleTestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_normalize_url(self):
+        """
+        Tests that equivalent media URLs share a cache key.
+        """
+        from imageboard.backends import normalize_url
+
+        self.assertEqual(normalize_url('https://www.YouTube.com/watch?v=abc#t'),
+                         normalize_url('http://youtube.com/watch?v=abc'))
+
+    def test_negative_cache(self):
+        """
+        Tests that missing embeds are only requested from the provider once.
+        """
+        from unittest import mock
+        from embed_video.backends import VideoDoesntExistException
+        from imageboard.backends import get_oembed
+
+        response = mock.Mock(status_code=404)
+        params = {'url': 'https://youtube.com/watch?v=missing'}
+        with mock.patch('imageboard.backends.session.request',
+                        return_value=response) as get:
+            for i in range(2):
+                self.assertRaises(VideoDoesntExistException, get_oembed,
+                                  'Youtube', 'https://youtube.com/oembed', params)
+        self.assertEqual(get.call_count, 1)
+
+    def test_server_error_not_cached(self):
+        """
+        Tests that a provider server error is retried rather than cached.
+        """
+        from unittest import mock
+        from imageboard.backends import get_oembed, ProviderUnavailable
+
+        response = mock.Mock(status_code=503)
+        params = {'url': 'https://youtube.com/watch?v=error'}
+        with mock.patch('imageboard.backends.session.request',
+                        return_value=response) as get:
+            for i in range(2):
+                self.assertRaises(ProviderUnavailable, get_oembed,
+                                  'Youtube', 'https://youtube.com/oembed', params)
+        self.assertEqual(get.call_count, 2)
+
+
+class EmbedMetadataTest(TestCase):
+    def test_resolve_embed(self):
+        """
+        Tests that resolved metadata is stored and failures are recorded.
+        """
+        from unittest import mock
+        from embed_video.backends import VideoDoesntExistException
+        from imageboard.embeds import resolve_embed
+        from imageboard.models import EmbedMetadata
+
+        backend = mock.Mock(backend='YoutubeBackend', provider='Youtube',
+                            thumbnail='https://i.ytimg.com/vi/a/hqdefault.jpg',
+                            start='30', **{'title.return_value': 'Title',
+                                           'username.return_value': 'Author',
+                                           'width.return_value': 420,
+                                           'height.return_value': '236'})
+        with mock.patch('imageboard.embeds.detect_backend', return_value=backend), \
+                mock.patch('imageboard.embeds.mirror_thumbnail',
+                           return_value='/media/thumbs/a.jpg') as mirror:
+            resolve_embed('https://youtube.com/watch?v=a')
+        mirror.assert_called_once_with('Youtube', backend.thumbnail)
+
+        record = EmbedMetadata.objects.get(url='https://youtube.com/watch?v=a')
+        self.assertTrue(record.is_resolved)
+        self.assertEqual((record.title, record.author, record.height, record.start),
+                         ('Title', 'Author', 236, '30'))
+        self.assertEqual(record.thumbnail_url, '/media/thumbs/a.jpg')
+
+        with mock.patch('imageboard.embeds.detect_backend',
+                        side_effect=VideoDoesntExistException):
+            resolve_embed('https://youtube.com/watch?v=b')
+
+        record = EmbedMetadata.objects.get(url='https://youtube.com/watch?v=b')
+        self.assertEqual(record.status, EmbedMetadata.FAILED)
+
+    def test_pending_left_to_queue(self):
+        """
+        Tests that pages resolve unknown embeds, and leave pending ones queued.
+        """
+        from unittest import mock
+        from django.utils.timezone import now
+        from imageboard.embeds import PENDING_RETRY, get_embeds
+        from imageboard.models import EmbedMetadata
+
+        EmbedMetadata.objects.create(url='https://youtube.com/watch?v=c')
+        EmbedMetadata.objects.create(url='https://youtube.com/watch?v=d')
+        EmbedMetadata.objects.filter(url='https://youtube.com/watch?v=d').update(
+            updated=now() - PENDING_RETRY * 2)
+
+        with mock.patch('imageboard.embeds.resolve_embed',
+                        side_effect=lambda url: EmbedMetadata(url=url)) as resolve, \
+                mock.patch('imageboard.tasks.enqueue') as enqueue:
+            records = get_embeds(['https://youtube.com/watch?v=a',
+                                  'https://youtube.com/watch?v=c',
+                                  'https://youtube.com/watch?v=d'])
+
+        self.assertEqual(len(records), 3)
+        resolve.assert_called_once_with('https://youtube.com/watch?v=a')
+        enqueue.assert_called_once_with(resolve, 'https://youtube.com/watch?v=d')
+
+
+class EmbedEndpointTest(TestCase):
+    def test_batched_metadata(self):
+        """
+        Tests that several embeds are answered by one request from stored metadata.
+        """
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from django.core.urlresolvers import reverse
+        from imageboard.models import EmbedMetadata
+
+        User.objects.create_user('embeds', password='embeds')
+        EmbedMetadata.objects.create(url='https://vimeo.com/1', status=EmbedMetadata.RESOLVED,
+                                     title='One', author='Author', width=640, height=360)
+        EmbedMetadata.objects.create(url='https://vimeo.com/2', status=EmbedMetadata.FAILED)
+
+        self.client.login(username='embeds', password='embeds')
+        with mock.patch('imageboard.embeds.resolve_embed') as resolve:
+            response = self.client.get(reverse('imageboard:embed_metadata'),
+                                       {'url': ['https://vimeo.com/1', 'https://vimeo.com/2']})
+
+        self.assertFalse(resolve.called)
+        data = response.json()
+        self.assertEqual(data['https://vimeo.com/1']['title'], 'One')
+        self.assertEqual(data['https://vimeo.com/1']['height'], 360)
+        self.assertIn('error', data['https://vimeo.com/2'])
+
+    def test_unknown_urls_ignored(self):
+        """
+        Tests that URLs which are not post or comment media are not stored or requested.
+        """
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from django.core.urlresolvers import reverse
+        from imageboard.models import EmbedMetadata, Post
+
+        user = User.objects.create_user('unknown', password='unknown')
+        Post.objects.create(user=user, title='media', body='', media='https://vimeo.com/3')
+
+        self.client.login(username='unknown', password='unknown')
+        with mock.patch('imageboard.embeds.resolve_embed',
+                        side_effect=lambda url: EmbedMetadata(url=url)) as resolve:
+            response = self.client.get(reverse('imageboard:embed_metadata'), {'url': [
+                'https://vimeo.com/3', 'https://vimeo.com/4',
+                'https://vimeo.com/' + 'x' * 300, 'not a url']})
+
+        self.assertEqual(len(response.json()), 4)
+        self.assertIn('error', response.json()['https://vimeo.com/4'])
+        # The post's own embed is pending, and left to its queued job
+        self.assertFalse(resolve.called)
+        self.assertFalse(EmbedMetadata.objects.filter(url='https://vimeo.com/4').exists())
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_circuit_opens(self):
+        """
+        Tests that a provider is not called after repeated failures.
+        """
+        from unittest import mock
+        import requests
+        from imageboard.backends import provider_request, ProviderUnavailable
+        from imageboard.conf import IMAGEBOARD_EMBED_FAILURE_THRESHOLD
+
+        with mock.patch('imageboard.backends.session.request',
+                        side_effect=requests.Timeout) as request:
+            for i in range(IMAGEBOARD_EMBED_FAILURE_THRESHOLD):
+                self.assertRaises(requests.Timeout, provider_request,
+                                  'Test', 'get', 'https://example.com')
+            self.assertRaises(ProviderUnavailable, provider_request,
+                              'Test', 'get', 'https://example.com')
+
+        self.assertEqual(request.call_count, IMAGEBOARD_EMBED_FAILURE_THRESHOLD)
+
+
+class DetectBackendTest(SimpleTestCase):
+    def test_detect_backend(self):
+        """
+        Tests that media URLs are dispatched to their backend by host.
+        """
+        from embed_video.backends import UnknownBackendException
+        from imageboard.backends import detect_backend
+
+        self.assertEqual(detect_backend('https://www.youtube.com/watch?v=abcdefghijk').backend,
+                         'YoutubeBackend')
+        self.assertEqual(detect_backend('https://youtu.be/abcdefghijk').code, 'abcdefghijk')
+        self.assertEqual(detect_backend('//player.vimeo.com/video/1234').backend, 'VimeoBackend')
+        self.assertRaises(UnknownBackendException, detect_backend, 'https://example.com/video')
+        self.assertRaises(UnknownBackendException, detect_backend, 'https://youtube.example.com/')
+
+
+class VimeoThumbnailTest(SimpleTestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_probe_remembered(self):
+        """
+        Tests that the preferred available resolution is probed once per video.
+        """
+        from unittest import mock
+        from imageboard.backends import VimeoBackend
+
+        def head(method, url, **kwargs):
+            return mock.Mock(status_code=200 if url.endswith('_640.jpg') else 404)
+
+        info = {'thumbnail_url': 'https://i.vimeocdn.com/video/123_295x166.jpg'}
+        with mock.patch('imageboard.backends.session.request', side_effect=head) as request, \
+                mock.patch.object(VimeoBackend, 'get_info', return_value=info):
+            for i in range(2):
+                backend = VimeoBackend('https://vimeo.com/42')
+                self.assertTrue(backend.thumbnail.endswith('/123_640.jpg'))
+
+        self.assertEqual(request.call_count, len(VimeoBackend.resolutions))
+
+    def test_youtube_thumbnail_probe(self):
+        """
+        Tests that YouTube thumbnails are probed through the provider session.
+        """
+        from unittest import mock
+        from imageboard.backends import YoutubeBackend
+
+        def head(method, url, **kwargs):
+            self.assertIn('timeout', kwargs)
+            return mock.Mock(status_code=200 if url.endswith('/hqdefault.jpg') else 404)
+
+        with mock.patch('imageboard.backends.session.request', side_effect=head) as request:
+            for i in range(2):
+                backend = YoutubeBackend('https://www.youtube.com/watch?v=dQw4w9WgXcQ')
+                self.assertTrue(backend.thumbnail.endswith('/vi/dQw4w9WgXcQ/hqdefault.jpg'))
+
+        self.assertEqual(request.call_count, len(YoutubeBackend.resolutions))
+
+
+class UploadHashTest(SimpleTestCase):
+    def test_hash_while_receiving(self):
+        """
+        Tests that uploads are hashed as chunks arrive, matching a full read.
+        """
+        from django.core.files.base import ContentFile
+        from django.core.files.uploadhandler import StopFutureHandlers
+        from imageboard.uploadhandlers import HashingMemoryFileUploadHandler, get_content_hash
+
+        handler = HashingMemoryFileUploadHandler()
+        handler.handle_raw_input(None, {}, 12, None)
+        # The activated memory handler claims the file from later handlers
+        self.assertRaises(StopFutureHandlers, handler.new_file, 'image', 'a.png', 'image/png', 12)
+        handler.receive_data_chunk(b'pifti-', 0)
+        handler.receive_data_chunk(b'upload', 6)
+        f = handler.file_complete(12)
+
+        self.assertEqual(f.content_hash, get_content_hash(ContentFile(b'pifti-upload')))
+        self.assertEqual(get_content_hash(f), f.content_hash)
+
+    def test_hash_multipart_upload(self):
+        """
+        Tests that a multipart upload parsed by the memory handler is hashed.
+        """
+        from django.core.files.base import ContentFile
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import RequestFactory
+        from imageboard.uploadhandlers import HashingMemoryFileUploadHandler, get_content_hash
+
+        request = RequestFactory().post('/', {
+            'image': SimpleUploadedFile('a.gif', GIF_1X1, 'image/gif')})
+        request.upload_handlers = [HashingMemoryFileUploadHandler(request)]
+        f = request.FILES['image']
+
+        self.assertEqual(f.read(), GIF_1X1)
+        self.assertEqual(f.content_hash, get_content_hash(ContentFile(GIF_1X1)))
+
+
+class UploadLimitTest(SimpleTestCase):
+    def test_stops_oversized_upload(self):
+        """
+        Tests that an upload is stopped once it exceeds its sniffed format's limit.
+        """
+        from django.core.files.uploadhandler import StopUpload
+        from django.http import HttpRequest
+        from imageboard.uploadhandlers import UploadLimitHandler, get_upload_limit
+
+        self.assertGreater(get_upload_limit('FFMPEG'), get_upload_limit('PNG'))
+        self.assertEqual(get_upload_limit(None), get_upload_limit('PNG'))
+
+        request = HttpRequest()
+        handler = UploadLimitHandler(request)
+        handler.new_file('image', 'image.png', 'image/png', None)
+        limit = get_upload_limit('PNG')
+
+        self.assertEqual(handler.receive_data_chunk(b'\x89PNG\r\n\x1a\n', 0), b'\x89PNG\r\n\x1a\n')
+        self.assertEqual(handler.receive_data_chunk(b'x', limit - 1), b'x')
+        with self.assertRaises(StopUpload) as cm:
+            handler.receive_data_chunk(b'xx', limit - 1)
+        self.assertTrue(cm.exception.connection_reset)
+        self.assertEqual(request.upload_errors['image'].code, 'max_size')
+
+    def test_limit_from_header(self):
+        """
+        Tests that a renamed image is not given the video upload limit.
+        """
+        from django.core.files.uploadhandler import StopUpload
+        from imageboard.uploadhandlers import UploadLimitHandler, get_upload_limit
+
+        handler = UploadLimitHandler()
+        handler.new_file('image', 'clip.webm', 'video/webm', None)
+        handler.receive_data_chunk(GIF_1X1, 0)
+        self.assertRaises(StopUpload, handler.receive_data_chunk,
+                          b'x', get_upload_limit('GIF'))
+
+        handler.new_file('image', 'clip.webm', 'video/webm', None)
+        handler.receive_data_chunk(b'\x1a\x45\xdf\xa3', 0)
+        self.assertEqual(handler.receive_data_chunk(b'x', get_upload_limit('GIF')), b'x')
+
+
+class UploadValidationTest(SimpleTestCase):
+    def test_validate_from_header(self):
+        """
+        Tests that uploads are identified from their header and decoded lazily.
+        """
+        from django.core.exceptions import ValidationError
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from imageboard.models import Post
+        from imageboard.probe import sniff_format
+
+        self.assertEqual(sniff_format(b'\x00\x00\x00\x18ftypmp42'), ('FFMPEG', 'video/mp4'))
+        self.assertEqual(sniff_format(b'plain text'), (None, None))
+
+        field = Post._meta.get_field('image')
+        f = field.to_python(SimpleUploadedFile('a.gif', GIF_1X1))
+        self.assertEqual(f.content_type, 'image/gif')
+        self.assertEqual(f.image.size, (1, 1))
+
+        self.assertRaises(ValidationError, field.to_python,
+                          SimpleUploadedFile('a.gif', b'GIF89a\x01'))
+        self.assertRaises(ValidationError, field.to_python,
+                          SimpleUploadedFile('a.png', b'plain text'))
+
+    def test_video_read_in_place(self):
+        """
+        Tests that a video upload on disk is read by FFmpeg without a copy.
+        """
+        from unittest import mock
+        from django.core.files.uploadedfile import TemporaryUploadedFile
+        from imageboard.models import Post
+
+        upload = TemporaryUploadedFile('a.webm', 'video/webm', 8, None)
+        upload.write(b'\x1a\x45\xdf\xa3\x80\x00\x00\x00')
+        upload.seek(0)
+
+        field = Post._meta.get_field('image')
+        with mock.patch('imageio.get_reader') as get_reader:
+            field.to_python(upload)
+        get_reader.assert_called_once_with(upload.temporary_file_path(), 'FFMPEG')
+        upload.close()
+
+
+class ProbeTest(SimpleTestCase):
+    def test_gif_animation(self):
+        """
+        Tests that GIF frames are counted from their image descriptors.
+        """
+        from io import BytesIO
+        from tempfile import NamedTemporaryFile
+        from unittest import mock
+        from imageboard.files import get_image_attributes
+        from imageboard.probe import probe_attributes
+
+        still = probe_attributes(BytesIO(GIF_1X1))
+        self.assertEqual((still.animated, still.frames, still.width), (False, 1, 1))
+
+        # Repeat the graphic control extension and image of the first frame
+        animated = GIF_1X1[:42] + GIF_1X1[19:42] + b';'
+        attributes = probe_attributes(BytesIO(animated))
+        self.assertEqual((attributes.animated, attributes.frames), (True, 2))
+
+        with NamedTemporaryFile(suffix='.gif') as f:
+            f.write(animated)
+            f.flush()
+            self.assertEqual(get_image_attributes(mock.Mock(path=f.name)), (True, 'GIF'))
+
+    def test_apng_delays(self):
+        """
+        Tests that APNG frames and delays are read from their acTL and fcTL chunks.
+        """
+        import struct
+        from io import BytesIO
+        from imageboard.probe import probe_attributes
+
+        def chunk(kind, data):
+            return struct.pack('>I4s', len(data), kind) + data + b'\x00' * 4
+
+        def fctl(sequence):
+            return chunk(b'fcTL', struct.pack('>IIIIIHHBB', sequence, 4, 3, 0, 0, 10, 100, 0, 0))
+
+        png = (b'\x89PNG\r\n\x1a\n' +
+               chunk(b'IHDR', struct.pack('>IIBBBBB', 4, 3, 8, 6, 0, 0, 0)) +
+               chunk(b'acTL', struct.pack('>II', 2, 0)) +
+               fctl(0) + chunk(b'IDAT', b'\x00' * 8) +
+               fctl(1) + chunk(b'fdAT', b'\x00' * 8) +
+               chunk(b'IEND', b''))
+
+        attributes = probe_attributes(BytesIO(png))
+        self.assertEqual((attributes.format, attributes.animated, attributes.frames),
+                         ('PNG', True, 2))
+        self.assertEqual((attributes.width, attributes.height), (4, 3))
+        self.assertAlmostEqual(attributes.duration, 0.2)
+
+    def test_jpeg_dimensions(self):
+        """
+        Tests that JPEG dimensions are read from the start of frame marker.
+        """
+        import struct
+        from io import BytesIO
+        from imageboard.probe import probe_attributes
+
+        jpeg = (b'\xff\xd8' +
+                b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9 +
+                b'\xff\xc0' + struct.pack('>HBHH', 11, 8, 48, 64) + b'\x01\x01\x11\x00' +
+                b'\xff\xd9')
+
+        self.assertEqual(probe_attributes(BytesIO(jpeg)), ('JPEG', False, 1, 64, 48, None))
+
+    def test_webm_unknown_size_segment(self):
+        """
+        Tests that WebM headers are read within a segment of unknown size.
+        """
+        import struct
+        from io import BytesIO
+        from imageboard.probe import probe_attributes
+
+        def element(id, data):
+            return id + bytes([0x80 | len(data)]) + data
+
+        video = element(b'\xe0', element(b'\xb0', struct.pack('>H', 640)) +
+                        element(b'\xba', struct.pack('>H', 360)))
+        webm = (element(b'\x1a\x45\xdf\xa3', element(b'\x42\x82', b'webm')) +
+                b'\x18\x53\x80\x67\x01\xff\xff\xff\xff\xff\xff\xff' +
+                element(b'\x15\x49\xa9\x66',
+                        element(b'\x2a\xd7\xb1', b'\x0f\x42\x40') +
+                        element(b'\x44\x89', struct.pack('>d', 2500.0))) +
+                element(b'\x16\x54\xae\x6b', element(b'\xae', video)) +
+                b'\x1f\x43\xb6\x75\x01\xff\xff\xff\xff\xff\xff\xff')
+
+        self.assertEqual(probe_attributes(BytesIO(webm)), ('FFMPEG', True, None, 640, 360, 2.5))
+
+    def test_mp4_moov_after_mdat(self):
+        """
+        Tests that MP4 headers are found after media data with a 64-bit box size.
+        """
+        import struct
+        from io import BytesIO
+        from imageboard.probe import probe_attributes
+
+        def box(kind, data):
+            return struct.pack('>I4s', len(data) + 8, kind) + data
+
+        mvhd = box(b'mvhd', struct.pack('>B3xIIII', 0, 0, 0, 1000, 2000) + b'\x00' * 80)
+        tkhd = box(b'tkhd', b'\x00' * 76 + struct.pack('>II', 320 << 16, 240 << 16))
+        stsz = box(b'stsz', struct.pack('>III', 0, 0, 48))
+        mp4 = (box(b'ftyp', b'isom\x00\x00\x02\x00') +
+               struct.pack('>I4sQ', 1, b'mdat', 16 + 64) + b'\x00' * 64 +
+               box(b'moov', mvhd + box(b'trak', tkhd + box(b'mdia', box(b'minf', box(b'stbl', stsz))))))
+
+        self.assertEqual(probe_attributes(BytesIO(mp4)), ('FFMPEG', True, 48, 320, 240, 2.0))
+
+    def test_truncated_falls_back(self):
+        """
+        Tests that truncated headers are not probed, and are left to imageio.
+        """
+        from io import BytesIO
+        from unittest import mock
+        from django.core.files.base import ContentFile
+        from imageboard.files import get_image_details
+        from imageboard.probe import probe_attributes
+
+        truncated = b'\x89PNG\r\n\x1a\n\x00\x00\x00\x0dIHDR\x00\x00'
+        self.assertIsNone(probe_attributes(BytesIO(truncated)))
+
+        reader = mock.Mock()
+        reader.format.name = 'PNG'
+        with mock.patch('imageio.get_reader', return_value=reader) as get_reader:
+            details = get_image_details(ContentFile(truncated))
+        self.assertTrue(get_reader.called)
+        self.assertEqual((details.animated, details.format), (False, 'PNG'))
+
+
+class ImageAttributeFieldsTest(SimpleTestCase):
+    def test_attributes_at_upload(self):
+        """
+        Tests that image attributes are stored on the row when an image is assigned.
+        """
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from imageboard.models import Post
+
+        animated = GIF_1X1[:42] + GIF_1X1[19:42] + b';'
+        post = Post(title='gif', body='', image=SimpleUploadedFile('a.gif', animated))
+
+        self.assertEqual((post.image_animated, post.image_format, post.image_frames),
+                         (True, 'GIF', 2))
+        self.assertEqual((post.image_width, post.image_height), (1, 1))
+        self.assertEqual(post.image.read(6), b'GIF89a')
+
+
+class ImageAttributePrefetchTest(TestCase):
+    def test_prefetch_older_rows(self):
+        """
+        Tests that older rows load their attributes in one query and queue the rest.
+        """
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from imageboard.files import prefetch_image_attributes, store_image_attributes
+        from imageboard.models import Post, SourceAttributes
+
+        user = User.objects.create_user('attributes', password='attributes')
+        for name in ('known.gif', 'unknown.gif'):
+            post = Post.objects.create(user=user, title=name, body='')
+            Post.objects.filter(pk=post.pk).update(image=name)
+        SourceAttributes.objects.create(name='known.gif', animated=True, format='GIF')
+
+        posts = list(Post.objects.order_by('title'))
+        with mock.patch('imageboard.tasks.enqueue') as enqueue, self.assertNumQueries(1):
+            prefetch_image_attributes(posts)
+
+        self.assertEqual((posts[0].image_animated, posts[0].image_format), (True, 'GIF'))
+        self.assertIsNone(posts[1].image_format)
+        enqueue.assert_called_once_with(store_image_attributes, 'imageboard.Post',
+                                        [posts[0].pk, posts[1].pk], 'image')
+
+
+class RecomputeImageAttributesTest(TestCase):
+    def test_recompute_and_store(self):
+        """
+        Tests that a worker reads image details from a path and the command stores them.
+        """
+        from tempfile import NamedTemporaryFile
+        from django.contrib.auth.models import User
+        from imageboard.management.commands.recompute_image_attributes import (
+            Command, _recompute)
+        from imageboard.models import Post, SourceAttributes
+
+        with NamedTemporaryFile(suffix='.gif') as f:
+            f.write(GIF_1X1[:42] + GIF_1X1[19:42] + b';')
+            f.flush()
+            name, details, error = _recompute(('a.gif', f.name))
+
+        self.assertIsNone(error)
+        self.assertEqual(_recompute(('b.gif', '/missing/b.gif'))[1:],
+                         (None, 'Source file not found'))
+
+        user = User.objects.create_user('recompute', password='recompute')
+        post = Post.objects.create(user=user, title='gif', body='')
+        Post.objects.filter(pk=post.pk).update(image=name)
+        Command().store(name, details)
+
+        post.refresh_from_db()
+        self.assertEqual((post.image_animated, post.image_format, post.image_frames),
+                         (True, 'GIF', 2))
+        self.assertTrue(SourceAttributes.objects.get(name=name).animated)
+
+
+class ThumbnailQueueTest(TestCase):
+    def test_placeholder_until_generated(self):
+        """
+        Tests that missing thumbnails are queued once and served when generated.
+        """
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from django.core.cache import cache
+        from easy_thumbnails.files import ThumbnailerFieldFile
+        from imageboard.models import Post
+        from imageboard.thumbnails import generate_thumbnails, get_thumbnail_url
+
+        cache.clear()
+        user = User.objects.create_user('thumbnails', password='thumbnails')
+        post = Post.objects.create(user=user, title='gif', body='')
+        Post.objects.filter(pk=post.pk).update(image='a.gif')
+        post = Post.objects.get(pk=post.pk)
+
+        with mock.patch.object(ThumbnailerFieldFile, 'get_existing_thumbnail',
+                               return_value=None), \
+                mock.patch('imageboard.tasks.enqueue') as enqueue:
+            self.assertIn('thumbnail_pending', get_thumbnail_url(post.image, 'avatar'))
+            self.assertIn('thumbnail_pending', get_thumbnail_url(post.image, 'avatar'))
+        enqueue.assert_called_once_with(generate_thumbnails, 'imageboard.Post',
+                                        post.pk, 'image')
+
+        with mock.patch.object(ThumbnailerFieldFile, 'get_thumbnail',
+                               return_value=mock.Mock(url='/media/thumbs/a.jpg')):
+            generate_thumbnails('imageboard.Post', post.pk)
+
+        with mock.patch.object(ThumbnailerFieldFile, 'get_existing_thumbnail') as existing:
+            self.assertEqual(get_thumbnail_url(post.image, 'avatar'), '/media/thumbs/a.jpg')
+        self.assertFalse(existing.called)
+
+
+class RegenerateThumbnailsTest(SimpleTestCase):
+    def test_skip_and_limit_decoders(self):
+        """
+        Tests that up to date thumbnails are skipped and video decoding is limited.
+        """
+        from unittest import mock
+        from imageboard.management.commands import regenerate_thumbnails
+
+        thumbnailer = mock.Mock()
+        thumbnailer.get_thumbnail_name.return_value = 'thumbs/a.jpg'
+        thumbnailer.get_existing_thumbnail.return_value = mock.Mock(url='/thumbs/a.jpg')
+        thumbnailer.generate_thumbnail.return_value = mock.Mock(url='/thumbs/b.jpg')
+        decoders = mock.Mock()
+        regenerate_thumbnails._init_decoders(decoders)
+        options = {'size': (150, 150)}
+
+        with mock.patch.object(regenerate_thumbnails, 'FormatThumbnailer',
+                               return_value=thumbnailer):
+            self.assertEqual(
+                regenerate_thumbnails._regenerate(('a.gif', ([options], False))),
+                ('a.gif', [('thumbs/a.jpg', '/thumbs/a.jpg', False)], None))
+            self.assertFalse(decoders.acquire.called)
+
+            self.assertEqual(
+                regenerate_thumbnails._regenerate(('b.webm', ([options], True))),
+                ('b.webm', [('thumbs/a.jpg', '/thumbs/b.jpg', True)], None))
+            decoders.acquire.assert_called_once_with()
+            decoders.release.assert_called_once_with()
+
+
+class ThumbnailDerivativeTest(SimpleTestCase):
+    def test_derivative_names_and_sets(self):
+        """
+        Tests that derivatives are named by format and offered once generated.
+        """
+        from unittest import mock
+        from django.core.cache import cache
+        from imageboard import thumbnails
+        from imageboard.files import FormatThumbnailer
+
+        thumbnailer = FormatThumbnailer(name='a.gif')
+        options = {'size': (150, 150), 'crop': True}
+        self.assertTrue(thumbnailer.get_thumbnail_name(
+            dict(options, FORMAT='webp')).endswith('.webp'))
+        self.assertEqual(
+            thumbnailer.get_thumbnail_name(dict(options, FORMAT='webp'))[:-5],
+            thumbnailer.get_thumbnail_name(options).rsplit('.', 1)[0])
+
+        file = mock.Mock(alias_target=None)
+        file.get_thumbnail_name.side_effect = lambda o: '%s-%s' % (
+            o['size'][0], o.get('FORMAT', 'jpg'))
+        file.get_existing_thumbnail.side_effect = lambda o: None if o['size'][0] > 150 \
+            else mock.Mock(url='/%s' % file.get_thumbnail_name(o))
+
+        expected = {
+            'src': '/150-jpg',
+            'srcset': '/150-jpg 1x',
+            'sources': [{'type': 'image/webp', 'srcset': '/150-webp 1x'}],
+        }
+
+        cache.clear()
+        with mock.patch.object(thumbnails, 'get_derivative_formats', return_value=['webp']), \
+                mock.patch.object(thumbnails.aliases, 'get', return_value=options), \
+                mock.patch.object(thumbnails, 'request_thumbnails') as request:
+            self.assertEqual(thumbnails.get_thumbnail_set(file, 'avatar'), expected)
+
+            # Cached thumbnails, and missing derivatives, are served without
+            # checking storage
+            file.get_existing_thumbnail.reset_mock()
+            self.assertEqual(thumbnails.get_thumbnail_set(file, 'avatar'), expected)
+            self.assertFalse(file.get_existing_thumbnail.called)
+
+            # Storage is checked again once missing derivatives expire
+            cache.delete_many(['thumbnail_ready_300-jpg', 'thumbnail_ready_300-webp'])
+            file.get_existing_thumbnail.side_effect = lambda o: mock.Mock(
+                url='/%s' % file.get_thumbnail_name(o))
+            self.assertEqual(thumbnails.get_thumbnail_set(file, 'avatar'), {
+                'src': '/150-jpg',
+                'srcset': '/150-jpg 1x, /300-jpg 2x',
+                'sources': [{'type': 'image/webp', 'srcset': '/150-webp 1x, /300-webp 2x'}],
+            })
+
+        # Missing derivatives are left to regenerate_thumbnails
+        self.assertFalse(request.called)
+
+    def test_decode_once(self):
+        """
+        Tests that every variant of an image is made from one decoded source.
+        """
+        from tempfile import TemporaryDirectory
+        from unittest import mock
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import FileSystemStorage
+        from easy_thumbnails.source_generators import pil_image
+        from imageboard.files import FormatThumbnailer
+        from imageboard.thumbnails import decode_once
+
+        with TemporaryDirectory() as directory:
+            storage = FileSystemStorage(location=directory)
+            storage.save('a.gif', ContentFile(GIF_1X1))
+            thumbnailer = FormatThumbnailer(name='a.gif', source_storage=storage,
+                                            thumbnail_storage=storage)
+            generator = mock.Mock(side_effect=pil_image)
+            thumbnailer.source_generators = [generator]
+
+            with decode_once(thumbnailer):
+                for size in (10, 20):
+                    thumbnailer.generate_thumbnail({'size': (size, size)})
+
+            self.assertEqual(generator.call_count, 1)
+            self.assertEqual(thumbnailer.source_generators, [generator])
+
+
+class ParallelCommandTest(SimpleTestCase):
+    def test_checkpoint_options_must_match(self):
+        """
+        Tests that a checkpoint is only resumed by a run with the same options.
+        """
+        import json
+        from tempfile import NamedTemporaryFile
+        from django.core.management.base import CommandError
+        from imageboard.management.parallel import ParallelCommand
+
+        command = ParallelCommand()
+        command.selecting_options = ('alias',)
+        options = {'alias': 'large', 'checkpoint': None, 'restart': False,
+                   'workers': 1, 'memory_limit': 0, 'tasks_per_worker': 1,
+                   'progress': 1}
+
+        with NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump({'last': 'b.gif', 'options': {'alias': 'avatar'}}, f)
+            f.flush()
+            options['checkpoint'] = f.name
+            self.assertRaises(CommandError, command.run,
+                              [('a.gif', None)], len, options)
@@ -0,0 +1,261 @@
+"""
+Background thumbnail generation for Pifti
+
+Generating a thumbnail may decode a video with FFmpeg, so thumbnails are made
+by a background job when an image is uploaded. Templates only look up
+thumbnails which already exist, and show a placeholder until they do.
+
+Each alias is also generated as derivatives at several pixel densities and in
+modern formats such as WebP, which templates offer as a `<picture>` source set.
+Images uploaded before derivatives were configured are backfilled with the
+`regenerate_thumbnails` management command, rather than from page views.
+
+Ready thumbnail URLs are cached under their thumbnail name, which includes the
+alias options, so changing an alias misses the cache rather than serving the
+old thumbnail. Derivatives found missing are remembered for `MISSING_TIMEOUT`
+seconds before storage is checked again, so derivatives made by another
+process are picked up even when each process has its own cache.
+"""
+from django.apps import apps
+from django.core.cache import cache
+from django.templatetags.static import static
+from easy_thumbnails import engine, utils
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.conf import settings as thumbnail_settings
+from PIL import Image
+
+from contextlib import contextmanager
+
+from imageboard import tasks
+from imageboard.conf import IMAGEBOARD_THUMBNAIL_DERIVATIVES as derivatives
+from imageboard.conf import IMAGEBOARD_THUMBNAIL_PLACEHOLDER as placeholder
+
+READY_KEY = 'thumbnail_ready_%s'
+QUEUED_KEY = 'thumbnail_queued_%s_%s'
+QUEUED_TIMEOUT = 3600
+MISSING_TIMEOUT = 300
+
+DERIVATIVE_TYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+}
+
+
+def get_thumbnail_url(file, alias):
+    """ Find the URL of an image thumbnail without generating it
+
+    Thumbnails which do not exist yet are queued for generation, and the
+    placeholder is returned in their place.
+
+    Args:
+        file: ThumbnailerImageExtFieldFile of a saved instance
+        alias: String representing a `THUMBNAIL_ALIASES` name
+
+    Returns:
+        URL string of the thumbnail or placeholder, or an empty string if
+        there is no image or alias
+    """
+    if not file:
+        return ''
+
+    options = aliases.get(alias, target=file.alias_target)
+    if not options:
+        return ''
+
+    url = _get_ready_url(file, options, cache.get(_ready_key(file, options)))
+    if url:
+        return url
+
+    request_thumbnails(file)
+    return static(placeholder)
+
+def get_thumbnail_set(file, alias):
+    """ Find the derivatives of an image thumbnail without generating them
+
+    The URLs of the alias and its derivatives are read with a single cache
+    query. Images without a thumbnail are queued for generation, and show the
+    placeholder. Missing derivatives of an existing thumbnail are left out
+    of the set, and are not queued from here, as `regenerate_thumbnails`
+    backfills them without decoding media in the web process. Storage is
+    checked for them again once `MISSING_TIMEOUT` has passed.
+
+    Args:
+        file: ThumbnailerImageExtFieldFile of a saved instance
+        alias: String representing a `THUMBNAIL_ALIASES` name
+
+    Returns:
+        A dictionary with the `src` and `srcset` of the alias's own format,
+        and a list of `sources` with the `type` and `srcset` of each
+        derivative format, or None if there is no image or alias
+    """
+    if not file:
+        return None
+
+    options = aliases.get(alias, target=file.alias_target)
+    if not options:
+        return None
+
+    # The first variant is the alias itself
+    variants = get_variants(options)
+    keys = [_ready_key(file, o) for format, scale, o in variants]
+    cached = cache.get_many(keys)
+
+    src = _get_ready_url(file, variants[0][2], cached.get(keys[0]))
+    if not src:
+        request_thumbnails(file)
+        return {'src': static(placeholder), 'srcset': '', 'sources': []}
+
+    srcsets = {}
+    missing = {}
+    for (format, scale, o), key in zip(variants, keys):
+        url = cached.get(key)
+        if url is None:
+            url = _get_ready_url(file, o, None)
+            if not url:
+                missing[key] = ''
+        if url:
+            srcsets.setdefault(format, []).append('%s %gx' % (url, scale))
+
+    if missing:
+        cache.set_many(missing, MISSING_TIMEOUT)
+
+    return {
+        'src': src,
+        'srcset': ', '.join(srcsets.pop(None, [])),
+        'sources': [{'type': DERIVATIVE_TYPES[format], 'srcset': ', '.join(srcsets[format])}
+                    for format in get_derivative_formats() if format in srcsets],
+    }
+
+def get_derivative_formats():
+    """
+    Returns the configured derivative formats which Pillow is able to save,
+    in order of preference.
+    """
+    # Ensure plugins are loaded so that Image.EXTENSION is populated
+    Image.init()
+    return [f for f in derivatives['formats']
+            if f in DERIVATIVE_TYPES and '.' + f in Image.EXTENSION]
+
+def get_variants(options):
+    """ List the derivatives of a thumbnail alias
+
+    Args:
+        options: easy_thumbnails options of the alias
+
+    Returns:
+        A list of `(format, scale, options)` tuples for every scale in the
+        alias's own format, where format is None, followed by every scale in
+        each derivative format. The first tuple is the alias itself.
+    """
+    variants = []
+    for format in [None] + get_derivative_formats():
+        for scale in derivatives['scales']:
+            variant = dict(options, size=tuple(int(d * scale) for d in options['size']))
+            if format:
+                variant['FORMAT'] = format
+            variants.append((format, scale, variant))
+    return variants
+
+def request_thumbnails(file):
+    """ Queue generation of every thumbnail alias of an image
+
+    Args:
+        file: ThumbnailerImageExtFieldFile of a saved instance
+
+    Returns:
+        None
+    """
+    instance = file.instance
+    label = instance._meta.label
+
+    # Queue each image once while its job is outstanding. A failed job
+    # leaves the key until it times out, so broken media is not retried on
+    # every page view.
+    if cache.add(QUEUED_KEY % (label, instance.pk), True, QUEUED_TIMEOUT):
+        tasks.enqueue(generate_thumbnails, label, instance.pk, file.field.name)
+
+def generate_thumbnails(label, pk, field_name='image'):
+    """
+    Background job generating the missing thumbnail aliases and derivatives of
+    an image, and caching their URLs.
+    """
+    model = apps.get_model(label)
+    instance = model._default_manager.filter(pk=pk).only('pk', field_name).first()
+
+    if instance is not None:
+        file = getattr(instance, field_name)
+        if file:
+            with decode_once(file):
+                for options in _all_variants(file):
+                    thumbnail = file.get_thumbnail(options)
+                    cache.set(_ready_key(file, options), thumbnail.url, None)
+
+    cache.delete(QUEUED_KEY % (label, pk))
+
+@contextmanager
+def decode_once(thumbnailer):
+    """ Decode the source of a thumbnailer once for every thumbnail it makes
+
+    easy_thumbnails decodes the source for each thumbnail it generates, which
+    for a video starts FFmpeg once per alias and derivative. Within this
+    context the first decoded source image is reused. Sources are only
+    decoded if a thumbnail is generated.
+
+    Args:
+        thumbnailer: easy_thumbnails Thumbnailer, or ThumbnailerFieldFile
+
+    Yields:
+        None
+    """
+    generators = thumbnailer.source_generators
+    if generators is None:
+        generators = [utils.dynamic_import(name)
+                      for name in thumbnail_settings.THUMBNAIL_SOURCE_GENERATORS]
+    decoded = []
+
+    def source_image(source, **options):
+        if not decoded:
+            decoded.append(engine.generate_source_image(
+                source, options, generators, fail_silently=False))
+        return decoded[0]
+
+    previous = thumbnailer.source_generators
+    thumbnailer.source_generators = [source_image]
+    try:
+        yield
+    finally:
+        thumbnailer.source_generators = previous
+
+def forget_thumbnails(file):
+    """ Remove the cached thumbnail URLs of an image
+
+    Args:
+        file: ThumbnailerImageExtFieldFile
+
+    Returns:
+        None
+    """
+    cache.delete_many([_ready_key(file, options) for options in _all_variants(file)])
+
+
+def _all_variants(file):
+    for alias_options in aliases.all(file, include_global=True).values():
+        for format, scale, options in get_variants(alias_options):
+            yield options
+
+def _ready_key(file, options):
+    return READY_KEY % file.get_thumbnail_name(options)
+
+def _get_ready_url(file, options, url):
+    """
+    Returns the cached URL of a thumbnail, or checks for it in storage and
+    caches the URL if it exists. Only modification times are compared, the
+    source is not opened.
+    """
+    if url:
+        return url
+
+    thumbnail = file.get_existing_thumbnail(options)
+    if thumbnail:
+        cache.set(_ready_key(file, options), thumbnail.url, None)
+        return thumbnail.url
@@ -0,0 +1,148 @@
+"""
+Upload handlers for Pifti
+
+Uploads are limited in size while they are received, and abandoned as soon as
+they exceed the limit for their format. The format is identified from the
+magic bytes of the first chunk, never from the file name.
+
+Uploaded images are named by a hash of their content. The handlers compute the
+hash as each chunk is received, and attach it to the uploaded file as
+`content_hash`, so the file is never read a second time to name it.
+"""
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import FileUploadHandler, \
+    MemoryFileUploadHandler, StopUpload, TemporaryFileUploadHandler
+from django.db.models.fields.files import FieldFile
+from django.template.defaultfilters import filesizeformat
+from django.utils.translation import ugettext_lazy as _
+
+from imageboard.conf import IMAGEBOARD_FORMATS as formats
+from imageboard.conf import IMAGEBOARD_UPLOAD_HASH as upload_hash
+from imageboard.conf import IMAGEBOARD_UPLOAD_MAX_SIZE as max_size
+from imageboard.probe import HEADER_SIZE, sniff_format
+
+FORMAT_EXTENSIONS = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.png': 'PNG',
+    '.ico': 'ICO',
+    '.gif': 'GIF',
+    '.webm': 'FFMPEG',
+    '.mp4': 'FFMPEG',
+}
+
+MAX_SIZE_MESSAGE = _("This file is too large (%(limit)s Limit).")
+
+
+def get_upload_limit(format):
+    """ Find the upload limit for a format
+
+    Args:
+        format: imageio format name identified from the file header, see
+                `imageboard.probe.sniff_format`, or None if it is not known
+
+    Returns:
+        Integer representing the limit in bytes for the format. Files of an
+        unknown format are given the smallest limit of any format.
+    """
+    if format is None:
+        return min([max_size] + [get_upload_limit(f) for f in formats])
+    return formats.get(format, {}).get('max_size', max_size)
+
+def max_size_error(limit):
+    """
+    Returns the ValidationError reported for a file exceeding a limit in bytes.
+    """
+    return ValidationError(MAX_SIZE_MESSAGE, code='max_size',
+                           params={'limit': filesizeformat(limit)})
+
+
+class UploadLimitHandler(FileUploadHandler):
+    """
+    Stops reading the request as soon as an uploaded file exceeds its limit,
+    so oversized uploads are never buffered in memory or on disk. Must be the
+    first upload handler.
+
+    The error is recorded in `request.upload_errors`, keyed by field name, and
+    reported on the form. The rest of the request body is not read, so a
+    client still sending it may see the connection reset instead.
+    """
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super(UploadLimitHandler, self).new_file(field_name, file_name, *args, **kwargs)
+        self.header = b''
+        self.limit = get_upload_limit(None)
+
+    def receive_data_chunk(self, raw_data, start):
+        if len(self.header) < HEADER_SIZE:
+            # The smallest limit applies until the header identifies the format
+            self.header += raw_data[:HEADER_SIZE - len(self.header)]
+            format, content_type = sniff_format(self.header)
+            self.limit = get_upload_limit(format)
+
+        if start + len(raw_data) > self.limit:
+            if self.request is not None:
+                errors = getattr(self.request, 'upload_errors', {})
+                errors[self.field_name] = max_size_error(self.limit)
+                self.request.upload_errors = errors
+            raise StopUpload(connection_reset=True)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+class ContentHashMixin(object):
+    """
+    Hashes the chunks consumed by an upload handler. Chunks the handler passes
+    on to the next handler are left for that handler to hash.
+    """
+    def new_file(self, *args, **kwargs):
+        # Created first, as activated handlers raise StopFutureHandlers
+        self.hasher = hashlib.new(upload_hash)
+        super(ContentHashMixin, self).new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super(ContentHashMixin, self).receive_data_chunk(raw_data, start)
+        if remaining is None:
+            self.hasher.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        f = super(ContentHashMixin, self).file_complete(file_size)
+        if f is not None:
+            f.content_hash = self.hasher.hexdigest()
+        return f
+
+
+class HashingMemoryFileUploadHandler(ContentHashMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(ContentHashMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def get_content_hash(f):
+    """ Find the content hash of a file
+
+    Args:
+        f: Django File, or FieldFile, to be hashed
+
+    Returns:
+        Hex digest of the file contents. The hash attached by the upload
+        handlers is used when present, otherwise the file is read once.
+    """
+    content_hash = getattr(f, 'content_hash', None)
+    if content_hash is None and isinstance(f, FieldFile):
+        # Uploaded files assigned to a field are wrapped by the FieldFile
+        content_hash = getattr(f.file, 'content_hash', None)
+
+    if content_hash is None:
+        hasher = hashlib.new(upload_hash)
+        for chunk in f.chunks():
+            hasher.update(chunk)
+        content_hash = hasher.hexdigest()
+
+    return content_hash
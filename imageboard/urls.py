@@ -11,8 +11,10 @@ urlpatterns = [
     url(r'^post/edit/(?P<post_id>\d+)/$', views.edit_post, name='edit_post'),
     url(r'^post/delete/(?P<post_id>\d+)/$', views.delete_post, name='delete_post'),
     url(r'^post/(?P<post_id>\d+)/comment/$', views.add_comment, name='add_comment'),
+    url(r'^post/(?P<post_id>\d+)/comment/hidden/$', views.hidden_comments, name='hidden_comments'),
     url(r'^post/(?P<post_id>\d+)/comment/edit/(?P<comment_id>\d+)/$', views.edit_comment, name='edit_comment'),
     url(r'^post/(?P<post_id>\d+)/comment/delete/(?P<comment_id>\d+)/$', views.delete_comment, name='delete_comment'),
+    url(r'^embeds/$', views.embed_metadata, name='embed_metadata'),
     url(r'^gallery/$', views.gallery, name='gallery'),
     url(r'^profile/(?P<username>[\w@+.-]+)/$', views.profile, name='profile'),
 ]
\ No newline at end of file
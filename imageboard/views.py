@@ -2,58 +2,65 @@ from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm
+from django.contrib.auth.models import User
 from django.core.cache import cache
 from django.core.cache.utils import make_template_fragment_key as tf
 from django.core.exceptions import ObjectDoesNotExist
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, render, redirect
+from imageboard.activity import get_activity
+from imageboard.embeds import get_embeds, get_known_urls
+from imageboard.files import prefetch_image_attributes
 from imageboard.forms import PostForm, PostEditForm, CommentForm, CommentEditForm, ProfileEditForm
-from imageboard.models import Post, Comment, UserProfile
+from imageboard.models import Post, Comment, UserProfile, EmbedMetadata
+from imageboard.pagination import CursorPaginator
+from imageboard.ranking import get_post_page
 
-from math import ceil
-from itertools import chain
-from operator import attrgetter
 
+EMBED_METADATA_MAX = 100
 
 @login_required
 def index(request):
-	post_list = Post.objects.prefetch_related('comment_set').order_by('-modified', '-id')
+	post_list = Post.objects.select_related('user').order_by('-modified', '-id')
 	profile, created = UserProfile.objects.get_or_create(id=request.user.id, user_id=request.user.id)
-	
-	paginator = Paginator(post_list, profile.pagination)
 
-	page = request.GET.get('page')
-	try:
-		post_list_paginated = paginator.page(page)
-	except PageNotAnInteger:
-		post_list_paginated = paginator.page(1)
-	except EmptyPage:
-		post_list_paginated = paginator.page(paginator.num_pages)
+	paginator = CursorPaginator(post_list, profile.pagination)
+	post_list_paginated = _getPage(request, paginator)
+
+	# Only load the comments revealed beneath each post
+	_prefetchComments(post_list_paginated, profile.comment_filter,
+					  expand=request.GET.get('expand'))
 
-	extras = _generateExtraPagination(paginator, post_list_paginated)
+	# Resolve the page's embeds together before rendering
+	embeds = _prefetchEmbeds(post_list_paginated)
+	_prefetchImageAttributes(post_list_paginated)
+
+	extras = _generateExtraPagination(post_list_paginated)
 
 	return render(request, 'home.html', {
 		'pagination_list': post_list_paginated,
 		'previous_previous_page_number_exists': extras['previous_previous_page_number_exists'],
 		'previous_previous_page_number': extras['previous_previous_page_number'],
+		'previous_previous_cursor': extras['previous_previous_cursor'],
 		'next_next_page_number_exists': extras['next_next_page_number_exists'],
 		'next_next_page_number': extras['next_next_page_number'],
-		'latest_activity': _getActivity(request)
+		'next_next_cursor': extras['next_next_cursor'],
+		'latest_activity': _getActivity(request),
+		'embeds': embeds
 	})
 
 @login_required
 def add_post(request):
 	if request.method == 'POST':
 		form = PostForm(request.POST, request.FILES)
+		_addUploadErrors(request, form)
 		if form.is_valid():
 			post = form.save(commit=False)
 			post.user = request.user
 			post.save()
 
-			# Update latest activity cache
-			_generateActivity()
-
 			messages.success(request, 'Post Successful.')
 
 			return redirect('imageboard:index')
@@ -96,18 +103,12 @@ def delete_post(request, post_id):
 			return redirect('imageboard:index')
 
 	# Delete template cache fragments for post and children
-	cache.delete_many([tf('post_media', [post_id]),
-					   tf('post_imagetype', [post_id]),
-					   tf('post_link', [post_id, request.user.userprofile.pagination])])
-	for c in Comment.objects.all().filter(post_id=post_id):
-		cache.delete_many([tf('comment_media', [c.id]),
-						   tf('comment_imagetype', [c.id])])
+	cache.delete_many([tf('post_media', [post_id])] +
+					  [tf('comment_media', [c]) for c in
+					   Comment.objects.filter(post_id=post_id).values_list('id', flat=True)])
 
 	p.delete()
 
-	# Update latest activity cache
-	_generateActivity()
-
 	messages.success(request, 'Post Successfully Deleted.')
 
 	return redirect('imageboard:index')
@@ -116,6 +117,7 @@ def delete_post(request, post_id):
 def add_comment(request, post_id):
 	if request.method == 'POST':
 		form = CommentForm(request.POST, request.FILES)
+		_addUploadErrors(request, form)
 		if form.is_valid():
 			comment = form.save(commit=False)
 			post = get_object_or_404(Post, pk = post_id)
@@ -123,9 +125,6 @@ def add_comment(request, post_id):
 			comment.user = request.user
 			comment.save()
 
-			# Update latest activity cache
-			_generateActivity()
-
 			messages.success(request, 'Comment Successful.')
 
 			return redirect(reverse('imageboard:index') +
@@ -137,6 +136,43 @@ def add_comment(request, post_id):
 
 	return render(request, 'comment/add.html', { 'form': form })
 
+@login_required
+def hidden_comments(request, post_id):
+	""" Render the comments hidden beneath a post
+
+	Returns the older comments which are not revealed by the user's comment
+	filter as an HTML fragment, using the same markup as the index.
+	"""
+	post = get_object_or_404(Post, pk = post_id)
+
+	comments = list(post.comment_set.select_related('user').order_by('-created', '-id')[request.user.userprofile.comment_filter:])
+	comments.reverse()
+	prefetch_image_attributes(comments)
+
+	return render(request, 'comment/hidden.html', {
+		'post': post,
+		'comments': comments,
+		'embeds': get_embeds(c.media for c in comments if c.media)
+	})
+
+@login_required
+def embed_metadata(request):
+	""" Return the metadata of every client side embed on a page
+
+	Takes any number of `url` parameters, up to `EMBED_METADATA_MAX`, and
+	answers them together from the stored embed metadata, so the browser
+	makes a single request instead of one per embed to each provider.
+
+	Only the media URLs of posts and comments are answered, other URLs are
+	reported as invalid without being stored or requested.
+	"""
+	urls = request.GET.getlist('url')[:EMBED_METADATA_MAX]
+	records = get_embeds(get_known_urls(urls), server_only=False)
+	invalid = EmbedMetadata(status=EmbedMetadata.FAILED).as_oembed()
+
+	return JsonResponse({ url: records[url].as_oembed() if url in records else invalid
+						  for url in urls })
+
 @login_required
 def edit_comment(request, post_id, comment_id):
 	c = get_object_or_404(Comment, pk = comment_id)
@@ -172,12 +208,8 @@ def delete_comment(request, post_id, comment_id):
 
 	c.delete()
 
-	# Delete template cache fragments and clear latest activity cache
-	cache.delete_many([tf('comment_media', [comment_id]),
-					   tf('comment_imagetype', [comment_id])])
-
-	# Update latest activity cache
-	_generateActivity()
+	# Delete template cache fragments
+	cache.delete(tf('comment_media', [comment_id]))
 
 	messages.success(request, 'Comment Successfully Deleted.')
 
@@ -189,24 +221,20 @@ def delete_comment(request, post_id, comment_id):
 @login_required
 def gallery(request):
 	gallery_list = Post.objects.prefetch_related('comment_set').all().order_by('-modified', '-id').exclude(image = '')
-	paginator = Paginator(gallery_list, 40)
+	paginator = CursorPaginator(gallery_list, 40)
+	gallery_list_paginated = _getPage(request, paginator)
+	_prefetchImageAttributes(gallery_list_paginated, comment_attr='comment_set')
 
-	page = request.GET.get('page')
-	try:
-		gallery_list_paginated = paginator.page(page)
-	except PageNotAnInteger:
-		gallery_list_paginated = paginator.page(1)
-	except EmptyPage:
-		gallery_list_paginated = paginator.page(paginator.num_pages)
-
-	extras = _generateExtraPagination(paginator, gallery_list_paginated)
+	extras = _generateExtraPagination(gallery_list_paginated)
 
 	return render(request, 'gallery/home.html', {
 		'pagination_list': gallery_list_paginated,
 		'previous_previous_page_number_exists': extras['previous_previous_page_number_exists'],
 		'previous_previous_page_number': extras['previous_previous_page_number'],
+		'previous_previous_cursor': extras['previous_previous_cursor'],
 		'next_next_page_number_exists': extras['next_next_page_number_exists'],
-		'next_next_page_number': extras['next_next_page_number']
+		'next_next_page_number': extras['next_next_page_number'],
+		'next_next_cursor': extras['next_next_cursor']
 	})
 
 @login_required
@@ -271,71 +299,165 @@ def logout_view(request):
 	return redirect('imageboard:index')
 
 
-def _generateExtraPagination(paginator, page_list):
-	# Adjusting the paginator rendering results for quicker paging.
-	extras = {}
+def _getPage(request, paginator):
+	""" Retrieve the requested page from a cursor paginator
 
-	extras['previous_previous_page_number_exists'] = False
-	extras['next_next_page_number_exists'] = False
-	extras['previous_previous_page_number'] = None
-	extras['next_next_page_number'] = None
+	Cursor tokens (`?cursor=`) are preferred, while page numbers (`?page=`)
+	remain supported for direct links to a post.
 
-	if page_list.number > 2:
-		extras['previous_previous_page_number_exists'] = True
-		extras['previous_previous_page_number'] = page_list.previous_page_number() - 1
+	Args:
+	    request: sender request
+	    paginator: CursorPaginator for the requested list
 
-	if page_list.number < paginator.num_pages - 1:
-		extras['next_next_page_number_exists'] = True
-		extras['next_next_page_number'] = page_list.next_page_number() + 1
+	Returns:
+	    A CursorPage
+	"""
+	cursor = request.GET.get('cursor')
+	if cursor:
+		return paginator.page(cursor)
 
-	return extras
+	return paginator.page_number(request.GET.get('page', 1))
 
-def _generateActivity():
-	"""	Generates and caches the lastest activity lists
+def _addUploadErrors(request, form):
+	""" Report uploads abandoned by UploadLimitHandler on their form field
 
-	For a list of pagination options defined in the UserProfile model class
-	the latest activity is generated and cached.
+	Args:
+	    request: HttpRequest whose body has been parsed
+	    form: Bound form for the request
 
 	Returns:
 	    None
 	"""
-	# Find maximum activity list length
-	ACTIVITY_MAX = max(UserProfile.ACTIVITY_CHOICES)[0] # [int, str]
+	for field, error in getattr(request, 'upload_errors', {}).items():
+		if field in form.fields:
+			# Replaces the required error of the missing file
+			form.errors[field] = form.error_class(error.messages)
+
+def _prefetchComments(posts, limit, expand=None):
+	""" Attach the newest comments and comment totals to a list of posts
+
+	A single windowed query loads at most `limit` comments for each post,
+	together with their authors and the total number of comments beneath it.
+	The comments of an expanded post are loaded in full.
 
-	# Retrieve the latest posts and comments
-	latest_posts = Post.objects.all().order_by('-id')[:ACTIVITY_MAX]
-	latest_comments = Comment.objects.all().order_by('-id')[:ACTIVITY_MAX]
+	Args:
+	    posts: list of Post instances
+	    limit: integer representing the user's comment filter profile option
+	    expand: optional post ID for which all comments are loaded
 
-	# Sort both lists together, via latest date
-	activity = sorted(chain(latest_posts, latest_comments),
-					  key=attrgetter('created'), reverse=True)[:ACTIVITY_MAX]
+	Returns:
+	    None, each post is given `recent_comments`, `comment_count`, and
+	    `hidden_comment_count` attributes
+	"""
+	posts = list(posts)
+	if not posts:
+		return
+
+	qn = connection.ops.quote_name
+	table = qn(Comment._meta.db_table)
+	user_table = qn(User._meta.db_table)
+	user_column = qn(Comment._meta.get_field('user').column)
+	# Author columns are selected alongside each comment, prefixed to avoid
+	# clashing with the comment's own columns
+	user_fields = [f.attname for f in User._meta.concrete_fields]
+	user_columns = ', '.join('u.%s AS %s' % (qn(f.column), qn('author_' + f.attname))
+		for f in User._meta.concrete_fields)
+	placeholders = ', '.join(['%s'] * len(posts))
+	comments = Comment.objects.raw(
+		'SELECT * FROM ('
+		'SELECT c.*, ' + user_columns + ', '
+		'ROW_NUMBER() OVER (PARTITION BY c.post_id ORDER BY c.created DESC, c.id DESC) AS comment_row, '
+		'COUNT(*) OVER (PARTITION BY c.post_id) AS comment_total '
+		'FROM ' + table + ' c INNER JOIN ' + user_table + ' u '
+		'ON u.' + qn(User._meta.pk.column) + ' = c.' + user_column + ' '
+		'WHERE c.post_id IN (' + placeholders + ')'
+		') w WHERE w.comment_row <= %s ORDER BY w.created, w.id',
+		[p.id for p in posts] + [limit])
+
+	recent = {}
+	totals = {}
+	for c in comments:
+		c.user = User.from_db(comments.db, user_fields,
+			[getattr(c, 'author_' + f) for f in user_fields])
+		recent.setdefault(c.post_id, []).append(c)
+		totals[c.post_id] = c.comment_total
+
+	for p in posts:
+		p.recent_comments = recent.get(p.id, [])
+		p.comment_count = totals.get(p.id, 0)
+
+		if expand == str(p.id) and p.comment_count > len(p.recent_comments):
+			p.recent_comments = list(p.comment_set.select_related('user').order_by('created', 'id'))
+
+		p.hidden_comment_count = p.comment_count - len(p.recent_comments)
+
+def _prefetchEmbeds(posts):
+	""" Resolve the embed metadata of every post and comment on a page
 
-	# For each pagination option annotate the latest activity list
-	for p in UserProfile.PAGINATION_CHOICES: # [int, str]
-		activity_key = 'activity_' + p[1]
+	Args:
+	    posts: list of Post instances, with `recent_comments` prefetched
 
-		# Find and set the post page for each activity item
-		for a in activity:
-			if hasattr(a, 'post_id'):  # Use parent post_id for comments
-				post = a.post_id
-			else:  # Otherwise use the posts id
-				post = a.id
+	Returns:
+	    A dictionary of media URL to EmbedMetadata record
+	"""
+	urls = set()
+	for p in posts:
+		if p.media:
+			urls.add(p.media)
+		for c in getattr(p, 'recent_comments', []):
+			if c.media:
+				urls.add(c.media)
 
-			# Set post page number for activity item
-			a.post_page = _getPostPage(post, p[0])
+	return get_embeds(urls)
 
-		# Add or update latest activity cache
-		cache.set(activity_key, activity)
+def _prefetchImageAttributes(posts, comment_attr='recent_comments'):
+	""" Load the image attributes missing from older rows on a page together
 
-def _deleteActivity():
-	"""	Clear the latest activity lists from cache
+	Args:
+	    posts: list of Post instances
+	    comment_attr: name of the post attribute holding the comments shown
+	                  beneath it, such as `recent_comments` or a prefetched
+	                  `comment_set`
 
 	Returns:
 	    None
 	"""
+	instances = list(posts)
+	for p in posts:
+		comments = getattr(p, comment_attr, [])
+		# Related managers are read through their prefetched queryset
+		if hasattr(comments, 'all'):
+			comments = comments.all()
+		instances.extend(comments)
 
-	for p in UserProfile.PAGINATION_CHOICES:
-		cache.delete('activity_' + p[1])
+	prefetch_image_attributes(instances)
+
+def _generateExtraPagination(page_list):
+	# Adjusting the paginator rendering results for quicker paging.
+	# Cursors two pages either side are resolved by the paginator, thus the
+	# total page count is never required.
+	extras = {}
+
+	extras['previous_previous_page_number_exists'] = False
+	extras['next_next_page_number_exists'] = False
+	extras['previous_previous_page_number'] = None
+	extras['next_next_page_number'] = None
+	extras['previous_previous_cursor'] = None
+	extras['next_next_cursor'] = None
+
+	if page_list.previous_previous_cursor is not None:
+		extras['previous_previous_page_number_exists'] = True
+		extras['previous_previous_cursor'] = page_list.previous_previous_cursor
+		if page_list.number is not None:
+			extras['previous_previous_page_number'] = page_list.previous_page_number() - 1
+
+	if page_list.next_next_cursor is not None:
+		extras['next_next_page_number_exists'] = True
+		extras['next_next_cursor'] = page_list.next_next_cursor
+		if page_list.number is not None:
+			extras['next_next_page_number'] = page_list.next_page_number() + 1
+
+	return extras
 
 def _getActivity(request):
 	""" Retrieve the latest activity list
@@ -347,16 +469,8 @@ def _getActivity(request):
 	    A list of the latest posts and comments
 	"""
 
-	# Find appropriate cached activity list
-	activity_key = 'activity_' + str(request.user.userprofile.pagination)
-	activity = cache.get(activity_key)
-
-	# Generate cache if not set or expired
-	if activity is None:
-		_generateActivity()  # Update latest activity cache
-
-	activity = cache.get(activity_key)
-	return activity[:request.user.userprofile.activity]
+	profile = request.user.userprofile
+	return get_activity(profile.pagination, profile.activity)
 
 def _getPostPage(post_id, pagination):
 	""" Find the page number for a specific post
@@ -369,5 +483,4 @@ def _getPostPage(post_id, pagination):
 	    An integer representing the page number for a given post and pagination
 	"""
 
-	post_count = Post.objects.filter(modified__gte=Post.objects.get(id=post_id).modified).count()
-	return ceil(post_count / pagination)
+	return get_post_page(post_id, pagination)
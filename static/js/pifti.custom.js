@@ -24,23 +24,42 @@ jQuery(document).ready(function($) {
     }, 6000);
 
     // Attach on click event to each hidden comments 'button'
+    // Hidden comments are requested when first shown, otherwise the button
+    // falls back to following its link
     $("div.comments-expand").each(function() {
-        $(this).click(function() {
-            // Hide expand 'button'
-            $(this).slideUp("slow");
-            // Begin generating media covers
-            $(this).prev().find("div.media_embed").each(function () {
-                generateCover($(this), p);
+        $(this).click(function(e) {
+            var $expand = $(this);
+            var $url = $expand.data("url");
+
+            if ($url === undefined) {
+                return true;
+            }
+            e.preventDefault();
+
+            $.ajax({
+                method: "GET",
+                url: $url,
+                success: function (html) {
+                    var $hidden = $(document.createElement("div"))
+                        .addClass("comments-hidden")
+                        .html(html);
+                    $expand.before($hidden);
+                    // Hide expand 'button'
+                    $expand.slideUp("slow");
+                    // Begin generating media covers
+                    generateCovers($hidden.find("div.media_embed"), p);
+                    // Show hidden comments
+                    $hidden.slideDown("slow");
+                },
+                error: function () {
+                    window.location = $expand.find("a").attr("href");
+                }
             });
-            // Show hidden comments
-            $(this).prev().slideDown("slow");
         })
     });
-    
+
     // Attach events and create covers for each visible media embed
-    $("div.media_embed:visible").each(function () {
-        generateCover($(this), p);
-    });
+    generateCovers($("div.media_embed:visible"), p);
 
     // Generate responsive thumbnail cover for media embed
     function generateCover(obj, protocol) {
@@ -50,7 +69,6 @@ jQuery(document).ready(function($) {
         var $excluded = $(obj).data("excluded"); // Excluded backend
         var $width = minwidth; // Smallest responsive cover width in pixels
         var $height = minheight; // Smallest responsive cover height in pixels
-        var $api = protocol; // Hosts oEmbed API, append to this variable
         var $base_url = protocol; // Video URL, append to this variable
         var $embed_url = protocol; // Iframe source URL or video source list
         var $thumb = undefined; // Thumbnail URL
@@ -70,7 +88,6 @@ jQuery(document).ready(function($) {
         switch ($embed) {
             case "YoutubeBackend":
                 $author = "Youtube";
-                $api = 'https://www.youtube.com/oembed';
                 $base_url += '//youtube.com/watch?v=' + $id;
                 $embed_url += '//www.youtube.com/embed/' + $id
                     + '?rel=0&autoplay=1&start=' + $start;
@@ -78,7 +95,6 @@ jQuery(document).ready(function($) {
 
             case "VimeoBackend":
                 $author = "Vimeo";
-                $api = 'https://vimeo.com/api/oembed.json';
                 $base_url += '//vimeo.com/' + $id;
                 $embed_url += '//player.vimeo.com/video/' + $id
                     + '?autoplay=1';
@@ -86,7 +102,6 @@ jQuery(document).ready(function($) {
 
             case "SoundCloudBackend":
                 $author = "Soundcloud";
-                $api = 'https://soundcloud.com/oembed';
                 // Check if we have the soundcloud track ID or author/track format
                 if (/^\d+$/.test($id)) {
                     $base_url += '//api.soundcloud.com/tracks/' + $id;
@@ -103,7 +118,6 @@ jQuery(document).ready(function($) {
 
             case "StreamableBackend":
                 $author = "Streamable";
-                $api = 'https://api.streamable.com/oembed.json';
                 $base_url += '//streamable.com/' + $id;
                 $thumb = protocol + '//cdn.streamable.com/image/' + $id + '.jpg';
                 $embed_url += '//streamable.com/e/' + $id
@@ -112,7 +126,6 @@ jQuery(document).ready(function($) {
 
             case "DailymotionBackend":
                 $author = "Dailymotion";
-                $api = 'https://www.dailymotion.com/services/oembed';
                 $base_url += '//dailymotion.com/video/' + $id;
                 $embed_url += '//www.dailymotion.com/embed/video/' + $id
                     + '?autoplay=true&endscreen-enable=false&quality=380'
@@ -121,7 +134,6 @@ jQuery(document).ready(function($) {
 
             case "GfycatBackend":
                 $author = "Gfycat";
-                $api = 'https://api.gfycat.com/v1/oembed';
                 $base_url += '//gfycat.com/' + $id;
                 $thumb = protocol + '//thumbs.gfycat.com/' + $id + '-poster.jpg';
                 $player = "video";
@@ -151,116 +163,93 @@ jQuery(document).ready(function($) {
         } else {
             $(obj).find("span.media_author").html($author);
             $(obj).find("span.media_title").html($title);
-            
-            $.ajax({
-                method: "GET",
-                url: $api,
-                data: {
-                    url: $base_url,
-                    maxwidth: maxwidth, // Maximum embed width
-                    maxheight: maxheight, // Maximum embed height
-                    format: 'json'
-                },
+
+            // Metadata is requested for every cover together, see generateCovers
+            return {
+                url: $(obj).data("url"),
                 success: function (data) {
-                    // Check for successful responses containing errors
-                    if (data['errorMessage'] != undefined) {
-                        // Gfycat returns errorMessage upon failure
-                        var error = jQuery.parseJSON(data['errorMessage']);
-                        ajaxError(obj, $id, $base_url, error['code']);
-                    } else if (data['type'] === undefined) {
-                        // Dailymotion does not always return data upon failure.
-                        // `Type` is a required property for oEmbed compliance,
-                        // thus it must exist within valid responses.
-                        ajaxError(obj, $id, $base_url, "Invalid Video Url");
+                    if (data === undefined || data['error'] != undefined) {
+                        ajaxError(obj, $id, $base_url,
+                            data === undefined ? "Invalid Video Url" : data['error']);
+                        return;
+                    }
+
+                    if ($expand && data['height'] != undefined) {
+                        $height = Math.max(data['height'], minheight);
+                    }
+                    if (data['width'] != undefined) {
+                        $width = Math.max(data['width'], minwidth);
+                    }
+                    if (data['title'] != undefined && data['title'] != '') {
+                        $title = data['title'];
                     } else {
-                        if ($expand && data['height'] != undefined) {
-                            $height = Math.max(data['height'], minheight);
-                        }
-                        if (data['width'] != undefined) {
-                            $width = Math.max(data['width'], minwidth);
-                        }
-                        if (data['title'] != undefined && data['title'] != '') {
-                            $title = data['title'];
-                        } else {
-                            $title = "Untitled";
-                        }
-                        if (data['author_name'] != undefined && data['author_name'] != '') {
-                            $author = data['author_name'];
-                        }
-
-                        // Find better quality thumbnails for these backends
-                        if ($thumb === undefined) {
-                            var code = null;
-
-                            switch ($embed) {
-                                case "YoutubeBackend":
-                                    $thumb = data['thumbnail_url'];
-                                    break;
-
-                                case "VimeoBackend":
-                                    $thumb = data['thumbnail_url'];
-
-                                    code = /\/\d+_/.exec($thumb);
-                                    if (code != null) {
-                                        $thumb = protocol + "//i.vimeocdn.com/video"
-                                            + code + $width + "x" + $height + ".jpg";
-                                    }
-                                    break;
-
-                                case "SoundCloudBackend":
-                                    $thumb = data['thumbnail_url'];
-
-                                    // Ensure thumbnail url matches request protocol
-                                    $thumb = $thumb.replace(/^http:/i, protocol);
-                                    break;
-
-                                case "DailymotionBackend":
-                                    $thumb = data['thumbnail_url'];
-
-                                    // Do not try and find larger PNG thumbnail
-                                    if (/\.png$/i.test($thumb)) {
-                                        break
-                                    }
-
-                                    code = /\/(\w+)\//.exec($thumb);
-                                    if (code != null) {
-                                        // Different server for secure connection
-                                        if (protocol === 'http:') {
-                                            $thumb = protocol + "//s1.dmcdn.net/"
-                                                + code[1] + ".jpg";
-                                        } else {
-                                            $thumb = protocol + "//s1-ssl.dmcdn.net/"
-                                                + code[1] + ".jpg";
-                                        }
-                                    }
-                                    break;
-
-                                default:
-                                    $thumb = data['thumbnail_url'];
-                                    break;
-                            }
-                        }
-
-                        $(obj).css("height", $height + "px");
-                        $(obj).find("span.media_title").html($title);
-                        $(obj).find("span.media_author").html($author);
-                        $(obj).find("div.media_cover").css("background-image",
-                            "url(" + $thumb + ")");
-
-                        // When clicked replace thumbnail cover with IFrame embed
-                        $(obj).click(function () {
-                            $(this).replaceWith(generateEmbed($width, $height, $embed_url, $expand, $player));
-                        });
+                        $title = "Untitled";
+                    }
+                    if (data['author_name'] != undefined && data['author_name'] != '') {
+                        $author = data['author_name'];
+                    }
+
+                    // The server has already chosen the best thumbnail
+                    if ($thumb === undefined && data['thumbnail_url']) {
+                        // Ensure thumbnail url matches request protocol
+                        $thumb = data['thumbnail_url'].replace(/^http:/i, protocol);
                     }
+
+                    $(obj).css("height", $height + "px");
+                    $(obj).find("span.media_title").html($title);
+                    $(obj).find("span.media_author").html($author);
+                    $(obj).find("div.media_cover").css("background-image",
+                        "url(" + $thumb + ")");
+
+                    // When clicked replace thumbnail cover with IFrame embed
+                    $(obj).click(function () {
+                        $(this).replaceWith(generateEmbed($width, $height, $embed_url, $expand, $player));
+                    });
                 },
-                error: function (e) {
-                    // Data return failure
-                    ajaxError(obj, $id, $base_url, e.statusText)
+                error: function (message) {
+                    ajaxError(obj, $id, $base_url, message);
                 }
-            });
+            };
         }
     }
 
+    // Generate covers for several media embeds, requesting the metadata of
+    // all of them from the server in a single request
+    function generateCovers(objs, protocol) {
+        var $covers = [];
+
+        $(objs).each(function () {
+            var $cover = generateCover($(this), protocol);
+            if ($cover) {
+                $covers.push($cover);
+            }
+        });
+
+        if ($covers.length === 0) {
+            return;
+        }
+
+        $.ajax({
+            method: "GET",
+            url: $("body").data("embeds"),
+            traditional: true,
+            data: {
+                url: $covers.map(function (cover) { return cover.url; })
+            },
+            success: function (data) {
+                $covers.forEach(function (cover) {
+                    cover.success(data[cover.url]);
+                });
+            },
+            error: function (e) {
+                // Data return failure
+                $covers.forEach(function (cover) {
+                    cover.error(e.statusText);
+                });
+            }
+        });
+    }
+
     // Build video embed DOM
     function generateEmbed(width, height, embed_url, expand, player) {
         var $aspect_ratio = height / width * 100; // Embed aspect ratio